@@ -59,9 +59,9 @@ You can use following guidelines to figure out what changes needs to be made to
 - You must pay close attention to past wrong fixes provided to you. These fixes were made earlier and didn't lead to a successful build. Do not attempt to make these fixes again.
 - It's useful to look at the target that's failing in the error message and then map it to corresponding target definition in the BUILD.bazel file.
 - Use `get_diff` tool to see what has changed for {commit_sha}. If you are not able to use this tool, it's futile to move ahead. You should just give up at that point.
-- From the diff obtained above and given error message, figure out what could have caused the build error and what changes needs to be made to fix the build. If you need more context, you can use `read_file` tool to inspect any files in the repository you like. 
+- From the diff obtained above and given error message, figure out what could have caused the build error and what changes needs to be made to fix the build. If you need more context, you can use `read_file` tool to inspect any files in the repository you like. Large files are returned in chunks; prefer `grep_file` to find the lines you need, e.g. a target name in a BUILD.bazel file, and then `read_file` with `start_line` and `end_line` to read just that range. 
 - Once you have a potential fix, you can use `search_and_replace` tool to modify any file on the disk. Make sure you pass exact text you want to replace, otherwise, this wouldn't succeed. 
-- You can read the directory structure of utils/bazel/llvm-project-overlay/ using `directory_structure` tool if needed.
+- You can read the directory structure of utils/bazel/llvm-project-overlay/ using `directory_structure` tool if needed. It lists two levels by default; pass `max_depth` to go deeper and `pattern` (e.g. "BUILD.bazel") to only list matching files.
 - Try to make minimal set of changes necessary to fix the build.
 
 ## Common pitfalls
@@ -111,6 +111,9 @@ class BazelFixerAgent(BaseAgent):  # pytype: disable=wrong-arg-types
             ),
         )
         for i in range(self.max_iterations):
+            if self.cmd_processor.cancelled.is_set():
+                self.logger_agent.info("Fix attempt cancelled. Exiting fix loop.")
+                return
             is_last_attempt = i == self.max_iterations - 1
             yield Event(
                 author=self.name,
@@ -120,11 +123,19 @@ class BazelFixerAgent(BaseAgent):  # pytype: disable=wrong-arg-types
             )
 
             self.logger_agent.info(f"Build Failed. Delegating to Code Fixer...")
-            fix_request = [
-                "The Bazel build failed with the following error:",
-                "<STDERR>" f"{build_result.stderr}" "</STDERR>",
-                "<STDOUT>" f"{build_result.stdout}" "</STDOUT>",
-            ]
+            # Only send the error digest when there is one, the full build log
+            # can be many megabytes.
+            if build_result.error_digest:
+                fix_request = [
+                    "The Bazel build failed with the following errors:",
+                    "<ERRORS>" f"{build_result.error_digest}" "</ERRORS>",
+                ]
+            else:
+                fix_request = [
+                    "The Bazel build failed with the following error:",
+                    "<STDERR>" f"{build_result.stderr}" "</STDERR>",
+                    "<STDOUT>" f"{build_result.stdout}" "</STDOUT>",
+                ]
             if i == 0:
                 fix_request.append("Please fix this issue.")
             elif is_last_attempt:
@@ -204,6 +215,7 @@ async def query_agent(
     cmd_processor: utils.CommandProcessor,
     past_fixes: list[str],
     github_token: str,
+    log_id: str | None = None,
 ) -> AgentResult:
     """
     A self-contained method to invoke the BazelFixerAgent from external modules.
@@ -211,11 +223,12 @@ async def query_agent(
         commit_sha: The Git SHA of the commit to fix/analyze.
         cmd_processor: The CommandProcessor instance for running commands.
         past_fixes: list of incorrect past fixes that agent made.
+        log_id: Tells apart the logs of attempts that run at the same time.
 
     Returns:
         AgentResult: Dataclass containing status and summary.
     """
-    logging_id = commit_sha
+    logging_id = commit_sha if log_id is None else f"{commit_sha}.{log_id}"
     logger_agent = logging.getLogger(logging_id)
     logger_agent.setLevel(logging.INFO)
     if not logger_agent.handlers:
@@ -236,8 +249,11 @@ async def query_agent(
         instruction=CODE_FIXER_PROMPT,
         tools=[
             tools.read_file,
+            tools.grep_file,
             tools.search_and_replace,
-            tools.get_diff_tool(github_token),
+            tools.get_diff_tool(
+                github_token, cmd_processor.repo_path, cmd_processor.diff_cache_dir
+            ),
             tools.directory_structure,
         ],
         generate_content_config=types.GenerateContentConfig(
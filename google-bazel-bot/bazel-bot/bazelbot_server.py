@@ -1,7 +1,11 @@
 import asyncio
+import collections
+import concurrent.futures
 import dataclasses
 import enum
 import logging
+import os
+import threading
 import time
 from collections.abc import Sequence
 
@@ -15,6 +19,9 @@ logger = logging.getLogger(__name__)
 # while we start fresh everytime.
 MAX_AGENT_ITERATIONS = 3
 
+# Number of local build results to remember. Bisecting a range needs far fewer.
+MAX_CACHED_BUILD_INFOS = 256
+
 # When agent returns resource exhausted, number of times we retry before giving up.
 MAX_AGENT_RESOURCE_EXHAUSTED_TRIES = 3
 
@@ -43,6 +50,9 @@ class BazelRepairBot:
         creds: utils.CredentialManager,
         build_processor: utils.BuildProcessor,
         poll_interval,
+        bisect_builds: bool = False,
+        parallel_ai_attempts: int = 0,
+        trigger: utils.TriggerServer | None = None,
     ):
         # Injectables
         self.command_processor = command_processor
@@ -55,11 +65,33 @@ class BazelRepairBot:
         self.last_processed_state: utils.BuildState = utils.BuildState.UNKNOWN
         self.last_processed_sha: str = ""
         self.poll_interval = poll_interval
+        self.bisect_builds = bisect_builds
+        # When set, bant and this many AI agent attempts run at the same time,
+        # each in its own worktree, instead of one after another.
+        self.parallel_ai_attempts = parallel_ai_attempts
+        self.worktree_lock = threading.Lock()
+        # When set, the bot wakes up on push notifications instead of only
+        # polling every poll_interval seconds.
+        self.trigger = trigger
+        # Attempts still running after another one fixed the build.
+        self.pending_fix_attempts: set[concurrent.futures.Future] = set()
+        # Local build results by commit, so a commit is never built twice while
+        # bisecting.
+        self.build_info_cache: collections.OrderedDict[str, utils.BuildInfo] = (
+            collections.OrderedDict()
+        )
 
     def wait(self, seconds):
         """Sleeps for a given number of seconds"""
         time.sleep(seconds)
 
+    def wait_for_new_commits(self) -> None:
+        """Sleeps until the next poll, or until notified of a push."""
+        if self.trigger is None:
+            self.wait(self.poll_interval)
+        elif self.trigger.wait(self.poll_interval):
+            logger.info("Woken up by push notification.")
+
     def process_failure_with_bant(self, build_data: utils.BuildInfo) -> bool:
         self.git_repo.create_branch_for_fix(build_data.commit)
         if not self.command_processor.run_bant(targets=build_data.failed_targets):
@@ -83,7 +115,9 @@ class BazelRepairBot:
             return False
 
         record = RepairSummaryRecord(build.commit, "", time.time())
-        if self.process_failure_with_bant(build):
+        if self.parallel_ai_attempts:
+            record.fixed_by = self.process_failure_in_worktrees(build)
+        elif self.process_failure_with_bant(build):
             logger.info(f"Successfully repaired build for {build.commit}) using bant.")
             record.fixed_by = FixTool.BANT
         elif self.process_failure_with_ai(build):
@@ -96,29 +130,41 @@ class BazelRepairBot:
 
         return record.fixed_by != FixTool.NOT_FIXED
 
-    def run_buildifier_on_changed_files(self) -> bool:
-        repo = self.git_repo.repo
+    def run_buildifier_on_changed_files(
+        self,
+        git_repo: utils.LocalGitRepo | utils.GitWorktree | None = None,
+        command_processor: utils.CommandProcessor | None = None,
+    ) -> bool:
+        git_repo = git_repo or self.git_repo
+        command_processor = command_processor or self.command_processor
+        repo = git_repo.repo
         changed_files = repo.git.diff(name_only=True).splitlines()
         changed_files.extend(repo.untracked_files)
-        return self.command_processor.run_buildifier(files=changed_files)
+        return command_processor.run_buildifier(files=changed_files)
 
-    def validate_before_publishing(self) -> bool:
-        if not self.git_repo.is_repo_dirty(untracked_files=True):
+    def validate_before_publishing(
+        self,
+        git_repo: utils.LocalGitRepo | utils.GitWorktree | None = None,
+        command_processor: utils.CommandProcessor | None = None,
+    ) -> bool:
+        git_repo = git_repo or self.git_repo
+        command_processor = command_processor or self.command_processor
+        if not git_repo.is_repo_dirty(untracked_files=True):
             logger.info("validate: no changes detected.")
             return False
 
-        bazel_build = self.command_processor.run_bazel_build()
+        bazel_build = command_processor.run_bazel_build()
         if not bazel_build.success:
             logger.info("validate: build fails.")
             logger.info(bazel_build.stderr)
             return False
 
-        if not self.run_buildifier_on_changed_files():
+        if not self.run_buildifier_on_changed_files(git_repo, command_processor):
             logger.info("validate: buildifier failed.")
             return False
 
         # Check bazel build again after running buildifier
-        bazel_build = self.command_processor.run_bazel_build()
+        bazel_build = command_processor.run_bazel_build()
         if not bazel_build.success:
             logger.info("validate: build fails after buildifier.")
             logger.info(bazel_build.stderr)
@@ -204,6 +250,144 @@ class BazelRepairBot:
 
         return True
 
+    def try_bant_fix_in_worktree(
+        self,
+        build_data: utils.BuildInfo,
+        worktree: utils.GitWorktree,
+        command_processor: utils.CommandProcessor,
+    ) -> bool:
+        if not command_processor.run_bant(targets=build_data.failed_targets):
+            logger.warning("Running bant failed.")
+            return False
+        return self.validate_before_publishing(worktree, command_processor)
+
+    def try_ai_fix_in_worktree(
+        self,
+        build_data: utils.BuildInfo,
+        worktree: utils.GitWorktree,
+        command_processor: utils.CommandProcessor,
+    ) -> bool:
+        agent_result = asyncio.run(
+            bazel_agent.query_agent(
+                commit_sha=build_data.commit,
+                cmd_processor=command_processor,
+                past_fixes=[],
+                github_token=self.git_repo.fork_github_integration.get_access_token(
+                    self.git_repo.gh_fork_installation.id
+                ),
+                log_id=os.path.basename(worktree.repo_path),
+            )
+        )
+        logger.info(f"AI Agent attempt in {worktree.repo_path} summary")
+        logger.info(agent_result.summary)
+        if agent_result.status != bazel_agent.AgentErrors.SUCCESS:
+            return False
+        return self.validate_before_publishing(worktree, command_processor)
+
+    def run_fix_candidate(
+        self,
+        build_data: utils.BuildInfo,
+        worktree: utils.GitWorktree,
+        command_processor: utils.CommandProcessor,
+        try_fix,
+    ) -> str | None:
+        """
+        Runs a fix attempt in its own worktree.
+
+        Returns:
+            The validated fix as a patch, or None if the attempt failed.
+        """
+        try:
+            if try_fix(build_data, worktree, command_processor):
+                return worktree.get_patch()
+        except Exception:
+            logger.exception(f"Fix attempt in {worktree.repo_path} failed.")
+        finally:
+            with self.worktree_lock:
+                worktree.remove()
+        return None
+
+    def process_failure_in_worktrees(self, build_data: utils.BuildInfo) -> FixTool:
+        """
+        Tries bant and several AI agent fixes at once, each in its own worktree.
+
+        The first candidate that passes validation is applied to the fix branch
+        and published. The other candidates are cancelled.
+
+        Returns:
+            The tool that fixed the build, or FixTool.NOT_FIXED.
+        """
+        candidates = [(FixTool.BANT, self.try_bant_fix_in_worktree)] + [
+            (FixTool.AI, self.try_ai_fix_in_worktree)
+        ] * self.parallel_ai_attempts
+
+        # Let attempts left over from the previous failure finish, so at most one
+        # set of attempts runs at a time.
+        concurrent.futures.wait(self.pending_fix_attempts)
+        self.pending_fix_attempts.clear()
+
+        # Push an empty branch to indicate that a fix is in progress
+        self.git_repo.create_branch_for_fix(build_data.commit)
+        self.git_repo.commit(
+            f"AI is working on fixing build for {build_data.commit[:7]}. Check back later!"
+        )
+        self.git_repo.push_fix(build_data.commit, False)
+
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(candidates))
+        futures = {}
+        command_processors = {}
+        with self.worktree_lock:
+            for i, (fix_tool, try_fix) in enumerate(candidates):
+                worktree = self.git_repo.create_worktree(
+                    build_data.commit, f"{build_data.commit[:7]}-{i}-{fix_tool.value}"
+                )
+                command_processor = self.command_processor.for_checkout(
+                    worktree.repo_path,
+                    os.path.join(
+                        self.command_processor.log_dir,
+                        os.path.basename(worktree.repo_path),
+                    ),
+                )
+                future = executor.submit(
+                    self.run_fix_candidate,
+                    build_data,
+                    worktree,
+                    command_processor,
+                    try_fix,
+                )
+                futures[future] = fix_tool
+                command_processors[future] = command_processor
+
+        fixed_by, patch = FixTool.NOT_FIXED, None
+        for future in concurrent.futures.as_completed(futures):
+            patch = future.result()
+            if patch is not None:
+                fixed_by = futures[future]
+                logger.info(f"Candidate fix from {fixed_by.value} passed validation.")
+                break
+        # Stop the remaining candidates, but don't wait for them, they clean up
+        # after themselves.
+        executor.shutdown(wait=False)
+        self.pending_fix_attempts = {future for future in futures if not future.done()}
+        for future in self.pending_fix_attempts:
+            command_processors[future].cancel()
+
+        self.git_repo.create_branch_for_fix(build_data.commit)
+        if fixed_by == FixTool.NOT_FIXED:
+            self.git_repo.commit(
+                f"AI failed to fix the build for {build_data.commit[:7]}. You "
+                "will need to fix it manually"
+            )
+            self.git_repo.push_fix(build_data.commit, False)
+            return FixTool.NOT_FIXED
+
+        self.git_repo.apply_patch(patch)
+        self.git_repo.commit(f"[Bazel] Fix build for {build_data.commit[:7]}")
+        if not self.git_repo.push_fix(build_data.commit, self.git_repo.can_create_pr):
+            logger.warning(f"Failed to publish fix for commit: {build_data.commit}")
+            return FixTool.NOT_FIXED
+        return fixed_by
+
     def set_state_from_latest_build(self) -> bool:
         logger.info("Initializing state with the latest build.")
         latest_build = self.build_processor.get_latest_build_status()
@@ -215,18 +399,91 @@ class BazelRepairBot:
         logger.error("Could not init state from latest build.")
         return False
 
-    def get_build_info_for_commit(self, commit_sha: str) -> utils.BuildInfo | None:
+    def get_build_info_for_commit(
+        self, commit_sha: str, passing_sha: str | None = None
+    ) -> utils.BuildInfo | None:
+        if commit_sha in self.build_info_cache:
+            logger.info(f"Using cached build state for commit {commit_sha}.")
+            self.build_info_cache.move_to_end(commit_sha)
+            return self.build_info_cache[commit_sha]
+
         logger.info(f"Finding build state for commit {commit_sha} locally ...")
         current_build = utils.BuildInfo(commit=commit_sha)
         self.git_repo.checkout_commit(commit_sha)
-        build_result = self.command_processor.run_bazel_build()
+        targets = self.build_processor.get_targets_to_build(commit_sha, passing_sha)
+        build_result = self.command_processor.run_bazel_build(targets=targets)
         current_build.state = (
             utils.BuildState.PASSED if build_result.success else utils.BuildState.FAILED
         )
         if not build_result.success:
-            current_build.failed_targets = utils.parse_targets(build_result.stderr)
+            current_build.failed_targets = build_result.failed_targets
+        self.build_info_cache[commit_sha] = current_build
+        if len(self.build_info_cache) > MAX_CACHED_BUILD_INFOS:
+            self.build_info_cache.popitem(last=False)
         return current_build
 
+    def get_last_passing_sha(self) -> str | None:
+        """Returns the last processed commit if its build passed."""
+        if self.last_processed_state == utils.BuildState.PASSED:
+            return self.last_processed_sha
+        return None
+
+    def triage_builds(
+        self, builds: Sequence[utils.BuildInfo]
+    ) -> Sequence[utils.BuildInfo]:
+        """
+        Reduces a range of unbuilt commits to the builds that matter.
+
+        The newest commit is built first. If it fails after a passing build,
+        the range is bisected to find the first failing commit in O(log n)
+        builds, instead of building every commit in order.
+
+        Args:
+            builds: Builds to process, oldest first.
+
+        Returns:
+            The builds to process in order, with known states.
+        """
+        if len(builds) < 2 or any(
+            build.state != utils.BuildState.UNKNOWN for build in builds
+        ):
+            return builds
+
+        passing_sha = self.get_last_passing_sha()
+        newest_build = self.get_build_info_for_commit(builds[-1].commit, passing_sha)
+        if (
+            newest_build.state != utils.BuildState.FAILED
+            or self.last_processed_state != utils.BuildState.PASSED
+        ):
+            logger.info(
+                f"Triage: newest build {newest_build.commit} is '{newest_build.state}'. "
+                f"Skipping {len(builds) - 1} intermediate builds."
+            )
+            return [newest_build]
+
+        # Invariant: builds[last_passed] passes (-1 being the last processed
+        # build) and builds[first_failed] fails.
+        last_passed, first_failed = -1, len(builds) - 1
+        while first_failed - last_passed > 1:
+            middle = (last_passed + first_failed) // 2
+            middle_build = self.get_build_info_for_commit(
+                builds[middle].commit, passing_sha
+            )
+            if middle_build.state == utils.BuildState.PASSED:
+                last_passed = middle
+                passing_sha = middle_build.commit
+            else:
+                first_failed = middle
+
+        first_failed_build = self.get_build_info_for_commit(builds[first_failed].commit)
+        logger.info(
+            f"Triage: first failing build is {first_failed_build.commit} "
+            f"({first_failed + 1} of {len(builds)})."
+        )
+        if first_failed_build is newest_build:
+            return [newest_build]
+        return [first_failed_build, newest_build]
+
     def run(self) -> None:
         while True:
             # On first run (or state reset), initialize with the latest build number.
@@ -239,16 +496,20 @@ class BazelRepairBot:
             ] = self.build_processor.get_builds_to_process(self.last_processed_sha)
             if not builds_to_process:
                 logger.debug("No new builds to process. Sleeping ...")
-                self.wait(self.poll_interval)
+                self.wait_for_new_commits()
                 continue
 
             logger.info(f"Found {len(builds_to_process)} new builds to process.")
+            if self.bisect_builds:
+                builds_to_process = self.triage_builds(builds_to_process)
             for build in builds_to_process:
                 if not build:
                     continue
 
                 current_build = (
-                    self.get_build_info_for_commit(build.commit)
+                    self.get_build_info_for_commit(
+                        build.commit, self.get_last_passing_sha()
+                    )
                     if build.state == utils.BuildState.UNKNOWN
                     else build
                 )
@@ -292,4 +553,5 @@ class BazelRepairBot:
                 self.last_processed_state = current_build.state
                 self.last_processed_sha = current_build.commit
 
-            self.wait(self.poll_interval)
+            # Pushes that arrived while processing wake the bot right away.
+            self.wait_for_new_commits()
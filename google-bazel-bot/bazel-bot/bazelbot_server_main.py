@@ -1,5 +1,6 @@
 import argparse
 import logging
+import os
 import sys
 
 import bazelbot_server
@@ -14,6 +15,57 @@ parser.add_argument("--create_prs", action="store_true", help="Whether to create
 parser.add_argument(
     "--log_level", default="INFO", help="Set the logging level -- WARNING, INFO, DEBUG"
 )
+parser.add_argument(
+    "--bisect_builds",
+    action="store_true",
+    help="Build the newest commit first and bisect to the first failing commit.",
+)
+parser.add_argument(
+    "--build_cache_dir",
+    type=str,
+    help="Directory to cache build results in, keyed by a hash of the build inputs.",
+)
+parser.add_argument(
+    "--diff_cache_dir",
+    type=str,
+    help="Directory to cache the commit diffs the agent reads in. Defaults to "
+    "diffs/ in --build_cache_dir, if set.",
+)
+parser.add_argument(
+    "--targeted_builds",
+    action="store_true",
+    help="Only build targets affected by changes since the last passing commit.",
+)
+parser.add_argument(
+    "--full_build_interval",
+    type=int,
+    help="With --targeted_builds, do a full build every this many builds.",
+    default=10,
+)
+parser.add_argument(
+    "--parallel_ai_attempts",
+    type=int,
+    help="Run bant and this many AI fix attempts at once, each in its own worktree.",
+    default=0,
+)
+parser.add_argument(
+    "--bazel_disk_cache",
+    type=str,
+    help="Bazel disk cache directory shared by all builds.",
+)
+parser.add_argument(
+    "--bazel_remote_cache",
+    type=str,
+    help="Bazel remote cache endpoint, e.g. http://localhost:9090 for a local "
+    "bazel-remote instance.",
+)
+parser.add_argument(
+    "--trigger_port",
+    type=int,
+    help="Listen for push notifications on this port and check for new commits "
+    "as soon as one arrives. Requests must carry the token in the "
+    "BAZELBOT_TRIGGER_TOKEN environment variable, if set.",
+)
 parser.add_argument(
     "--test_commits", type=str, help="File path containing commits to test."
 )
@@ -45,19 +97,44 @@ if __name__ == "__main__":
         handlers=[logging.FileHandler("bot.log"), logging.StreamHandler()],
     )
     creds_manager = utils.CredentialManager()
-    cmd_processor = utils.CommandProcessor(args.llvm_git_repo)
+    build_cache = (
+        utils.BuildResultCache(args.build_cache_dir) if args.build_cache_dir else None
+    )
+    diff_cache_dir = args.diff_cache_dir
+    if diff_cache_dir is None and args.build_cache_dir:
+        diff_cache_dir = os.path.join(args.build_cache_dir, "diffs")
+    cmd_processor = utils.CommandProcessor(
+        args.llvm_git_repo,
+        build_cache,
+        disk_cache=args.bazel_disk_cache,
+        remote_cache=args.bazel_remote_cache,
+        # The agent's tools may run in another working directory.
+        diff_cache_dir=os.path.abspath(diff_cache_dir) if diff_cache_dir else None,
+    )
     git_repo = utils.LocalGitRepo(args.llvm_git_repo, creds_manager, args.create_prs)
-    build_processor = utils.LocalBuildProcessor(cmd_processor, git_repo)
+    build_processor = utils.LocalBuildProcessor(
+        cmd_processor, git_repo, args.targeted_builds, args.full_build_interval
+    )
+    trigger = None
+    if args.trigger_port is not None:
+        trigger = utils.TriggerServer(
+            args.trigger_port, os.getenv("BAZELBOT_TRIGGER_TOKEN")
+        )
     bot = bazelbot_server.BazelRepairBot(
         cmd_processor,
         git_repo,
         creds_manager,
         build_processor,
         args.poll_interval,
+        args.bisect_builds,
+        args.parallel_ai_attempts,
+        trigger,
     )
     if args.test_commits:
         test_commits(bot, args.test_commits)
         exit(0)
 
+    if trigger is not None:
+        trigger.start()
     logger.info("Bazel Bot entering main loop...")
     bot.run()
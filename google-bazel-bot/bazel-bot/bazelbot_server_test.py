@@ -1,12 +1,28 @@
+import concurrent.futures
+import json
 import os
+import subprocess
+import tempfile
+import threading
+import time
 import unittest
+import urllib.error
+import urllib.request
 from unittest import mock
 
 import bazel_agent
 import bazelbot_server
+import tools
 import utils
 
 
+def mock_build_process(returncode: int = 0, output: str = "") -> mock.MagicMock:
+    process = mock.MagicMock()
+    process.stdout = iter(output.splitlines(keepends=True))
+    process.wait.return_value = returncode
+    return process
+
+
 class TestBazelBotServer(unittest.TestCase):
     def test_parse_targets(self):
         log = "ERROR: /path/to/BUILD:10:11: (from target //foo:bar)"
@@ -17,6 +33,266 @@ class TestBazelBotServer(unittest.TestCase):
 
         self.assertEqual(utils.parse_targets(None), [])
 
+    def test_build_result_cache(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = utils.BuildResultCache(cache_dir)
+            self.assertIsNone(cache.get("key"))
+
+            cache.put("key", utils.BazelBuildResult(False, "out", "err", 12.5))
+            result = cache.get("key")
+            self.assertEqual(
+                result, utils.BazelBuildResult(False, "out", "err", 12.5, cached=True)
+            )
+
+    def test_build_result_cache_pruning(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = utils.BuildResultCache(cache_dir, max_entries=2, max_age_seconds=60)
+            for age, key in enumerate(["c", "b", "a"]):
+                cache.put(key, utils.BazelBuildResult(True))
+                mtime = time.time() - 30 + age
+                os.utime(cache._get_path(key), (mtime, mtime))
+            # Reading an entry makes it the most recently used one.
+            self.assertIsNotNone(cache.get("a"))
+            cache.put("d", utils.BazelBuildResult(True))
+            self.assertEqual(sorted(os.listdir(cache_dir)), ["a.json", "d.json"])
+
+            old_mtime = time.time() - 120
+            os.utime(cache._get_path("a"), (old_mtime, old_mtime))
+            cache.prune()
+            self.assertEqual(os.listdir(cache_dir), ["d.json"])
+
+    def test_get_bazel_input_hash(self):
+        with tempfile.TemporaryDirectory() as repo_path:
+
+            def commit_file(path, content):
+                os.makedirs(
+                    os.path.join(repo_path, os.path.dirname(path)), exist_ok=True
+                )
+                with open(os.path.join(repo_path, path), "w") as f:
+                    f.write(content)
+                subprocess.run(["git", "add", "."], cwd=repo_path, check=True)
+                subprocess.run(
+                    [
+                        "git",
+                        "-c",
+                        "user.name=a",
+                        "-c",
+                        "user.email=a@b",
+                        "commit",
+                        "-qm",
+                        path,
+                    ],
+                    cwd=repo_path,
+                    check=True,
+                )
+
+            subprocess.run(["git", "init", "-q"], cwd=repo_path, check=True)
+            commit_file("utils/bazel/BUILD.bazel", "a")
+            commit_file("llvm/foo.cpp", "a")
+            cmd_processor = utils.CommandProcessor(repo_path)
+            input_hash = cmd_processor.get_bazel_input_hash()
+            self.assertIsNotNone(input_hash)
+
+            # Paths the overlay doesn't build don't change the hash.
+            commit_file("flang/foo.cpp", "a")
+            self.assertEqual(cmd_processor.get_bazel_input_hash(), input_hash)
+
+            # Uncommitted changes to inputs disable caching.
+            with open(os.path.join(repo_path, "llvm/foo.cpp"), "w") as f:
+                f.write("b")
+            self.assertIsNone(cmd_processor.get_bazel_input_hash())
+
+            commit_file("llvm/foo.cpp", "b")
+            self.assertNotEqual(cmd_processor.get_bazel_input_hash(), input_hash)
+
+    @mock.patch("utils.subprocess.Popen")
+    def test_run_bazel_build_with_cache(self, mock_run):
+        mock_run.side_effect = lambda *args, **kwargs: mock_build_process(0, "built")
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cmd_processor = utils.CommandProcessor(
+                "/path/to/repo", utils.BuildResultCache(cache_dir), cache_dir
+            )
+            cmd_processor.get_bazel_input_hash = mock.MagicMock(return_value="hash1")
+
+            # The first build runs bazel, the second reuses its result.
+            self.assertFalse(cmd_processor.run_bazel_build().cached)
+            result = cmd_processor.run_bazel_build()
+            self.assertTrue(result.cached)
+            self.assertTrue(result.success)
+            self.assertEqual(result.stderr, "built")
+            self.assertEqual(mock_run.call_count, 1)
+
+            # Uncommitted changes to the inputs always require a build.
+            cmd_processor.get_bazel_input_hash.return_value = None
+            self.assertFalse(cmd_processor.run_bazel_build().cached)
+            self.assertEqual(mock_run.call_count, 2)
+
+    @mock.patch("utils.subprocess.Popen")
+    def test_run_bazel_build_caches_failures(self, mock_run):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cmd_processor = utils.CommandProcessor(
+                "/path/to/repo", utils.BuildResultCache(cache_dir), cache_dir
+            )
+            cmd_processor.get_bazel_input_hash = mock.MagicMock(return_value="hash1")
+
+            # Failures without compile or analysis errors may not recur.
+            mock_run.side_effect = lambda *args, **kwargs: mock_build_process(
+                1, "ERROR: remote cache unavailable\n"
+            )
+            self.assertFalse(cmd_processor.run_bazel_build().success)
+            self.assertIsNone(cmd_processor.build_cache.get("hash1"))
+
+            mock_run.side_effect = lambda *args, **kwargs: mock_build_process(
+                1, "llvm/foo.cpp:1:2: error: bad\nERROR: x (from target //llvm:foo)\n"
+            )
+            self.assertFalse(cmd_processor.run_bazel_build().cached)
+            result = cmd_processor.run_bazel_build()
+            self.assertTrue(result.cached)
+            self.assertEqual(result.failed_targets, ["//llvm:foo"])
+            self.assertEqual(mock_run.call_count, 2)
+
+    @mock.patch("utils.os.killpg")
+    @mock.patch("utils.subprocess.Popen")
+    def test_run_bazel_build_cancel(self, mock_run, mock_killpg):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cmd_processor = utils.CommandProcessor(
+                "/path/to/repo", utils.BuildResultCache(cache_dir), cache_dir
+            )
+            cmd_processor.get_bazel_input_hash = mock.MagicMock(return_value="hash1")
+
+            def output():
+                yield "building\n"
+                # Another attempt fixed the build in the meantime.
+                cmd_processor.cancel()
+
+            process = mock_build_process(-9)
+            process.stdout = output()
+            mock_run.return_value = process
+
+            result = cmd_processor.run_bazel_build()
+            self.assertFalse(result.success)
+            self.assertEqual(result.stderr, "Build cancelled")
+            mock_killpg.assert_called_once_with(process.pid, mock.ANY)
+            # Cancelled builds are not cached, and no further builds start.
+            self.assertIsNone(cmd_processor.build_cache.get("hash1"))
+            self.assertFalse(cmd_processor.run_bazel_build().success)
+            self.assertEqual(mock_run.call_count, 1)
+
+    def test_directory_structure(self):
+        with tempfile.TemporaryDirectory() as repo_path:
+            overlay = os.path.join(repo_path, tools.OVERLAY_PATH)
+            os.makedirs(os.path.join(overlay, "llvm/unittests"))
+            os.makedirs(os.path.join(overlay, "clang"))
+            for path in ["llvm/BUILD.bazel", "llvm/config.bzl", "clang/BUILD.bazel"]:
+                open(os.path.join(overlay, path), "w").close()
+
+            self.assertEqual(
+                tools.directory_structure(overlay, max_depth=1),
+                f"{overlay}/\nclang/\nllvm/",
+            )
+            self.assertEqual(
+                tools.directory_structure(overlay, pattern="*.bzl"),
+                f"{overlay}/\nllvm/\n  config.bzl",
+            )
+
+            # New entries are picked up by the cached index.
+            open(os.path.join(overlay, "llvm/unittests/BUILD.bazel"), "w").close()
+            self.assertEqual(
+                tools.directory_structure(
+                    os.path.join(overlay, "llvm"), max_depth=3, pattern="BUILD.bazel"
+                ),
+                f"{overlay}/llvm/\nunittests/\n  BUILD.bazel\nBUILD.bazel",
+            )
+            self.assertIn(
+                "outside", tools.directory_structure(os.path.join(repo_path, "llvm"))
+            )
+
+    def test_read_and_grep_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, "BUILD.bazel")
+            with open(file_path, "w") as f:
+                f.write("".join(f"line {i}\n" for i in range(1, 1501)))
+
+            self.assertEqual(tools.read_file(file_path, 2, 3), "line 2\nline 3\n")
+            content = tools.read_file(file_path)
+            self.assertTrue(content.startswith("line 1\n"))
+            self.assertIn("showing lines 1-1000 of 1500", content)
+            self.assertEqual(tools.read_file(file_path, 1500), "line 1500\n")
+
+            self.assertEqual(
+                tools.grep_file(file_path, r"^line 1[02]$", context_lines=1),
+                "9-line 9\n10:line 10\n11-line 11\n12:line 12\n13-line 13",
+            )
+            self.assertIn("No matches", tools.grep_file(file_path, "foo"))
+            self.assertIn("Invalid pattern", tools.grep_file(file_path, "("))
+
+    @mock.patch("tools.get_github_session")
+    def test_get_diff_tool(self, mock_session):
+        with tempfile.TemporaryDirectory() as repo_path:
+            subprocess.run(["git", "init", "-q"], cwd=repo_path, check=True)
+            with open(os.path.join(repo_path, "foo.txt"), "w") as f:
+                f.write("".join(f"line {i}\n" for i in range(10)))
+            subprocess.run(["git", "add", "."], cwd=repo_path, check=True)
+            subprocess.run(
+                [
+                    "git",
+                    "-c",
+                    "user.name=a",
+                    "-c",
+                    "user.email=a@b",
+                    "commit",
+                    "-qm",
+                    "a",
+                ],
+                cwd=repo_path,
+                check=True,
+            )
+            commit_sha = subprocess.run(
+                ["git", "rev-parse", "HEAD"],
+                cwd=repo_path,
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout.strip()
+            cache_dir = os.path.join(repo_path, ".diff_cache")
+            get_diff = tools.get_diff_tool("token", repo_path, cache_dir)
+
+            diff = get_diff(commit_sha[:7])
+            self.assertIn("+line 9", diff)
+            mock_session.assert_not_called()
+            # The diff is cached under the full SHA.
+            self.assertTrue(
+                os.path.exists(os.path.join(cache_dir, f"{commit_sha}.diff"))
+            )
+            self.assertEqual(
+                tools.get_diff_tool("token", None, cache_dir)(commit_sha), diff
+            )
+
+            # Commits missing from the clone are fetched from GitHub.
+            mock_session.return_value.get.return_value.text = "github diff"
+            self.assertEqual(get_diff("a" * 40), "github diff")
+            self.assertEqual(get_diff("a" * 40), "github diff")
+            self.assertEqual(mock_session.return_value.get.call_count, 1)
+
+        truncated = tools.truncate_diff(diff, max_lines_per_file=5)
+        self.assertEqual(len(truncated.splitlines()), 6)
+        self.assertIn("more lines in this file", truncated)
+
+    def test_diff_cache_eviction(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            diff_cache = tools.DiffCache(cache_dir, max_entries=2)
+            shas = [c * 40 for c in "abc"]
+            for age, commit_sha in enumerate(shas[:2]):
+                diff_cache.put(commit_sha, commit_sha)
+                os.utime(diff_cache._get_path(commit_sha), (age, age))
+            # Reading an entry makes it the most recently used one.
+            self.assertEqual(diff_cache.get(shas[0]), shas[0])
+            diff_cache.put(shas[2], shas[2])
+            self.assertEqual(diff_cache.get(shas[0]), shas[0])
+            self.assertIsNone(diff_cache.get(shas[1]))
+            self.assertEqual(diff_cache.get(shas[2]), shas[2])
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+
     @mock.patch.dict(
         os.environ,
         {
@@ -69,6 +345,18 @@ class TestBazelBotServer(unittest.TestCase):
             "--hard", f"{repo.remote_name}/{repo.main_branch}"
         )
 
+        # Nothing is fetched if upstream hasn't moved.
+        repo.gh_fork_repo.merge_upstream.reset_mock()
+        repo_instance.remotes.origin.fetch.reset_mock()
+        repo_instance.git.ls_remote.return_value = "new_sha\trefs/heads/main"
+        repo_instance.commit.return_value.hexsha = "new_sha"
+        self.assertEqual(repo.refresh_main_branch(), "new_sha")
+        repo.gh_fork_repo.merge_upstream.assert_not_called()
+        repo_instance.remotes.origin.fetch.assert_not_called()
+        repo_instance.git.ls_remote.assert_called_with(
+            utils.LocalGitRepo.UpstreamUrl, "refs/heads/main"
+        )
+
         # Setup mocks for getting open PRs.
         class MockPullRequest:
             def __init__(self):
@@ -93,6 +381,33 @@ class TestBazelBotServer(unittest.TestCase):
         self.assertEqual(mock_prs[0].state, "closed")
         self.assertEqual(mock_prs[1].state, "closed")
 
+    def test_trigger_server(self):
+        trigger = utils.TriggerServer(0, token="secret", host="localhost")
+        trigger.start()
+        self.addCleanup(trigger.stop)
+
+        def post(headers):
+            request = urllib.request.Request(
+                f"http://localhost:{trigger.port}/trigger",
+                data=b"{}",
+                headers=headers,
+                method="POST",
+            )
+            try:
+                with urllib.request.urlopen(request) as response:
+                    return response.status
+            except urllib.error.HTTPError as e:
+                return e.code
+
+        self.assertFalse(trigger.wait(0))
+        self.assertEqual(post({"X-Buildkite-Token": "wrong"}), 403)
+        self.assertFalse(trigger.wait(0))
+        self.assertEqual(post({"X-Buildkite-Token": "secret"}), 202)
+        self.assertTrue(trigger.wait(0))
+        self.assertEqual(post({"Authorization": "Bearer secret"}), 202)
+        self.assertTrue(trigger.wait(0))
+        self.assertFalse(trigger.wait(0))
+
     def test_local_build_processor(self):
         cmd_processor = mock.MagicMock()
         git_repo = mock.MagicMock()
@@ -122,6 +437,241 @@ class TestBazelBotServer(unittest.TestCase):
         self.assertEqual(builds[0].commit, "sha_old")
         self.assertEqual(builds[1].commit, "sha_new")
 
+    def test_get_changed_file_labels(self):
+        with tempfile.TemporaryDirectory() as repo_path:
+            overlay_path = os.path.join(repo_path, utils.CommandProcessor.OverlayPath)
+            for package in ["llvm", "llvm/unittests"]:
+                os.makedirs(os.path.join(overlay_path, package))
+                open(os.path.join(overlay_path, package, "BUILD.bazel"), "w").close()
+            for source in ["llvm/lib/Support/Foo.cpp", "llvm/unittests/Foo.cpp"]:
+                os.makedirs(os.path.join(repo_path, os.path.dirname(source)))
+                open(os.path.join(repo_path, source), "w").close()
+            cmd_processor = utils.CommandProcessor(repo_path)
+
+            self.assertEqual(
+                cmd_processor.get_changed_file_labels(
+                    [
+                        "llvm/lib/Support/Foo.cpp",
+                        "llvm/unittests/Foo.cpp",
+                        "flang/lib/Foo.cpp",
+                        "utils/bazel/llvm-project-overlay/llvm/BUILD.bazel",
+                    ]
+                ),
+                [
+                    "@llvm-project//llvm/unittests:Foo.cpp",
+                    "@llvm-project//llvm:all",
+                    "@llvm-project//llvm:lib/Support/Foo.cpp",
+                ],
+            )
+            self.assertEqual(
+                cmd_processor.get_changed_file_labels(["flang/lib/Foo.cpp"]), []
+            )
+            # Deleted files affect their whole package.
+            self.assertEqual(
+                cmd_processor.get_changed_file_labels(["llvm/unittests/Bar.cpp"]),
+                ["@llvm-project//llvm/unittests:all"],
+            )
+            self.assertIsNone(
+                cmd_processor.get_changed_file_labels(
+                    ["llvm/lib/Foo.cpp", "utils/bazel/MODULE.bazel"]
+                )
+            )
+            self.assertIsNone(
+                cmd_processor.get_changed_file_labels(
+                    ["utils/bazel/llvm-project-overlay/llvm/cc_plugin_library.bzl"]
+                )
+            )
+
+    @mock.patch("utils.subprocess.run")
+    def test_get_affected_targets(self, mock_run):
+        cmd_processor = utils.CommandProcessor("/path/to/repo")
+        cmd_processor.get_changed_files = mock.MagicMock(return_value=[])
+        cmd_processor.get_changed_file_labels = mock.MagicMock(
+            return_value=["@llvm-project//gone:all", "@llvm-project//llvm:all"]
+        )
+
+        # Labels that can't be resolved don't require a full build.
+        mock_run.return_value = subprocess.CompletedProcess(
+            [], 3, "//llvm:foo\n//llvm:bar\n", "no such package 'gone'"
+        )
+        self.assertEqual(
+            cmd_processor.get_affected_targets("sha1", "sha2"),
+            ["//llvm:foo", "//llvm:bar"],
+        )
+        self.assertIn("--keep_going", mock_run.call_args.args[0])
+
+        # Other errors do.
+        mock_run.return_value = subprocess.CompletedProcess([], 2, "", "error")
+        self.assertIsNone(cmd_processor.get_affected_targets("sha1", "sha2"))
+
+    @mock.patch("utils.subprocess.Popen")
+    def test_run_bazel_build_with_targets(self, mock_run):
+        mock_run.return_value = mock_build_process()
+        with tempfile.TemporaryDirectory() as log_dir:
+            cmd_processor = utils.CommandProcessor("/path/to/repo", log_dir=log_dir)
+
+            self.assertTrue(cmd_processor.run_bazel_build(targets=[]).success)
+            mock_run.assert_not_called()
+
+            targets = [f"//foo:bar{i}" for i in range(50000)]
+
+            def run_build(args, env, **kwargs):
+                # The targets are passed in a file, not on the command line.
+                self.assertEqual(args[1:], [])
+                with open(env["BAZEL_TARGET_PATTERN_FILE"]) as f:
+                    self.assertEqual(f.read().split(), targets)
+                return mock_build_process()
+
+            mock_run.side_effect = run_build
+            self.assertTrue(cmd_processor.run_bazel_build(targets=targets).success)
+            mock_run.assert_called_once()
+            self.assertFalse(
+                any(name.endswith(".targets") for name in os.listdir(log_dir))
+            )
+
+    def test_build_error_extractor(self):
+        extractor = utils.BuildErrorExtractor(max_entries=3)
+        log = [
+            "INFO: Analyzed 100 targets",
+            "ERROR: /overlay/llvm/BUILD.bazel:10:11: Compiling llvm/lib/Foo.cpp failed: (Exit 1) (from target @llvm-project//llvm:Support)",
+            "llvm/lib/Foo.cpp:3:10: fatal error: 'llvm/Bar.h' file not found",
+            "llvm/lib/Foo.cpp:3:10: fatal error: 'llvm/Bar.h' file not found",
+            "ERROR: /overlay/llvm/BUILD.bazel:10:11: Compiling llvm/lib/Baz.cpp failed: (Exit 1) (from target @llvm-project//llvm:Support)",
+        ]
+        for line in log:
+            extractor.process_line(line + "\n")
+
+        self.assertEqual(
+            list(extractor.failed_targets), ["@llvm-project//llvm:Support"]
+        )
+        self.assertEqual(
+            extractor.get_digest(),
+            "\n".join(
+                [
+                    "Failed targets:",
+                    "  @llvm-project//llvm:Support",
+                    "Missing dependencies:",
+                    "  fatal error: 'llvm/Bar.h' file not found",
+                    "Compiler errors:",
+                    "  llvm/lib/Foo.cpp:3:10: fatal error: 'llvm/Bar.h' file not found",
+                    "Bazel errors:",
+                    "  " + log[1].removeprefix("ERROR: "),
+                    "  " + log[4].removeprefix("ERROR: "),
+                ]
+            ),
+        )
+
+    @mock.patch("utils.subprocess.Popen")
+    def test_run_bazel_build_streams_log(self, mock_run):
+        output = "".join(f"line {i}\n" for i in range(500))
+        output += "ERROR: Analysis of target '//foo:bar' failed\n"
+        mock_run.return_value = mock_build_process(1, output)
+        with tempfile.TemporaryDirectory() as log_dir:
+            cmd_processor = utils.CommandProcessor("/path/to/repo", log_dir=log_dir)
+            cmd_processor.MaxBuildLogs = 2
+            for _ in range(3):
+                mock_run.return_value = mock_build_process(1, output)
+                result = cmd_processor.run_bazel_build()
+
+            self.assertFalse(result.success)
+            self.assertEqual(result.failed_targets, ["//foo:bar"])
+            self.assertIn("Analysis of target '//foo:bar' failed", result.error_digest)
+            # Only the tail of the log is kept in memory.
+            self.assertEqual(
+                len(result.stderr.splitlines()), cmd_processor.BuildLogTailLines
+            )
+            with open(result.log_path) as f:
+                self.assertEqual(f.read(), output)
+            # Older logs are rotated out.
+            logs = [name for name in os.listdir(log_dir) if name.endswith(".log")]
+            self.assertEqual(len(logs), 2)
+
+    @mock.patch("utils.subprocess.Popen")
+    def test_run_bazel_build_metrics(self, mock_run):
+        events = [
+            {"id": {"started": {}}, "started": {}},
+            {
+                "id": {"buildMetrics": {}},
+                "buildMetrics": {
+                    "actionSummary": {
+                        "actionsCreated": "120",
+                        "actionsExecuted": "100",
+                        "runnerCount": [
+                            {"name": "total", "count": 100},
+                            {"name": "internal", "count": 20},
+                            {"name": "disk cache hit", "count": 30},
+                            {"name": "remote cache hit", "count": 30},
+                            {"name": "linux-sandbox", "count": 20},
+                        ],
+                        "actionCacheStatistics": {"hits": 5, "misses": 95},
+                    },
+                    "timingMetrics": {
+                        "criticalPathTimeInMs": "42500",
+                        "wallTimeInMs": "60000",
+                    },
+                },
+            },
+        ]
+
+        def run_build(args, env, **kwargs):
+            with open(env["BAZEL_BUILD_EVENT_JSON"], "w") as f:
+                f.write("".join(json.dumps(event) + "\n" for event in events))
+            return mock_build_process()
+
+        mock_run.side_effect = run_build
+        with tempfile.TemporaryDirectory() as log_dir:
+            cmd_processor = utils.CommandProcessor(
+                "/path/to/repo", log_dir=log_dir, remote_cache="http://localhost:9090"
+            )
+            result = cmd_processor.run_bazel_build()
+
+            self.assertEqual(
+                mock_run.call_args.kwargs["env"]["BAZEL_REMOTE_CACHE"],
+                "http://localhost:9090",
+            )
+            self.assertEqual(
+                result.metrics,
+                utils.BuildMetrics(
+                    actions_created=120,
+                    actions_executed=100,
+                    disk_cache_hits=30,
+                    remote_cache_hits=30,
+                    action_cache_hits=5,
+                    action_cache_misses=95,
+                    cache_hit_ratio=0.75,
+                    critical_path_seconds=42.5,
+                    wall_time_seconds=60.0,
+                ),
+            )
+            # The build event file is only kept until it is parsed.
+            self.assertFalse(
+                any(name.endswith(".json") for name in os.listdir(log_dir))
+            )
+            with open(os.path.join(log_dir, cmd_processor.BuildMetricsFile)) as f:
+                record = json.loads(f.read())
+            self.assertEqual(record["metrics"]["cache_hit_ratio"], 0.75)
+
+            # Metrics survive the build result cache.
+            cache = utils.BuildResultCache(log_dir)
+            cache.put("key", result)
+            self.assertEqual(cache.get("key").metrics, result.metrics)
+
+    def test_local_build_processor_targeted_builds(self):
+        cmd_processor = mock.MagicMock()
+        cmd_processor.get_affected_targets.return_value = ["//foo:bar"]
+        lbp = utils.LocalBuildProcessor(
+            cmd_processor, mock.MagicMock(), targeted_builds=True, full_build_interval=3
+        )
+
+        # Without a passing commit to compare against, everything is built.
+        self.assertIsNone(lbp.get_targets_to_build("sha2", None))
+        self.assertEqual(lbp.get_targets_to_build("sha2", "sha1"), ["//foo:bar"])
+        cmd_processor.get_affected_targets.assert_called_with("sha1", "sha2")
+        self.assertEqual(lbp.get_targets_to_build("sha3", "sha2"), ["//foo:bar"])
+        # Periodic full build.
+        self.assertIsNone(lbp.get_targets_to_build("sha4", "sha3"))
+        self.assertEqual(lbp.get_targets_to_build("sha5", "sha4"), ["//foo:bar"])
+
     @mock.patch("bazelbot_server.asyncio.run")
     def test_process_failure_with_ai(self, mock_asyncio_run):
         cmd_processor = mock.MagicMock()
@@ -223,6 +773,72 @@ class TestBazelBotServer(unittest.TestCase):
         git_repo.commit.assert_called()
         git_repo.push_fix.assert_called()
 
+    def test_process_failure_in_worktrees(self):
+        cmd_processor = mock.MagicMock()
+        cmd_processor.log_dir = "build_logs"
+        git_repo = mock.MagicMock()
+        git_repo.can_create_pr = True
+        git_repo.push_fix.return_value = True
+        bot = bazelbot_server.BazelRepairBot(
+            cmd_processor,
+            git_repo,
+            mock.MagicMock(),
+            mock.MagicMock(),
+            10,
+            parallel_ai_attempts=2,
+        )
+        build_info = utils.BuildInfo("sha1", utils.BuildState.FAILED, [], 1)
+        worktrees = []
+
+        def create_worktree(commit_hash, name):
+            worktree = mock.MagicMock(repo_path=f"/worktrees/{name}")
+            worktree.get_patch.return_value = f"patch from {name}"
+            worktrees.append(worktree)
+            return worktree
+
+        git_repo.create_worktree.side_effect = create_worktree
+        cancelled = {}
+
+        def for_checkout(repo_path, log_dir):
+            command_processor = mock.MagicMock(repo_path=repo_path)
+            cancelled[repo_path] = threading.Event()
+            command_processor.cancel.side_effect = cancelled[repo_path].set
+            return command_processor
+
+        cmd_processor.for_checkout.side_effect = for_checkout
+        # Only the AI attempts produce a fix, bant runs until it is cancelled.
+        bot.try_bant_fix_in_worktree = mock.MagicMock(
+            side_effect=lambda build_data, worktree, command_processor: not cancelled[
+                worktree.repo_path
+            ].wait(10)
+        )
+        bot.try_ai_fix_in_worktree = mock.MagicMock(return_value=True)
+
+        result = bot.process_failure_in_worktrees(build_info)
+
+        self.assertEqual(result, bazelbot_server.FixTool.AI)
+        self.assertEqual(len(worktrees), 3)
+        self.assertEqual(bot.try_ai_fix_in_worktree.call_count, 2)
+        self.assertIn(
+            git_repo.apply_patch.call_args.args[0],
+            ["patch from sha1-1-ai", "patch from sha1-2-ai"],
+        )
+        git_repo.push_fix.assert_called_with("sha1", True)
+        # The losing attempts are cancelled, and every worktree is cleaned up.
+        self.assertTrue(cancelled["/worktrees/sha1-0-bant"].is_set())
+        concurrent.futures.wait(bot.pending_fix_attempts)
+        for worktree in worktrees:
+            worktree.remove.assert_called_once()
+
+        # No candidate fixes the build.
+        bot.try_bant_fix_in_worktree = mock.MagicMock(return_value=False)
+        bot.try_ai_fix_in_worktree.return_value = False
+        self.assertEqual(
+            bot.process_failure_in_worktrees(build_info),
+            bazelbot_server.FixTool.NOT_FIXED,
+        )
+        git_repo.push_fix.assert_called_with("sha1", False)
+
     def test_validate_before_publishing(self):
         cmd_processor = mock.MagicMock()
         git_repo = mock.MagicMock()
@@ -334,6 +950,88 @@ class TestBazelBotServer(unittest.TestCase):
         # Verify get_builds_to_process was called with initial sha
         build_processor.get_builds_to_process.assert_called_with("init_sha")
 
+    def test_run_waits_for_push_after_processing(self):
+        build_processor = mock.MagicMock()
+        trigger = mock.MagicMock()
+        bot = bazelbot_server.BazelRepairBot(
+            mock.MagicMock(),
+            mock.MagicMock(),
+            mock.MagicMock(),
+            build_processor,
+            10,
+            trigger=trigger,
+        )
+        bot.last_processed_sha = "init_sha"
+        build_processor.get_builds_to_process.return_value = [
+            utils.BuildInfo(commit="sha1", state=utils.BuildState.PASSED)
+        ]
+        bot.wait = mock.MagicMock()
+        trigger.wait.side_effect = StopIteration
+
+        with self.assertRaises(StopIteration):
+            bot.run()
+
+        # A push during processing ends the wait, instead of a full poll.
+        trigger.wait.assert_called_once_with(10)
+        bot.wait.assert_not_called()
+        self.assertEqual(bot.last_processed_sha, "sha1")
+
+    def test_run_logic_with_bisect_builds(self):
+        cmd_processor = mock.MagicMock()
+        git_repo = mock.MagicMock()
+        creds = mock.MagicMock()
+        build_processor = mock.MagicMock()
+
+        bot = bazelbot_server.BazelRepairBot(
+            cmd_processor, git_repo, creds, build_processor, 10, bisect_builds=True
+        )
+        bot.last_processed_sha = "init_sha"
+        bot.last_processed_state = utils.BuildState.PASSED
+
+        # sha5 breaks the build, every later commit stays broken.
+        commits = [f"sha{i}" for i in range(1, 9)]
+        build_processor.get_builds_to_process.return_value = [
+            utils.BuildInfo(commit=commit) for commit in commits
+        ]
+        build_processor.get_targets_to_build.return_value = None
+        built_commits = []
+
+        def run_bazel_build(targets):
+            commit = git_repo.checkout_commit.call_args.args[0]
+            built_commits.append(commit)
+            return utils.BazelBuildResult(success=commits.index(commit) < 4)
+
+        cmd_processor.run_bazel_build.side_effect = run_bazel_build
+        bot.repair_build = mock.MagicMock(return_value=True)
+        bot.wait = mock.MagicMock(side_effect=StopIteration)
+
+        try:
+            bot.run()
+        except StopIteration:
+            pass
+
+        self.assertEqual(built_commits, ["sha8", "sha4", "sha6", "sha5"])
+        bot.repair_build.assert_called_once()
+        self.assertEqual(bot.repair_build.call_args.args[0].commit, "sha5")
+        self.assertEqual(bot.last_processed_sha, "sha8")
+        self.assertEqual(bot.last_processed_state, utils.BuildState.FAILED)
+
+    @mock.patch("bazelbot_server.MAX_CACHED_BUILD_INFOS", 2)
+    def test_build_info_cache(self):
+        cmd_processor = mock.MagicMock()
+        cmd_processor.run_bazel_build.return_value = utils.BazelBuildResult(True)
+        bot = bazelbot_server.BazelRepairBot(
+            cmd_processor, mock.MagicMock(), mock.MagicMock(), mock.MagicMock(), 10
+        )
+
+        for commit in ["sha1", "sha2", "sha1", "sha3"]:
+            bot.get_build_info_for_commit(commit)
+        # The least recently used result is dropped.
+        self.assertEqual(list(bot.build_info_cache), ["sha1", "sha3"])
+        self.assertEqual(cmd_processor.run_bazel_build.call_count, 3)
+        bot.get_build_info_for_commit("sha2")
+        self.assertEqual(cmd_processor.run_bazel_build.call_count, 4)
+
 
 if __name__ == "__main__":
     unittest.main()
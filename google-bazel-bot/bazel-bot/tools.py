@@ -1,63 +1,217 @@
-import json
+import dataclasses
+import fnmatch
 import os
 import pathlib
-from typing import Any
+import re
+import subprocess
+import tempfile
+import threading
 
 import requests
+import requests.adapters
 
 GITHUB_REPO = "llvm/llvm-project"
+OVERLAY_PATH = "utils/bazel/llvm-project-overlay"
 
+# Limits that keep tool output small enough for the agent's prompt.
+MAX_LISTING_ENTRIES = 500
+MAX_READ_LINES = 1000
+MAX_GREP_MATCHES = 50
+MAX_DIFF_LINES_PER_FILE = 400
 
-def path_to_dict(path: pathlib.Path) -> dict[str, Any]:
+MAX_DIFF_CACHE_ENTRIES = 2000
+FULL_SHA_RE = re.compile(r"^[0-9a-f]{40}$")
+
+
+@dataclasses.dataclass
+class DirectoryNode:
+    """A directory in a DirectoryIndex, with its entries as of mtime_ns."""
+
+    mtime_ns: int
+    directories: dict[str, "DirectoryNode"]
+    files: list[str]
+    symlinks: list[str]
+
+
+class DirectoryIndex:
     """
-    Recursively converts a pathlib.Path object into a dictionary.
+    In-memory tree of a directory, so repeated listings don't walk the disk.
+
+    The tree is built once. A directory's entries are re-read only when its
+    mtime changes, which happens whenever an entry is added, removed or renamed.
     """
-    # Base dictionary structure
-    d: dict[str, Any] = {"name": path.name}
-    if path.is_symlink():
-        d["type"] = "symlink"
-        return d
-
-    if path.is_dir():
-        d["type"] = "directory"
-        # Recursively map children; use sorted() for consistent output
-        try:
-            d["children"] = [
-                path_to_dict(child)
-                for child in sorted(path.iterdir(), key=lambda x: (x.is_file(), x.name))
-            ]
-        except PermissionError:
-            d["error"] = "Permission Denied"
-    else:
-        d["type"] = "file"
 
-    return d
+    def __init__(self, root: str):
+        self.root = root
+        self.lock = threading.Lock()
+        self.root_node = self._scan(root)
+
+    def _scan(self, path: str, old: DirectoryNode | None = None) -> DirectoryNode:
+        node = DirectoryNode(os.stat(path).st_mtime_ns, {}, [], [])
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.is_symlink():
+                    node.symlinks.append(entry.name)
+                elif entry.is_dir():
+                    if old is not None and entry.name in old.directories:
+                        # Its own mtime is checked when it is visited.
+                        node.directories[entry.name] = old.directories[entry.name]
+                    else:
+                        node.directories[entry.name] = self._scan(entry.path)
+                else:
+                    node.files.append(entry.name)
+        node.files.sort()
+        node.symlinks.sort()
+        return node
+
+    def _validate(self, path: str, node: DirectoryNode) -> DirectoryNode:
+        if os.stat(path).st_mtime_ns == node.mtime_ns:
+            return node
+        return self._scan(path, node)
+
+    def get_node(self, path: str) -> DirectoryNode | None:
+        """Returns the up-to-date node for path, or None if it is not a directory."""
+        relative = os.path.relpath(path, self.root)
+        if relative.startswith(os.pardir):
+            return None
+        with self.lock:
+            self.root_node = self._validate(self.root, self.root_node)
+            node, node_path = self.root_node, self.root
+            for part in pathlib.Path(relative).parts:
+                if part == os.curdir:
+                    continue
+                child = node.directories.get(part)
+                if child is None:
+                    return None
+                node_path = os.path.join(node_path, part)
+                child = self._validate(node_path, child)
+                node.directories[part] = child
+                node = child
+            return node
+
+    def list(
+        self,
+        path: str,
+        max_depth: int,
+        pattern: str = "",
+        max_entries: int = MAX_LISTING_ENTRIES,
+    ) -> list[str] | None:
+        """
+        Lists a directory as indented lines, directories first.
 
+        Args:
+            path: The directory to list.
+            max_depth: How many levels of subdirectories to descend into.
+            pattern: If not empty, only files matching this glob are listed, along
+                with the directories that contain them.
+            max_entries: The maximum number of lines to return.
 
-def directory_structure(start_path: str) -> str:
+        Returns:
+            The listing, or None if path is not a directory in the index.
+        """
+        node = self.get_node(path)
+        if node is None:
+            return None
+
+        lines: list[str] = []
+
+        def visit(node: DirectoryNode, node_path: str, depth: int) -> bool:
+            # Returns whether anything was listed under node.
+            indent = "  " * depth
+            listed = False
+            for name in sorted(node.directories):
+                if len(lines) >= max_entries:
+                    return listed
+                child_path = os.path.join(node_path, name)
+                with self.lock:
+                    child = node.directories[name] = self._validate(
+                        child_path, node.directories[name]
+                    )
+                lines.append(f"{indent}{name}/")
+                if depth + 1 < max_depth and visit(child, child_path, depth + 1):
+                    listed = True
+                elif pattern:
+                    # Only keep directories that contain matching files.
+                    lines.pop()
+                else:
+                    listed = True
+            for name in node.files + node.symlinks:
+                if len(lines) >= max_entries:
+                    return listed
+                if not pattern or fnmatch.fnmatch(name, pattern):
+                    suffix = "@" if name in node.symlinks else ""
+                    lines.append(f"{indent}{name}{suffix}")
+                    listed = True
+            return listed
+
+        visit(node, path, 0)
+        if len(lines) >= max_entries:
+            lines.append(f"... (truncated at {max_entries} entries)")
+        return lines
+
+
+# Indexes by overlay root, shared by all agent sessions in the process.
+_directory_indexes: dict[str, DirectoryIndex] = {}
+_directory_indexes_lock = threading.Lock()
+
+
+def get_directory_index(path: str) -> DirectoryIndex:
+    """Returns the shared index of the overlay directory that contains path."""
+    prefix, _, _ = path.partition(OVERLAY_PATH)
+    root = os.path.join(prefix, OVERLAY_PATH)
+    with _directory_indexes_lock:
+        if root not in _directory_indexes:
+            _directory_indexes[root] = DirectoryIndex(root)
+        return _directory_indexes[root]
+
+
+def directory_structure(start_path: str, max_depth: int = 2, pattern: str = "") -> str:
     """
-    Returns directory structure of a given path in JSON format
+    Returns the directory structure of a given path, one entry per line.
+
+    Entries are indented by depth. Directories end with "/" and symlinks
+    with "@".
+
+    Args:
+        start_path: The absolute path of a directory within
+            utils/bazel/llvm-project-overlay.
+        max_depth: How many levels of subdirectories to list.
+        pattern: Optional glob, e.g. "BUILD.bazel" or "*.bzl". If given, only
+            matching files and the directories containing them are listed.
+
+    Returns:
+        The directory listing, or an error message.
     """
-    if not "utils/bazel/llvm-project-overlay" in start_path:
-        return "Cannot return directory structure outside of utils/bazel/llvm-project-overlay"
+    if not OVERLAY_PATH in start_path:
+        return f"Cannot return directory structure outside of {OVERLAY_PATH}"
+
+    path = os.path.abspath(start_path)
+    if not os.path.isdir(path):
+        return "Error: Path does not exist"
 
-    path = pathlib.Path(start_path)
-    if not path.exists():
-        return json.dumps({"error": "Path does not exist"}, indent=4)
+    lines = get_directory_index(path).list(path, max(max_depth, 1), pattern)
+    if lines is None:
+        return "Error: Path does not exist"
+    return "\n".join([f"{path}/", *lines])
 
-    tree_dict = path_to_dict(path)
-    # Fix the root name to be the full path for clarity
-    tree_dict["name"] = str(path)
 
-    return json.dumps(tree_dict, indent=4)
+def _read_text(file_path: str) -> str:
+    with open(file_path, "r", encoding="utf-8") as f:
+        return f.read()
 
 
-def read_file(file_path: str) -> str:
+def read_file(file_path: str, start_line: int = 1, end_line: int = 0) -> str:
     """
     Reads the content of a file from the filesystem.
 
+    Large files are cut off after MAX_READ_LINES lines; use start_line and
+    end_line to read the rest, or grep_file to find the relevant lines.
+
     Args:
         file_path: The absolute path to the file to read.
+        start_line: The first line to read, starting at 1.
+        end_line: The last line to read, inclusive. Reads to the end of the file
+            if 0.
 
     Returns:
         The content of the file as a string, or an error message if reading fails.
@@ -66,8 +220,57 @@ def read_file(file_path: str) -> str:
         if not os.path.exists(file_path):
             return f"Error: File not found at {file_path}"
 
-        with open(file_path, "r", encoding="utf-8") as f:
-            return f.read()
+        lines = _read_text(file_path).splitlines(keepends=True)
+        first = max(start_line, 1)
+        last = min(end_line or len(lines), len(lines), first + MAX_READ_LINES - 1)
+        content = "".join(lines[first - 1 : last])
+        if last < len(lines) and not end_line:
+            content += (
+                f"\n... (showing lines {first}-{last} of {len(lines)}, pass "
+                "start_line to read more)"
+            )
+        return content
+    except Exception as e:
+        return f"Error reading file: {str(e)}"
+
+
+def grep_file(file_path: str, pattern: str, context_lines: int = 2) -> str:
+    """
+    Searches a file for lines matching a regular expression.
+
+    Args:
+        file_path: The absolute path to the file to search.
+        pattern: A Python regular expression, e.g. a target or header name.
+        context_lines: How many lines to show around each match.
+
+    Returns:
+        The matching lines prefixed with their line numbers, or an error message.
+    """
+    try:
+        if not os.path.exists(file_path):
+            return f"Error: File not found at {file_path}"
+
+        regex = re.compile(pattern)
+        lines = _read_text(file_path).splitlines()
+        matches = [i for i, line in enumerate(lines) if regex.search(line)]
+        if not matches:
+            return f"No matches for '{pattern}' in {file_path}"
+
+        output = []
+        shown_until = -1
+        for i in matches[:MAX_GREP_MATCHES]:
+            first = max(i - context_lines, shown_until + 1)
+            if output and first > shown_until + 1:
+                output.append("--")
+            for j in range(first, min(i + context_lines + 1, len(lines))):
+                separator = ":" if j == i or regex.search(lines[j]) else "-"
+                output.append(f"{j + 1}{separator}{lines[j]}")
+                shown_until = j
+        if len(matches) > MAX_GREP_MATCHES:
+            output.append(f"... ({len(matches) - MAX_GREP_MATCHES} more matches)")
+        return "\n".join(output)
+    except re.error as e:
+        return f"Error: Invalid pattern: {e}"
     except Exception as e:
         return f"Error reading file: {str(e)}"
 
@@ -85,13 +288,13 @@ def search_and_replace(file_path: str, old_content: str, new_content: str) -> st
         A success message or an error message.
     """
     file_path = os.path.abspath(file_path)
-    if "utils/bazel/llvm-project-overlay" not in file_path:
-        return "Error: Can only modify files within utils/bazel/llvm-project-overlay directory."
+    if OVERLAY_PATH not in file_path:
+        return f"Error: Can only modify files within {OVERLAY_PATH} directory."
 
     try:
-        content = read_file(file_path)
-        if content.startswith("Error"):
-            return content
+        if not os.path.exists(file_path):
+            return f"Error: File not found at {file_path}"
+        content = _read_text(file_path)
 
         if old_content not in content:
             return f"Error: 'old_content' not found in {file_path}. No changes made."
@@ -106,24 +309,170 @@ def search_and_replace(file_path: str, old_content: str, new_content: str) -> st
         return f"Error modifying file: {str(e)}"
 
 
-def get_diff_tool(github_token: str):
+class DiffCache:
+    """
+    Stores commit diffs on disk, keyed by full commit SHA.
+
+    Diffs of a commit never change, so entries are never invalidated. Only
+    the max_entries most recently used ones are kept.
+    """
+
+    def __init__(self, cache_dir: str, max_entries: int = MAX_DIFF_CACHE_ENTRIES):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+
+    def _get_path(self, commit_sha: str) -> str:
+        return os.path.join(self.cache_dir, f"{commit_sha}.diff")
+
+    def get(self, commit_sha: str) -> str | None:
+        if not FULL_SHA_RE.match(commit_sha):
+            return None
+        try:
+            with open(self._get_path(commit_sha), "r", encoding="utf-8") as f:
+                diff = f.read()
+            # The mtime orders the entries for eviction.
+            os.utime(self._get_path(commit_sha))
+            return diff
+        except FileNotFoundError:
+            return None
+
+    def put(self, commit_sha: str, diff: str) -> None:
+        if not FULL_SHA_RE.match(commit_sha):
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with tempfile.NamedTemporaryFile(
+            "w", encoding="utf-8", dir=self.cache_dir, delete=False
+        ) as f:
+            f.write(diff)
+        os.replace(f.name, self._get_path(commit_sha))
+        self._evict()
+
+    def _evict(self) -> None:
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".diff"):
+                try:
+                    entries.append((entry.stat().st_mtime_ns, entry.path))
+                except FileNotFoundError:
+                    pass
+        entries.sort()
+        for _, path in entries[: max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # Another bot process evicted it first.
+                pass
+
+
+_github_session: requests.Session | None = None
+_github_session_lock = threading.Lock()
+
+
+def get_github_session() -> requests.Session:
+    """Returns a session that reuses connections to the GitHub API."""
+    global _github_session
+    with _github_session_lock:
+        if _github_session is None:
+            _github_session = requests.Session()
+            _github_session.mount(
+                "https://",
+                requests.adapters.HTTPAdapter(
+                    pool_maxsize=8,
+                    max_retries=requests.adapters.Retry(
+                        total=3, backoff_factor=1, status_forcelist=[502, 503, 504]
+                    ),
+                ),
+            )
+        return _github_session
+
+
+def get_local_diff(repo_path: str, commit_sha: str) -> tuple[str, str] | None:
+    """
+    Returns the full SHA and diff of a commit from a local clone.
+
+    Returns:
+        None if the commit is not in the clone.
+    """
+    try:
+        full_sha = subprocess.run(
+            ["git", "rev-parse", "--verify", "--quiet", f"{commit_sha}^{{commit}}"],
+            cwd=repo_path,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+        diff = subprocess.run(
+            ["git", "show", "--format=", "--no-color", "--no-ext-diff", full_sha],
+            cwd=repo_path,
+            capture_output=True,
+            text=True,
+            errors="replace",
+            check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return full_sha, diff
+
+
+def truncate_diff(diff: str, max_lines_per_file: int = MAX_DIFF_LINES_PER_FILE) -> str:
+    """Truncates the diff of each file to at most max_lines_per_file lines."""
+    output = []
+    file_lines = 0
+    skipped = 0
+    for line in diff.splitlines(keepends=True):
+        if line.startswith("diff --git "):
+            if skipped:
+                output.append(f"... ({skipped} more lines in this file)\n")
+            file_lines = skipped = 0
+        if file_lines < max_lines_per_file:
+            output.append(line)
+            file_lines += 1
+        else:
+            skipped += 1
+    if skipped:
+        output.append(f"... ({skipped} more lines in this file)\n")
+    return "".join(output)
+
+
+def get_diff_tool(
+    github_token: str,
+    repo_path: str | None = None,
+    cache_dir: str | None = None,
+):
     """Returns a function containing a tool to get a diff.
 
     Takes in as argument a github token to use when accessing the github API
     and returns a function that can be used as a LLM tool for getting a diff
-    for a specific commit.
+    for a specific commit. Diffs are read from the local clone at repo_path
+    when it has the commit and cached on disk if cache_dir is set, GitHub is
+    only used as a fallback.
 
     Args:
       github_token: The github token the returned tool should use for
         requesting diffs.
+      repo_path: Optional path to a local clone of the repository.
+      cache_dir: Optional directory to cache diffs in.
 
     Returns:
       A function that takes in a commit SHA and returns a string diff.
     """
+    diff_cache = DiffCache(cache_dir) if cache_dir is not None else None
+
+    def get_diff_from_github(commit_sha: str) -> str:
+        url = f"https://api.github.com/repos/{GITHUB_REPO}/commits/{commit_sha}"
+        headers = {
+            "Authorization": f"Bearer {github_token}",
+            "Accept": "application/vnd.github.v3.diff",
+        }
+        response = get_github_session().get(url, headers=headers, timeout=60)
+        response.raise_for_status()
+        return response.text
 
     def get_diff(commit_sha: str) -> str:
         """
-        Retrieves the git diff for a specific commit SHA using the GitHub API.
+        Retrieves the git diff for a specific commit SHA.
+
+        Very long diffs are truncated per file.
 
         Args:
             commit_sha: The SHA hash of the commit to analyze.
@@ -132,14 +481,18 @@ def get_diff_tool(github_token: str):
             The diff of the commit as a string, or an error message.
         """
         try:
-            url = f"https://api.github.com/repos/{GITHUB_REPO}/commits/{commit_sha}"
-            headers = {
-                "Authorization": f"Bearer {github_token}",
-                "Accept": "application/vnd.github.v3.diff",
-            }
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            return response.text
+            commit_sha = commit_sha.strip().lower()
+            diff = diff_cache.get(commit_sha) if diff_cache is not None else None
+            if diff is None and repo_path is not None:
+                local_diff = get_local_diff(repo_path, commit_sha)
+                if local_diff is not None:
+                    commit_sha, diff = local_diff
+                    if diff_cache is not None:
+                        diff_cache.put(commit_sha, diff)
+            if diff is None:
+                diff = get_diff_from_github(commit_sha)
+                diff_cache.put(commit_sha, diff)
+            return truncate_diff(diff)
         except requests.exceptions.RequestException as e:
             return f"Error getting diff from GitHub API: {e}"
         except Exception as e:
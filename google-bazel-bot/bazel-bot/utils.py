@@ -1,10 +1,18 @@
 import abc
+import collections
 import dataclasses
 import enum
+import hashlib
+import hmac
+import http.server
+import json
 import logging
 import os
 import re
+import signal
 import subprocess
+import tempfile
+import threading
 import time
 from collections.abc import Sequence
 
@@ -20,12 +28,227 @@ def parse_targets(error_log: str | None) -> Sequence[str]:
     return re.findall(r"\(from target (.*?)\)", error_log)
 
 
+class BuildErrorExtractor:
+    """
+    Extracts a bounded, deduplicated digest of errors from a bazel build log,
+    one line at a time as the log is streamed.
+    """
+
+    FailedTargetPatterns = (
+        re.compile(r"\(from target (.*?)\)"),
+        re.compile(r"Analysis of target '([^']+)' failed"),
+        re.compile(r"undeclared inclusion\(s\) in rule '([^']+)'"),
+    )
+    MissingDependencyPatterns = (
+        re.compile(r"undeclared inclusion\(s\) in rule .*"),
+        re.compile(r"fatal error: '?([^':]+)'? file not found"),
+        re.compile(r"fatal error: (.+): No such file or directory"),
+        re.compile(r"no such (?:package|target) '[^']+'.*"),
+        re.compile(r"does not depend on a module exporting '[^']+'"),
+    )
+    ErrorLocationPattern = re.compile(
+        r"^(\S+?):(\d+):(?:\d+:)? (?:fatal )?error: (.*)$"
+    )
+    ErrorPattern = re.compile(r"^ERROR: (.*)$")
+
+    def __init__(self, max_entries: int = 20):
+        self.max_entries = max_entries
+        self.failed_targets: dict[str, None] = {}
+        self.missing_dependencies: dict[str, None] = {}
+        self.error_locations: dict[str, None] = {}
+        self.errors: dict[str, None] = {}
+
+    def _add(self, entries: dict[str, None], entry: str) -> None:
+        # Dicts keep insertion order, so they double as ordered sets.
+        if len(entries) < self.max_entries:
+            entries[entry.strip()] = None
+
+    def process_line(self, line: str) -> None:
+        for pattern in self.FailedTargetPatterns:
+            for target in pattern.findall(line):
+                self._add(self.failed_targets, target)
+        for pattern in self.MissingDependencyPatterns:
+            match = pattern.search(line)
+            if match:
+                self._add(self.missing_dependencies, match.group(0))
+        location_match = self.ErrorLocationPattern.match(line)
+        if location_match:
+            self._add(self.error_locations, line)
+        error_match = self.ErrorPattern.match(line)
+        if error_match:
+            self._add(self.errors, error_match.group(1))
+
+    def get_digest(self) -> str:
+        sections = [
+            ("Failed targets", self.failed_targets),
+            ("Missing dependencies", self.missing_dependencies),
+            ("Compiler errors", self.error_locations),
+            ("Bazel errors", self.errors),
+        ]
+        digest = []
+        for title, entries in sections:
+            if entries:
+                digest.append(f"{title}:")
+                digest.extend(f"  {entry}" for entry in entries)
+        return "\n".join(digest)
+
+
+@dataclasses.dataclass
+class BuildMetrics:
+    """Action and cache statistics of a bazel build, from its build events."""
+
+    actions_created: int = 0
+    actions_executed: int = 0
+    # Spawns served from the disk or remote cache instead of being run.
+    disk_cache_hits: int = 0
+    remote_cache_hits: int = 0
+    # Actions skipped entirely because bazel's in-memory action cache was valid.
+    action_cache_hits: int = 0
+    action_cache_misses: int = 0
+    cache_hit_ratio: float = 0.0
+    critical_path_seconds: float = 0.0
+    wall_time_seconds: float = 0.0
+
+
+def parse_build_event_json(bep_path: str) -> BuildMetrics | None:
+    """
+    Extracts build metrics from a file written by --build_event_json_file.
+
+    Returns:
+        The metrics, or None if the file has no BuildMetrics event, e.g.
+        because the build was interrupted.
+    """
+    try:
+        with open(bep_path, "r", encoding="utf-8") as f:
+            for line in f:
+                event = json.loads(line)
+                if "buildMetrics" in event.get("id", {}):
+                    build_metrics = event.get("buildMetrics", {})
+                    break
+            else:
+                return None
+    except (OSError, json.JSONDecodeError) as e:
+        logger.warning(f"Failed to read build events from {bep_path}: {e}")
+        return None
+
+    # int64 fields are serialized as strings in the JSON build event protocol.
+    action_summary = build_metrics.get("actionSummary", {})
+    runner_counts = {
+        runner["name"]: int(runner.get("count", 0))
+        for runner in action_summary.get("runnerCount", [])
+    }
+    action_cache = action_summary.get("actionCacheStatistics", {})
+    timing = build_metrics.get("timingMetrics", {})
+    metrics = BuildMetrics(
+        actions_created=int(action_summary.get("actionsCreated", 0)),
+        actions_executed=int(action_summary.get("actionsExecuted", 0)),
+        disk_cache_hits=runner_counts.get("disk cache hit", 0),
+        remote_cache_hits=runner_counts.get("remote cache hit", 0),
+        action_cache_hits=int(action_cache.get("hits", 0)),
+        action_cache_misses=int(action_cache.get("misses", 0)),
+        critical_path_seconds=int(timing.get("criticalPathTimeInMs", 0)) / 1000,
+        wall_time_seconds=int(timing.get("wallTimeInMs", 0)) / 1000,
+    )
+    # Internal spawns, like symlinking, are never cached.
+    cacheable = runner_counts.get("total", 0) - runner_counts.get("internal", 0)
+    if cacheable > 0:
+        metrics.cache_hit_ratio = (
+            metrics.disk_cache_hits + metrics.remote_cache_hits
+        ) / cacheable
+    return metrics
+
+
+class BuildCancelledError(Exception):
+    """Raised when a build is cancelled with CommandProcessor.cancel()."""
+
+
 @dataclasses.dataclass
 class BazelBuildResult:
     success: bool
     stdout: str = ""
+    # Only the tail of the build log is kept, the full log is at log_path.
     stderr: str = ""
     time_taken: float = 0.0
+    failed_targets: list[str] = dataclasses.field(default_factory=list)
+    # Bounded, deduplicated summary of the errors in the build log.
+    error_digest: str = ""
+    log_path: str = ""
+    # Whether this result was reused from an earlier build with the same inputs.
+    cached: bool = False
+    metrics: BuildMetrics | None = None
+
+
+class BuildResultCache:
+    """
+    Stores bazel build results on disk, keyed by a hash of the build inputs.
+
+    Only the max_entries most recently used results are kept, and none that
+    weren't used for max_age_seconds.
+    """
+
+    MaxEntries = 10000
+    MaxAgeSeconds = 30 * 24 * 3600  # 30 days
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_entries: int = MaxEntries,
+        max_age_seconds: float = MaxAgeSeconds,
+    ):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_age_seconds = max_age_seconds
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _get_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key: str) -> BazelBuildResult | None:
+        try:
+            with open(self._get_path(key), "r") as f:
+                data = json.load(f)
+            # The mtime orders the entries for pruning.
+            os.utime(self._get_path(key))
+        except (OSError, json.JSONDecodeError):
+            return None
+
+        fields = {field.name for field in dataclasses.fields(BazelBuildResult)}
+        result = BazelBuildResult(
+            **{name: value for name, value in data.items() if name in fields}
+        )
+        if result.metrics is not None:
+            result.metrics = BuildMetrics(**result.metrics)
+        result.cached = True
+        return result
+
+    def put(self, key: str, result: BazelBuildResult) -> None:
+        data = dataclasses.asdict(result)
+        data["cached"] = False
+        # Write to a temporary file first so readers never see a partial entry.
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.cache_dir, suffix=".tmp", delete=False
+        ) as f:
+            json.dump(data, f)
+        os.replace(f.name, self._get_path(key))
+        self.prune()
+
+    def prune(self) -> None:
+        """Removes the entries beyond the size and age limits."""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".json"):
+                try:
+                    entries.append((entry.stat().st_mtime, entry.path))
+                except FileNotFoundError:
+                    pass
+        entries.sort(reverse=True)
+        min_mtime = time.time() - self.max_age_seconds
+        for index, (mtime, path) in enumerate(entries):
+            if index >= self.max_entries or mtime < min_mtime:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
 
 
 class CredentialManager:
@@ -49,57 +272,459 @@ class CredentialManager:
 
 class CommandProcessor:
     BazelPath = "utils/bazel"
+    # Paths in llvm-project that the bazel overlay reads. Commits that don't
+    # touch any of these can't change the outcome of a bazel build.
+    BazelInputPaths = (
+        BazelPath,
+        "bolt",
+        "clang",
+        "clang-tools-extra",
+        "cmake",
+        "compiler-rt",
+        "libc",
+        "libunwind",
+        "lld",
+        "lldb",
+        "llvm",
+        "mlir",
+        "third-party",
+    )
 
-    def __init__(self, repo_path: str):
+    OverlayPath = os.path.join(BazelPath, "llvm-project-overlay")
+    BuildTimeoutSeconds = 1800  # 30 minutes
+    BuildLogTailLines = 200
+    MaxBuildLogs = 20
+    BuildMetricsFile = "build_metrics.jsonl"
+    # Exit code of `bazel query --keep_going` when some labels had errors.
+    BazelPartialQueryExitCode = 3
+
+    def __init__(
+        self,
+        repo_path: str,
+        build_cache: BuildResultCache | None = None,
+        log_dir: str = "build_logs",
+        disk_cache: str | None = None,
+        remote_cache: str | None = None,
+        diff_cache_dir: str | None = None,
+    ):
         self.repo_path = repo_path
         self.bazel_path = os.path.join(repo_path, self.BazelPath)
+        self.build_cache = build_cache
+        self.log_dir = log_dir
+        # Bazel disk cache shared by all builds, including those in other
+        # checkouts of the repository.
+        self.disk_cache = disk_cache
+        # Remote cache endpoint, e.g. a local bazel-remote instance.
+        self.remote_cache = remote_cache
+        # Directory the agent's diff tool caches commit diffs in.
+        self.diff_cache_dir = diff_cache_dir
+        # Set once the work in this checkout is no longer needed, see cancel().
+        self.cancelled = threading.Event()
+        self.build_process_lock = threading.Lock()
+        self.build_process: subprocess.Popen | None = None
+
+    def for_checkout(self, repo_path: str, log_dir: str) -> "CommandProcessor":
+        """Returns a processor for another checkout, sharing this one's caches."""
+        return CommandProcessor(
+            repo_path,
+            self.build_cache,
+            log_dir,
+            self.disk_cache,
+            self.remote_cache,
+            self.diff_cache_dir,
+        )
+
+    def cancel(self) -> None:
+        """Kills the running build, and makes any later build fail at once."""
+        self.cancelled.set()
+        with self.build_process_lock:
+            if self.build_process is not None:
+                try:
+                    os.killpg(self.build_process.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+
+    def get_bazel_env(
+        self, bep_path: str | None = None, target_pattern_file: str | None = None
+    ) -> dict[str, str]:
+        env = dict(os.environ)
+        if self.disk_cache:
+            env["BAZEL_DISK_CACHE"] = self.disk_cache
+        if self.remote_cache:
+            env["BAZEL_REMOTE_CACHE"] = self.remote_cache
+        if bep_path:
+            env["BAZEL_BUILD_EVENT_JSON"] = bep_path
+        if target_pattern_file:
+            env["BAZEL_TARGET_PATTERN_FILE"] = target_pattern_file
+        return env
+
+    def record_build_metrics(
+        self, result: BazelBuildResult, targets: Sequence[str] | None
+    ) -> None:
+        """Logs a build's metrics and appends them to the metrics file."""
+        metrics = result.metrics
+        if metrics is not None:
+            logger.info(
+                f"Build metrics: {metrics.actions_executed} actions executed, "
+                f"{metrics.cache_hit_ratio:.1%} cache hits "
+                f"({metrics.disk_cache_hits} disk, {metrics.remote_cache_hits} remote), "
+                f"critical path {metrics.critical_path_seconds:.1f}s."
+            )
+        record = {
+            "timestamp": time.time(),
+            "success": result.success,
+            "time_taken": result.time_taken,
+            "num_targets": None if targets is None else len(targets),
+            "metrics": dataclasses.asdict(metrics) if metrics else None,
+        }
+        with open(os.path.join(self.log_dir, self.BuildMetricsFile), "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def _get_new_build_log_path(self) -> str:
+        """Returns a path for a new build log, removing the oldest logs."""
+        os.makedirs(self.log_dir, exist_ok=True)
+        logs = sorted(
+            os.path.join(self.log_dir, name)
+            for name in os.listdir(self.log_dir)
+            if name.startswith("bazel_build.") and name.endswith(".log")
+        )
+        for old_log in logs[: max(0, len(logs) - self.MaxBuildLogs + 1)]:
+            os.remove(old_log)
+        return os.path.join(self.log_dir, f"bazel_build.{time.time_ns()}.log")
 
     def bazel_build_in_kubernetes(self) -> bool:
         return os.getenv("POD_NAME") is not None
 
-    def run_bazel_build(self) -> BazelBuildResult:
+    def get_bazel_build_file(self) -> str:
+        return "bazel-build-ci" if self.bazel_build_in_kubernetes() else "bazel-build"
+
+    def get_bazel_input_hash(self, targets: Sequence[str] | None = None) -> str | None:
         """
-        Runs the bazel build command in the given repository path for specific targets.
+        Hashes the git tree IDs of all bazel build inputs at HEAD.
+
+        Args:
+            targets: The targets being built, or None for a full build.
 
         Returns:
-            BazelBuildResult containing status, stdout, stderr, and time taken.
+            The hash, or None if any input has uncommitted changes.
         """
         try:
-            bazel_build_file = (
-                "bazel-build-ci" if self.bazel_build_in_kubernetes() else "bazel-build"
+            status = subprocess.run(
+                ["git", "status", "--porcelain", "--", *self.BazelInputPaths],
+                cwd=self.repo_path,
+                capture_output=True,
+                text=True,
+                check=True,
             )
-            base_path = os.path.dirname(os.path.abspath(__file__))
-            bazel_build_path = os.path.join(base_path, bazel_build_file)
+            if status.stdout.strip():
+                return None
 
-            logger.info("Running bazel build...")
-            start_time = time.time()
-            result = subprocess.run(
-                [bazel_build_path],
-                cwd=os.path.join(self.repo_path, self.BazelPath),
+            trees = subprocess.run(
+                ["git", "ls-tree", "HEAD", "--", *self.BazelInputPaths],
+                cwd=self.repo_path,
                 capture_output=True,
                 text=True,
-                timeout=1800,  # 30 minutes
+                check=True,
+            )
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.warning(f"Could not hash bazel build inputs: {e}")
+            return None
+
+        input_hash = hashlib.sha256()
+        input_hash.update(self.get_bazel_build_file().encode())
+        if targets is not None:
+            input_hash.update("\n".join(sorted(targets)).encode())
+        input_hash.update(trees.stdout.encode())
+        return input_hash.hexdigest()
+
+    def get_changed_files(self, base_sha: str, head_sha: str) -> Sequence[str]:
+        """Returns the paths of files changed between two commits."""
+        result = subprocess.run(
+            ["git", "diff", "--name-only", base_sha, head_sha],
+            cwd=self.repo_path,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        return result.stdout.splitlines()
+
+    def get_changed_file_labels(
+        self, changed_files: Sequence[str]
+    ) -> Sequence[str] | None:
+        """
+        Maps changed files to bazel labels in the overlay packages.
+
+        Source files belong to the package of the closest overlay BUILD.bazel in
+        one of their parent directories. A changed overlay BUILD.bazel file
+        affects every target in its package, and so does a deleted source
+        file, which has no label anymore but may have been globbed by any of
+        them.
+
+        Args:
+            changed_files: Paths of changed files, relative to the repository root.
+
+        Returns:
+            The labels of all changed files that are part of an overlay
+            package, or None if a change can affect the whole build.
+        """
+        labels = set()
+        overlay_prefix = self.OverlayPath + "/"
+        for changed_file in changed_files:
+            if changed_file.startswith(overlay_prefix):
+                package, file_name = os.path.split(
+                    changed_file.removeprefix(overlay_prefix)
+                )
+                if file_name != "BUILD.bazel":
+                    # .bzl files and other overlay files can be used by any package.
+                    return None
+                labels.add(f"@llvm-project//{package}:all")
+                continue
+            if changed_file.startswith(self.BazelPath + "/"):
+                # Changes to the bazel workspace itself affect everything.
+                return None
+
+            package = os.path.dirname(changed_file)
+            while package and not os.path.exists(
+                os.path.join(self.repo_path, self.OverlayPath, package, "BUILD.bazel")
+            ):
+                package = os.path.dirname(package)
+            if not package:
+                # Not part of any overlay package, so not built by bazel.
+                continue
+            if not os.path.exists(os.path.join(self.repo_path, changed_file)):
+                labels.add(f"@llvm-project//{package}:all")
+                continue
+            labels.add(
+                f"@llvm-project//{package}:{os.path.relpath(changed_file, package)}"
+            )
+
+        return sorted(labels)
+
+    def get_affected_targets(
+        self, base_sha: str, head_sha: str
+    ) -> Sequence[str] | None:
+        """
+        Finds the bazel targets affected by the changes between two commits.
+
+        The changed files are mapped to labels in the overlay packages, and
+        `bazel query rdeps` finds every target that depends on them. Labels
+        that bazel can't resolve are skipped instead of failing the query.
+        Expects head_sha to be checked out.
+
+        Args:
+            base_sha: The commit to compare against.
+            head_sha: The commit being built.
+
+        Returns:
+            The affected targets, or None if a full build is required.
+        """
+        try:
+            labels = self.get_changed_file_labels(
+                self.get_changed_files(base_sha, head_sha)
+            )
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.warning(f"Could not determine changed files: {e}")
+            return None
+        if not labels:
+            return labels
+
+        # The query can get too long for a single command line argument.
+        with tempfile.NamedTemporaryFile("w", suffix=".query") as query_file:
+            query_file.write(
+                f"kind(rule, rdeps(//... + @llvm-project//..., set({' '.join(labels)})))"
+            )
+            query_file.flush()
+            try:
+                result = subprocess.run(
+                    [
+                        "bazelisk",
+                        "query",
+                        "--lockfile_mode=off",
+                        "--keep_going",
+                        f"--query_file={query_file.name}",
+                        "--output=label",
+                    ],
+                    cwd=os.path.join(self.repo_path, self.BazelPath),
+                    capture_output=True,
+                    text=True,
+                    timeout=600,
+                )
+            except (OSError, subprocess.TimeoutExpired) as e:
+                logger.warning(f"Could not query affected targets: {e}")
+                return None
+
+        if result.returncode == self.BazelPartialQueryExitCode:
+            # E.g. an overlay package that was deleted along with its sources.
+            logger.warning(
+                f"Skipped labels that could not be resolved: {result.stderr}"
             )
+        elif result.returncode != 0:
+            logger.warning(f"Querying affected targets failed: {result.stderr}")
+            return None
+        return result.stdout.split()
+
+    def run_bazel_build(self, targets: Sequence[str] | None = None) -> BazelBuildResult:
+        """
+        Runs the bazel build, reusing the result of an earlier build if none of
+        the build inputs changed since.
+
+        Args:
+            targets: The targets to build, or None to build everything.
+
+        Returns:
+            BazelBuildResult containing status, stdout, stderr, and time taken.
+        """
+        if targets is not None and not targets:
+            logger.info("No bazel targets affected. Skipping build.")
+            return BazelBuildResult(success=True, stdout="No targets to build.")
+
+        input_hash = self.get_bazel_input_hash(targets) if self.build_cache else None
+        if input_hash:
+            cached_result = self.build_cache.get(input_hash)
+            if cached_result:
+                logger.info(
+                    f"Reusing cached bazel build result for inputs {input_hash}."
+                )
+                return cached_result
+
+        result, cacheable = self._run_bazel_build_uncached(targets)
+        if input_hash and cacheable:
+            self.build_cache.put(input_hash, result)
+        return result
+
+    def _run_bazel_build_uncached(
+        self, targets: Sequence[str] | None = None
+    ) -> tuple[BazelBuildResult, bool]:
+        """
+        Runs the bazel build command in the given repository path for specific targets.
+
+        Returns:
+            BazelBuildResult containing status, stdout, stderr, and time taken,
+            and whether the result can be reused for the same inputs. Failures
+            only can if they come from compile or analysis errors, and not from
+            e.g. a flaky cache or a build that ran out of memory.
+        """
+        try:
+            if self.cancelled.is_set():
+                raise BuildCancelledError()
+            bazel_build_file = self.get_bazel_build_file()
+            base_path = os.path.dirname(os.path.abspath(__file__))
+            bazel_build_path = os.path.join(base_path, bazel_build_file)
+
+            if targets is None:
+                logger.info("Running bazel build...")
+            else:
+                logger.info(f"Running bazel build for {len(targets)} targets...")
+            log_path = self._get_new_build_log_path()
+            bep_path = log_path.removesuffix(".log") + ".bep.json"
+            # A change to a core library affects tens of thousands of targets,
+            # too many to pass as command line arguments.
+            target_pattern_file = None
+            if targets is not None:
+                target_pattern_file = log_path.removesuffix(".log") + ".targets"
+                with open(target_pattern_file, "w") as f:
+                    f.write("".join(f"{target}\n" for target in targets))
+            extractor = BuildErrorExtractor()
+            log_tail = collections.deque(maxlen=self.BuildLogTailLines)
+            timed_out = threading.Event()
+            start_time = time.time()
+            # Stream the build output to a log file instead of holding all of
+            # it in memory, extracting errors as they come in.
+            with open(log_path, "w", encoding="utf-8") as log_file:
+                with self.build_process_lock:
+                    if self.cancelled.is_set():
+                        if target_pattern_file:
+                            os.remove(target_pattern_file)
+                        raise BuildCancelledError()
+                    process = subprocess.Popen(
+                        [bazel_build_path],
+                        cwd=os.path.join(self.repo_path, self.BazelPath),
+                        env=self.get_bazel_env(bep_path, target_pattern_file),
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.STDOUT,
+                        text=True,
+                        errors="replace",
+                        # Run in its own process group so the whole build can
+                        # be killed on timeout or cancel, not just the script.
+                        start_new_session=True,
+                    )
+                    self.build_process = process
+
+                def kill_build():
+                    timed_out.set()
+                    try:
+                        os.killpg(process.pid, signal.SIGKILL)
+                    except ProcessLookupError:
+                        # The build exited just as it timed out.
+                        pass
+
+                timer = threading.Timer(self.BuildTimeoutSeconds, kill_build)
+                timer.start()
+                try:
+                    for line in process.stdout:
+                        log_file.write(line)
+                        extractor.process_line(line)
+                        log_tail.append(line)
+                    returncode = process.wait()
+                finally:
+                    timer.cancel()
+                    with self.build_process_lock:
+                        self.build_process = None
+                    if target_pattern_file:
+                        os.remove(target_pattern_file)
+
+            if timed_out.is_set():
+                raise subprocess.TimeoutExpired(process.args, self.BuildTimeoutSeconds)
+            if self.cancelled.is_set():
+                raise BuildCancelledError()
+
             end_time = time.time()
             time_taken = end_time - start_time
-            logger.info(f"Bazel build took {time_taken} seconds.")
-            return BazelBuildResult(
-                success=result.returncode == 0,
-                stdout=result.stdout,
-                stderr=result.stderr,
+            logger.info(f"Bazel build took {time_taken} seconds. Log: {log_path}")
+            metrics = parse_build_event_json(bep_path)
+            if os.path.exists(bep_path):
+                # The metrics are all we need, the full event log is large.
+                os.remove(bep_path)
+            result = BazelBuildResult(
+                success=returncode == 0,
+                stderr="".join(log_tail),
                 time_taken=time_taken,
+                failed_targets=list(extractor.failed_targets),
+                error_digest=extractor.get_digest(),
+                log_path=log_path,
+                metrics=metrics,
             )
+            self.record_build_metrics(result, targets)
+            cacheable = result.success or bool(
+                extractor.failed_targets or extractor.error_locations
+            )
+            return result, cacheable
 
         except subprocess.TimeoutExpired:
-            return BazelBuildResult(success=False, stderr="Timeout", time_taken=1800)
+            return (
+                BazelBuildResult(
+                    success=False,
+                    stderr="Timeout",
+                    time_taken=self.BuildTimeoutSeconds,
+                ),
+                False,
+            )
+        except BuildCancelledError:
+            return BazelBuildResult(success=False, stderr="Build cancelled"), False
         except FileNotFoundError:
-            return BazelBuildResult(
-                success=False,
-                stderr="Error: 'bazel' command not found. Please ensure Bazel is installed.",
+            return (
+                BazelBuildResult(
+                    success=False,
+                    stderr="Error: 'bazel' command not found. Please ensure Bazel is installed.",
+                ),
+                False,
             )
         except Exception as e:
-            return BazelBuildResult(
-                success=False, stderr=f"Error running bazel build: {str(e)}"
+            return (
+                BazelBuildResult(
+                    success=False, stderr=f"Error running bazel build: {str(e)}"
+                ),
+                False,
             )
 
     def run_buildifier(self, files: Sequence[str]) -> bool:
@@ -174,7 +799,107 @@ class CommandProcessor:
             return False
 
 
+class GitWorktree:
+    """
+    A separate working tree of a repository, used to try out a fix in isolation.
+    """
+
+    def __init__(self, main_repo: git.Repo, path: str, commit_hash: str):
+        self.main_repo = main_repo
+        self.repo_path = path
+        self.main_repo.git.worktree("add", "--force", "--detach", path, commit_hash)
+        self.repo = git.Repo(path)
+
+    def diff(self) -> str:
+        return self.repo.git.diff(None)
+
+    def is_repo_dirty(self, untracked_files=False) -> bool:
+        return self.repo.is_dirty(untracked_files=untracked_files)
+
+    def get_patch(self) -> str:
+        """Returns all changes in the worktree, including new files, as a patch."""
+        self.repo.git.add("-A")
+        return self.repo.git.diff("--cached", "--binary") + "\n"
+
+    def remove(self) -> None:
+        self.main_repo.git.worktree("remove", "--force", self.repo_path)
+
+
+class TriggerServer:
+    """
+    HTTP endpoint that wakes the bot up when new commits are pushed.
+
+    Any POST request, e.g. a GitHub push or Buildkite build webhook, counts as
+    a notification. If a token is set, requests must carry it in an
+    X-Buildkite-Token header or as a bearer token.
+    """
+
+    class RequestHandler(http.server.BaseHTTPRequestHandler):
+        def do_POST(self):
+            trigger: TriggerServer = self.server.trigger
+            # Drain the payload, we only care that something happened.
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if not trigger.is_authorized(self.headers):
+                self.send_response(403)
+                self.end_headers()
+                return
+            logger.info(f"Received push notification on {self.path}.")
+            trigger.notify()
+            self.send_response(202)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    def __init__(self, port: int, token: str | None = None, host: str = ""):
+        self.token = token
+        self.wake_event = threading.Event()
+        self.httpd = http.server.ThreadingHTTPServer((host, port), self.RequestHandler)
+        self.httpd.trigger = self
+        self.port = self.httpd.server_address[1]
+
+    def is_authorized(self, headers) -> bool:
+        if not self.token:
+            return True
+        return any(
+            hmac.compare_digest(candidate.encode(), self.token.encode())
+            for candidate in (
+                headers.get("X-Buildkite-Token", ""),
+                headers.get("Authorization", "").removeprefix("Bearer "),
+            )
+        )
+
+    def start(self) -> None:
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+        logger.info(f"Listening for push notifications on port {self.port}.")
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def notify(self) -> None:
+        self.wake_event.set()
+
+    def wait(self, timeout: float) -> bool:
+        """
+        Waits for a notification, at most timeout seconds.
+
+        Notifications received since the last wait return immediately.
+
+        Returns:
+            Whether a notification was received.
+        """
+        notified = self.wake_event.wait(timeout)
+        if notified:
+            # Only clear after a notification, so one arriving just as the
+            # wait times out is not lost.
+            self.wake_event.clear()
+        return notified
+
+
 class LocalGitRepo:
+    UpstreamUrl = "https://github.com/llvm/llvm-project.git"
+
     def __init__(self, repo_path: str, creds: CredentialManager, can_create_pr):
         self.can_create_pr = can_create_pr
         self.repo_path = repo_path
@@ -220,12 +945,31 @@ class LocalGitRepo:
     def get_branch_name(self, commit_hash: str) -> str:
         return f"{self.branch_prefix}{commit_hash}"
 
+    def is_main_branch_up_to_date(self) -> bool:
+        """
+        Checks with a cheap ls-remote whether the local copy of the main branch
+        already matches upstream, so that syncing the fork and fetching can be
+        skipped.
+        """
+        try:
+            upstream_sha = self.repo.git.ls_remote(
+                self.UpstreamUrl, f"refs/heads/{self.main_branch}"
+            ).split()[0]
+            local_sha = self.repo.commit(
+                f"{self.remote_name}/{self.main_branch}"
+            ).hexsha
+        except Exception as e:
+            logger.warning(f"Failed to check whether main branch is up to date: {e}")
+            return False
+        return upstream_sha == local_sha
+
     def refresh_main_branch(self) -> str:
         """Pulls the repository locally."""
-        self.gh_fork_repo.merge_upstream(self.main_branch)
+        if not self.is_main_branch_up_to_date():
+            self.gh_fork_repo.merge_upstream(self.main_branch)
+            # Force pull by fetching and resetting to overwrite local changes.
+            self.repo.remotes.origin.fetch()
         self.repo.git.checkout("-f", self.main_branch)
-        # Force pull by fetching and resetting to overwrite local changes.
-        self.repo.remotes.origin.fetch()
         self.repo.git.reset("--hard", f"{self.remote_name}/{self.main_branch}")
 
         return self.repo.head.commit.hexsha
@@ -233,6 +977,18 @@ class LocalGitRepo:
     def diff(self) -> str:
         return self.repo.git.diff(None)
 
+    def apply_patch(self, patch: str) -> None:
+        """Applies a patch, e.g. from GitWorktree.get_patch, to the working tree."""
+        with tempfile.NamedTemporaryFile("w", suffix=".patch") as patch_file:
+            patch_file.write(patch)
+            patch_file.flush()
+            self.repo.git.apply(patch_file.name)
+
+    def create_worktree(self, commit_hash: str, name: str) -> GitWorktree:
+        """Creates a worktree next to the repository with commit_hash checked out."""
+        path = os.path.join(f"{self.repo_path.rstrip(os.sep)}.worktrees", name)
+        return GitWorktree(self.repo, path, commit_hash)
+
     def create_branch_for_fix(self, commit_hash: str) -> None:
         """Prepares the local git repository for applying fixes."""
         self.checkout_commit(commit_hash)
@@ -336,11 +1092,57 @@ class BuildProcessor(abc.ABC):
         """Get builds to process since last processed build."""
         pass
 
+    def get_targets_to_build(
+        self, commit_sha: str, passing_sha: str | None
+    ) -> Sequence[str] | None:
+        """Get targets to build for a commit, or None to build everything."""
+        return None
+
 
 class LocalBuildProcessor(BuildProcessor):
-    def __init__(self, cmd_processor: CommandProcessor, git_repo: LocalGitRepo):
+    def __init__(
+        self,
+        cmd_processor: CommandProcessor,
+        git_repo: LocalGitRepo,
+        targeted_builds: bool = False,
+        full_build_interval: int = 10,
+    ):
         self.cmd_processor = cmd_processor
         self.git_repo = git_repo
+        # Targeted builds only build what changed since the last passing commit.
+        # Every full_build_interval builds, everything is built regardless to
+        # catch anything the targeted builds missed.
+        self.targeted_builds = targeted_builds
+        self.full_build_interval = full_build_interval
+        self.builds_since_full_build = 0
+
+    def get_targets_to_build(
+        self, commit_sha: str, passing_sha: str | None
+    ) -> Sequence[str] | None:
+        """
+        Get the targets affected by changes since a passing commit.
+
+        Args:
+            commit_sha: The commit to build, which must be checked out.
+            passing_sha: A commit known to pass the build, if any.
+
+        Returns:
+            The targets to build, or None to build everything.
+        """
+        if not self.targeted_builds or not passing_sha:
+            self.builds_since_full_build = 0
+            return None
+
+        self.builds_since_full_build += 1
+        if self.builds_since_full_build >= self.full_build_interval:
+            logger.info("Running periodic full build.")
+            self.builds_since_full_build = 0
+            return None
+
+        targets = self.cmd_processor.get_affected_targets(passing_sha, commit_sha)
+        if targets is None:
+            self.builds_since_full_build = 0
+        return targets
 
     def get_latest_build_status(self) -> BuildInfo:
         """Get the latest build status by running bazel build locally."""
@@ -350,7 +1152,7 @@ class LocalBuildProcessor(BuildProcessor):
         return BuildInfo(
             commit=latest_sha,
             state=BuildState.PASSED if result.success else BuildState.FAILED,
-            failed_targets=parse_targets(result.stderr),
+            failed_targets=result.failed_targets,
         )
 
     def get_builds_to_process(self, last_processed_sha: str) -> Sequence[BuildInfo]:
@@ -1,9 +1,11 @@
 """Handy algorithms."""
 
+import asyncio
 
-def bisect(predicate, list):
+
+def bisect(predicate, list, prefetch=None):
     """
-    bisect(predicate, list) -> item or None
+    bisect(predicate, list, prefetch=None) -> item or None
 
     Given a test predicate and a list of items, search return the first item in
     the list for which the predicate succeeds, or None if no such item is
@@ -17,6 +19,9 @@ def bisect(predicate, list):
 
     This function is optimized for the case where the searched for item is near
     the beginning of the list.
+
+    If given, prefetch is called with the items that may be tested next before
+    each predicate evaluation, so they can be prepared in the background.
     """
 
     if not list:
@@ -26,6 +31,8 @@ def bisect(predicate, list):
     hi = len(list)-1
 
     # Check first item immediately.
+    if prefetch is not None:
+        prefetch([list[(lo + hi) // 2]])
     if predicate(list[lo]):
         return list[lo]
 
@@ -34,8 +41,11 @@ def bisect(predicate, list):
     #  predicate(list[hi])
 
     # Binary search region.
-    while lo + 1 != hi:
+    while lo + 1 < hi:
         mid = (lo + hi) // 2
+        if prefetch is not None:
+            prefetch([list[i] for i in ((lo + mid) // 2, (mid + hi) // 2)
+                      if i not in (lo, mid, hi)])
         if predicate(list[mid]):
             hi = mid
         else:
@@ -44,9 +54,9 @@ def bisect(predicate, list):
     return list[hi]
 
 
-def gallop(predicate, list):
+def gallop(predicate, list, prefetch=None):
     """
-    gallop(predicate, list) -> list or None
+    gallop(predicate, list, prefetch=None) -> list or None
 
     Given a test predicate and a list of items, reduce the search space
     assuming the searched for item is near the beginning of the list.
@@ -56,12 +66,16 @@ def gallop(predicate, list):
     satisfy the predicate and the item preceeding it is guaranteed to fail the
     predicate, but that is all. Additionally, if the last item does not pass
     the predicate, such an item might not be found.
+
+    If given, prefetch is called as for bisect().
     """
 
     if not list:
         return None
 
     # Check first item immediately.
+    if prefetch is not None:
+        prefetch(list[1:2])
     if predicate(list[0]):
         return list[0:1]
 
@@ -73,6 +87,9 @@ def gallop(predicate, list):
     lo = 0
     hi = 1
     while hi < len(list):
+        if prefetch is not None:
+            next_hi = hi + (hi - lo)*2
+            prefetch([list[min(next_hi, len(list) - 1)]])
         if predicate(list[hi]):
             break
         lo, hi = hi, hi + (hi - lo)*2
@@ -83,3 +100,145 @@ def gallop(predicate, list):
         if hi == lo or not predicate(list[hi]):
             return None
     return list[lo:hi+1]
+
+
+def parallel_bisect(evaluate, list, jobs):
+    """
+    parallel_bisect(evaluate, list, jobs) -> item or None
+
+    Like bisect(), but tests up to jobs items at once. evaluate is given a list
+    of items and returns the list of predicate results for them, presumably
+    computed concurrently.
+
+    Each round tests evenly spaced items in the remaining range and narrows it
+    down to one of jobs + 1 segments, so the number of rounds drops from
+    log2(n) to log_{jobs+1}(n).
+    """
+
+    if jobs <= 1:
+        return bisect(lambda item: evaluate([item])[0], list)
+
+    if not list:
+        return None
+
+    lo = 0
+    hi = len(list)-1
+
+    # Invariants, once the first item is checked:
+    #  not predicate(list[lo])
+    #  predicate(list[hi])
+    checked_first = False
+    while lo + 1 < hi or not checked_first:
+        # Check the first item immediately, along with the first round.
+        num_points = jobs if checked_first else jobs - 1
+        points = set(lo + (hi - lo) * i // (num_points + 1)
+                     for i in range(1, num_points + 1))
+        indices = sorted(points - set([lo, hi]))
+        if not checked_first:
+            indices.insert(0, lo)
+
+        results = evaluate([list[i] for i in indices])
+        if not checked_first:
+            checked_first = True
+            if results[0]:
+                return list[lo]
+            indices, results = indices[1:], results[1:]
+
+        for i, result in zip(indices, results):
+            if result:
+                hi = i
+                break
+            lo = i
+
+    return list[hi]
+
+
+def parallel_gallop(evaluate, list, jobs):
+    """
+    parallel_gallop(evaluate, list, jobs) -> list or None
+
+    Like gallop(), but tests up to jobs items at once. See parallel_bisect()
+    for the meaning of evaluate.
+    """
+
+    if jobs <= 1:
+        return gallop(lambda item: evaluate([item])[0], list)
+
+    if not list:
+        return None
+
+    # The items gallop() would test, in order.
+    positions = []
+    lo = 0
+    hi = 1
+    while hi < len(list):
+        positions.append(hi)
+        lo, hi = hi, hi + (hi - lo)*2
+    if len(list) > 1 and positions[-1] != len(list) - 1:
+        positions.append(len(list) - 1)
+
+    # Check the first item immediately, along with the first round.
+    tested = [0] + positions[:jobs-1]
+    positions = positions[jobs-1:]
+    results = evaluate([list[i] for i in tested])
+    if results[0]:
+        return list[0:1]
+
+    lo = 0
+    while True:
+        for i, result in zip(tested, results):
+            if result:
+                return list[lo:i+1]
+            lo = i
+        if not positions:
+            return None
+        tested, positions = positions[:jobs], positions[jobs:]
+        results = evaluate([list[i] for i in tested])
+
+
+async def evaluate_concurrently(predicate, items):
+    """
+    evaluate_concurrently(predicate, items) -> [bool]
+
+    Evaluate an async predicate on items, taken in list order, all at once.
+    This is an evaluate function for parallel_bisect() and parallel_gallop().
+
+    The predicate is assumed to be monotonic, as for bisect(). So once an item
+    passes, the evaluations of the items after it are cancelled and they are
+    assumed to pass as well, and once an item fails, the evaluations of the
+    items before it are cancelled and they are assumed to fail.
+    """
+
+    def get_range():
+        # The indices of the last failing and first passing items so far.
+        lo = max([i for i, result in enumerate(results)
+                  if result is False] or [-1])
+        hi = min([i for i, result in enumerate(results)
+                  if result is True] or [len(items)])
+        return lo, hi
+
+    tasks = [asyncio.ensure_future(predicate(item)) for item in items]
+    results = [None] * len(items)
+    try:
+        pending = set(tasks)
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if not task.cancelled():
+                    results[tasks.index(task)] = bool(task.result())
+
+            # Cancel the evaluations that can no longer change the outcome.
+            lo, hi = get_range()
+            for i, task in enumerate(tasks):
+                if (i < lo or i > hi) and not task.done():
+                    task.cancel()
+    finally:
+        # Wait for cancelled evaluations to clean up.
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    lo, hi = get_range()
+    return [result if result is not None else i > hi
+            for i, result in enumerate(results)]
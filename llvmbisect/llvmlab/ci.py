@@ -2,10 +2,16 @@
 Tools for working with llvmlab CI infrastructure.
 """
 
+import argparse
+import asyncio
 import errno
+import functools
+import hashlib
+import json
 import os
-import resource
+import re
 import shutil
+import signal
 import subprocess
 import sys
 import tempfile
@@ -16,11 +22,25 @@ from . import shell
 from . import algorithm
 from . import llvmlab
 from . import util
-from util import warning, fatal, note
+from .util import warning, fatal, note
 from . import scripts
-from . import util
 
-from optparse import OptionParser
+
+async def run_in_thread(fn, *args, **kwargs):
+    """
+    Run a blocking function in the event loop's executor.
+
+    Threads can't be interrupted, so if the caller is cancelled, this waits for
+    the function to finish before passing on the cancellation. That way the
+    caller can safely clean up whatever the function was working on.
+    """
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(None, functools.partial(fn, *args, **kwargs))
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        await asyncio.wait([future])
+        raise
 
 
 class Command(object):
@@ -38,11 +58,20 @@ class Command(object):
             command.result = not command.result
 
     class MaxTimeFilter(Filter):
+        """
+        Fails the command if it takes too long. The command is also killed
+        once it has run for that long, which fails it too.
+        """
+
+        # Matches max_time filters, to find the time limit before the command
+        # is run.
+        spec_re = re.compile(r'\s*max_time\s*\(\s*([0-9.eE+-]+)\s*\)\s*$')
+
         def __init__(self, value):
             try:
                 self.value = float(value)
             except:
-                fatal("invalid argument: %r" % time)
+                fatal("invalid argument: %r" % (value,))
             warning("'max_time' filter is deprecated, use "
                     "'user_time < %.4f' filter expression" % self.value)
 
@@ -53,6 +82,27 @@ class Command(object):
     available_filters = {"negate": NotFilter(),  # note this is an instance.
                          "max_time": MaxTimeFilter}
 
+    @classmethod
+    def get_timeout(klass, filters):
+        """
+        get_timeout(filters) -> float or None
+
+        Get the time limit set by the max_time filters among the given filter
+        specifications, if any.
+        """
+        timeout = None
+        for spec in filters:
+            m = klass.MaxTimeFilter.spec_re.match(spec)
+            if m is None:
+                continue
+            try:
+                value = float(m.group(1))
+            except ValueError:
+                continue
+            if timeout is None or value < timeout:
+                timeout = value
+        return timeout
+
     def __init__(self, command, stdout_path, stderr_path, env):
         self.command = command
         self.stdout_path = stdout_path
@@ -62,25 +112,51 @@ class Command(object):
         # Test data.
         self.metrics = {}
         self.result = None
+        self.timed_out = False
 
-    def execute(self, verbose=False):
+    async def execute(self, verbose=False, timeout=None):
+        """
+        Run the command, killing it if it runs longer than timeout seconds or
+        if the caller is cancelled.
+        """
         if verbose:
             note('executing: %s' % ' '.join("'%s'" % arg
                                             for arg in self.command))
 
-        start_rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
         start_time = time.time()
 
-        p = subprocess.Popen(self.command,
-                             stdout=open(self.stdout_path, 'w'),
-                             stderr=open(self.stderr_path, 'w'),
-                             env=self.env)
-        self.result = p.wait() == 0
+        # The output goes straight to the log files. The command gets its own
+        # process group, so anything it spawns can be killed along with it.
+        with open(self.stdout_path, 'w') as stdout, \
+                open(self.stderr_path, 'w') as stderr:
+            p = subprocess.Popen(self.command, stdout=stdout, stderr=stderr,
+                                 env=self.env, start_new_session=True)
+
+        # Reap the process with wait4() to get its own resource usage, which
+        # RUSAGE_CHILDREN can't give while other commands are running.
+        wait = asyncio.get_running_loop().run_in_executor(
+            None, os.wait4, p.pid, 0)
+        try:
+            try:
+                _, status, rusage = await asyncio.wait_for(
+                    asyncio.shield(wait), timeout)
+            except asyncio.TimeoutError:
+                if verbose:
+                    note("command timed out after %.4fs" % (timeout,))
+                self.timed_out = True
+                self._kill(p)
+                _, status, rusage = await wait
+        except asyncio.CancelledError:
+            self._kill(p)
+            await asyncio.wait([wait])
+            raise
+        # Let Popen know the process was reaped.
+        p.returncode = status
 
         end_time = time.time()
-        end_rusage = resource.getrusage(resource.RUSAGE_CHILDREN)
-        self.metrics["user_time"] = end_rusage.ru_utime - start_rusage.ru_utime
-        self.metrics["sys_time"] = end_rusage.ru_stime - start_rusage.ru_stime
+        self.result = status == 0 and not self.timed_out
+        self.metrics["user_time"] = rusage.ru_utime
+        self.metrics["sys_time"] = rusage.ru_stime
         self.metrics["wall_time"] = end_time - start_time
 
         if verbose:
@@ -89,6 +165,13 @@ class Command(object):
                     self.metrics["user_time"], self.metrics["wall_time"],
                     self.metrics["sys_time"]))
 
+    @staticmethod
+    def _kill(p):
+        try:
+            os.killpg(p.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
     def evaluate_filter_spec(self, spec):
         # Run the filter in an environment with the builtin filters and the
         # metrics.
@@ -106,25 +189,123 @@ class Command(object):
         self.result = bool(result)
 
 
-def execute_sandboxed_test(sandbox, builder, build, args,
-                           verbose=False, very_verbose=False,
-                           add_path_variables=True,
-                           show_command_output=False,
-                           reuse_sandbox=False):
-
-    def split_command_filters(command):
-        for i, arg in enumerate(command):
-            if arg[:2] != "%%" or arg[-2:] != "%%":
-                break
-        else:
-            fatal("invalid command: %s, only contains filter "
-                  "specifications" % ("".join('"%s"' % a for a in command)))
+class ResultMemo(object):
+    """
+    A persistent record of test results, so that interrupted, repeated and
+    overlapping bisects don't test a build with the same command twice.
+
+    Results are keyed by builder, build and a hash of the normalized test
+    command, along with the directory it was run from, since test commands
+    usually refer to files there. The size and modification time of any
+    argument naming an existing file, such as the test script, are part of
+    the key too, so editing the file invalidates its results. Commands that
+    timed out aren't recorded, since they may pass or fail when retried.
+    """
+
+    # Only the end of longer logs is kept.
+    max_log_size = 64 * 1024
+
+    @classmethod
+    def fromprefs(klass, prefs):
+        return klass(os.path.join(prefs.path, "ci", "results"))
+
+    def __init__(self, path):
+        self.path = path
+
+    @staticmethod
+    def get_command_hash(args):
+        commands = []
+        for command in util.list_split(args, "----"):
+            # Ignore whitespace around filter expressions.
+            command = list(command)
+            for i, arg in enumerate(command):
+                if arg[:2] != "%%" or arg[-2:] != "%%":
+                    break
+                command[i] = "%%" + arg[2:-2].strip() + "%%"
+            commands.append(command)
+        files = {}
+        for arg in args:
+            if arg not in files and os.path.isfile(arg):
+                st = os.stat(arg)
+                files[arg] = [st.st_size, st.st_mtime_ns]
+        data = json.dumps({'commands': commands, 'cwd': os.getcwd(),
+                           'files': files}, sort_keys=True)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+    def _get_entry_path(self, builder, build, args):
+        return os.path.join(self.path, builder,
+                            build.tobasename(include_suffix=False),
+                            self.get_command_hash(args) + '.json')
+
+    def get(self, builder, build, args):
+        """
+        get(builder, build, args) -> dict or None
+
+        Get the recorded result of testing build with args, if any.
+        """
+        try:
+            with open(self._get_entry_path(builder, build, args)) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return None
 
-        return ([a[2:-2] for a in command[:i]],
-                command[i:])
+    def _read_log(self, path):
+        try:
+            with open(path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                f.seek(max(0, f.tell() - self.max_log_size))
+                return f.read().decode('utf-8', 'replace')
+        except IOError:
+            return None
+
+    def record(self, builder, build, args, test_result, command_objects):
+        """Record the result and logs of testing build with args."""
+        if any(cmd_object.timed_out for cmd_object in command_objects):
+            return
 
+        entry = {'builder': builder,
+                 'build': build.tobasename(include_suffix=False),
+                 'args': args,
+                 'cwd': os.getcwd(),
+                 'result': bool(test_result),
+                 'timestamp': time.time(),
+                 'commands': [{'command': cmd_object.command,
+                               'result': cmd_object.result,
+                               'timed_out': cmd_object.timed_out,
+                               'metrics': cmd_object.metrics,
+                               'stdout': self._read_log(cmd_object.stdout_path),
+                               'stderr': self._read_log(cmd_object.stderr_path)}
+                              for cmd_object in command_objects]}
+        entry_path = self._get_entry_path(builder, build, args)
+        shell.mkdir_p(os.path.dirname(entry_path))
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(entry_path))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entry, f, indent=2)
+        os.replace(tmp_path, entry_path)
+
+
+def execute_sandboxed_test(*args, **kwargs):
+    """
+    execute_sandboxed_test(sandbox, builder, build, args, ...)
+        -> (test_result, command_objects)
+
+    Synchronous wrapper for execute_sandboxed_test_async().
+    """
+    return asyncio.run(execute_sandboxed_test_async(*args, **kwargs))
+
+
+async def execute_sandboxed_test_async(sandbox, builder, build, args,
+                                       verbose=False, very_verbose=False,
+                                       add_path_variables=True,
+                                       show_command_output=False,
+                                       reuse_sandbox=False,
+                                       prefetcher=None, memo=None):
+    """
+    Fetch build into the sandbox and run the test command args against it.
+
+    If given, the result and logs of the test are recorded in memo.
+    """
     path = build.tobasename(include_suffix=False)
-    fullpath = build.tobasename()
 
     if verbose:
         note('testing %r' % path)
@@ -140,12 +321,45 @@ def execute_sandboxed_test(sandbox, builder, build, args,
         if not os.path.exists(sandbox):
             os.mkdir(sandbox)
 
+    try:
+        test_result, command_objects = await _execute_in_sandbox(
+            sandbox, builder, build, args, verbose, very_verbose,
+            add_path_variables, show_command_output, reuse_sandbox,
+            prefetcher)
+        # Record the result while the logs are still around.
+        if memo is not None:
+            memo.record(builder, build, args, test_result, command_objects)
+        return test_result, command_objects
+    finally:
+        # Remove the temporary directory.
+        if is_temp:
+            if shell.execute(['rm', '-rf', sandbox]) != 0:
+                note('unable to remove sandbox dir %r' % path)
+
+
+async def _execute_in_sandbox(sandbox, builder, build, args, verbose,
+                              very_verbose, add_path_variables,
+                              show_command_output, reuse_sandbox, prefetcher):
+    def split_command_filters(command):
+        for i, arg in enumerate(command):
+            if arg[:2] != "%%" or arg[-2:] != "%%":
+                break
+        else:
+            fatal("invalid command: %s, only contains filter "
+                  "specifications" % ("".join('"%s"' % a for a in command)))
+
+        return ([a[2:-2] for a in command[:i]],
+                command[i:])
+
+    path = build.tobasename(include_suffix=False)
+    fullpath = build.tobasename()
+
     # Compute paths and make sure sandbox is clean.
     root_path = os.path.join(sandbox, fullpath)
     builddir_path = os.path.join(sandbox, path)
     need_build = True
-    if reuse_sandbox and (os.path.exists(root_path) and
-                          os.path.exists(builddir_path)):
+    # The tarball is not downloaded if the build was in the build cache.
+    if reuse_sandbox and os.path.exists(builddir_path):
         need_build = False
     else:
         for p in (root_path, builddir_path):
@@ -155,21 +369,15 @@ def execute_sandboxed_test(sandbox, builder, build, args,
     # Fetch and extract the build.
     if need_build:
         start_time = time.time()
-        llvmlab.fetch_build_to_path(builder, build, root_path, builddir_path)
+        await run_in_thread(llvmlab.fetch_build_to_path, builder, build,
+                            root_path, builddir_path, prefetcher)
         if very_verbose:
             note("extracted build in %.2fs" % (time.time() - start_time,))
 
-    # Attempt to find clang/clang++ in the downloaded build.
-    def find_binary(name):
-        x = subprocess.check_output(['find', builddir_path, '-name', name])\
-                    .strip().split("\n")[0]
-        if x == '':
-            x = None
-        return x
-
-    clang_path = find_binary('clang')
-    clangpp_path = find_binary('clang++')
-    liblto_path = find_binary('libLTO.dylib')
+    # Find clang/clang++ and the other tools in the downloaded build, using
+    # the manifest written when it was extracted.
+    tools = llvmlab.load_build_manifest(builddir_path)
+    liblto_path = tools.pop('libLTO.dylib', None)
     if liblto_path is not None:
         liblto_dir = os.path.dirname(liblto_path)
     else:
@@ -180,9 +388,9 @@ def execute_sandboxed_test(sandbox, builder, build, args,
                'path': builddir_path,
                'revision': build.revision,
                'build': build.build,
-               'clang': clang_path,
-               'clang++': clangpp_path,
                'libltodir': liblto_dir}
+    for name, tool_path in tools.items():
+        options.setdefault(name, tool_path)
 
     # Inject environment variables.
     env = os.environ.copy()
@@ -244,10 +452,11 @@ def execute_sandboxed_test(sandbox, builder, build, args,
         cmd_object = Command(command, stdout_log_path, stderr_log_path, env)
         command_objects.append(cmd_object)
 
-        # Execute the command.
+        # Execute the command, enforcing any max_time limit.
         try:
-            cmd_object.execute(verbose=verbose)
-        except OSError, e:
+            await cmd_object.execute(verbose=verbose,
+                                     timeout=Command.get_timeout(filters))
+        except OSError as e:
             # Python's exceptions are horribly to read, and this one is
             # incredibly common when people don't use the right syntax (or
             # misspell something) when writing a predicate. Detect this and
@@ -267,19 +476,22 @@ def execute_sandboxed_test(sandbox, builder, build, args,
         for filter in filters:
             cmd_object.evaluate_filter_spec(filter)
 
+        # A command that was killed fails, whatever the filters say.
+        if cmd_object.timed_out:
+            cmd_object.result = False
+
         if show_command_output:
             for p, type in ((stdout_log_path, "stdout"),
                             (stderr_log_path, "stderr")):
                 if not os.path.exists(p):
                     continue
 
-                f = open(p)
-                data = f.read()
-                f.close()
+                with open(p, errors='replace') as f:
+                    data = f.read()
                 if data:
-                    print ("-- command %s (note: suppressed by default, "
-                           "see sandbox dir for log files) --" % (type))
-                    print "--\n%s--\n" % data
+                    print("-- command %s (note: suppressed by default, "
+                          "see sandbox dir for log files) --" % (type))
+                    print("--\n%s--\n" % data)
 
         test_result = cmd_object.result
         if not test_result:
@@ -287,11 +499,6 @@ def execute_sandboxed_test(sandbox, builder, build, args,
     if not interpolated_variables:
         warning('no substitutions found. Fetched root ignored?')
 
-    # Remove the temporary directory.
-    if is_temp:
-        if shell.execute(['rm', '-rf', sandbox]) != 0:
-            note('unable to remove sandbox dir %r' % path)
-
     return test_result, command_objects
 
 
@@ -327,44 +534,39 @@ def get_best_match(builds, name, key=lambda x: x):
 def action_fetch(name, args):
     """fetch a build from the server"""
 
-    parser = OptionParser("""\
-usage: %%prog %(name)s [options] builder [build-name]
-
+    parser = argparse.ArgumentParser(
+        prog=name, usage="%(prog)s [options] builder [build-name]",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description="""\
 Fetch the build from the named builder which matchs build-name. If no match is
 found, get the first build before the given name. If no build name is given,
 the most recent build is fetched.
 
 The available builders can be listed using:
 
-  %%prog ls
+  llvmlab ls
 
 The available builds can be listed using:
 
-  %%prog ls builder""" % locals())
-    parser.add_option("-f", "--force", dest="force",
-                      help=("always download and extract, overwriting any"
-                            "existing files"),
-                      action="store_true", default=False)
-    parser.add_option("", "--update-link", dest="update_link", metavar="PATH",
-                      help=("update a symbolic link at PATH to point to the "
-                            "fetched build (on success)"),
-                      action="store", default=None)
-    parser.add_option("-d", "--dry-run", dest='dry_run',
-                      help=("Perform all operations except the actual "
-                            "downloading and extracting of any files"),
-                      action="store_true", default=False)
-
-    (opts, args) = parser.parse_args(args)
-
-    if len(args) == 0:
-        parser.error("please specify a builder name")
-    elif len(args) == 1:
-        builder, = args
-        build_name = None
-    elif len(args) == 2:
-        builder, build_name = args
-    else:
-        parser.error("invalid number of arguments")
+  llvmlab ls builder""")
+    parser.add_argument("-f", "--force", dest="force",
+                        help=("always download and extract, overwriting any"
+                              "existing files"),
+                        action="store_true", default=False)
+    parser.add_argument("--update-link", dest="update_link", metavar="PATH",
+                        help=("update a symbolic link at PATH to point to the "
+                              "fetched build (on success)"),
+                        action="store", default=None)
+    parser.add_argument("-d", "--dry-run", dest='dry_run',
+                        help=("Perform all operations except the actual "
+                              "downloading and extracting of any files"),
+                        action="store_true", default=False)
+    parser.add_argument("builder", help="name of the builder")
+    parser.add_argument("build_name", metavar="build-name", nargs="?",
+                        help="name of the build to fetch", default=None)
+
+    opts = parser.parse_args(args)
+    builder, build_name = opts.builder, opts.build_name
 
     builds = list(llvmlab.fetch_builds(builder))
     if not builds:
@@ -393,8 +595,11 @@ The available builds can be listed using:
                 fatal('current directory is not clean, %r exists' % p)
         llvmlab.fetch_build_to_path(builder, build, root_path, builddir_path)
 
-    print 'downloaded root: %s' % root_path
-    print 'extracted path : %s' % builddir_path
+    # Builds are extracted while they are downloaded, unless streaming is
+    # disabled.
+    if os.path.exists(root_path):
+        print('downloaded root: %s' % root_path)
+    print('extracted path : %s' % builddir_path)
 
     # Update the symbolic link, if requested.
     if not opts.dry_run and opts.update_link:
@@ -408,39 +613,41 @@ The available builds can be listed using:
 
         # Create the symbolic link.
         os.symlink(os.path.abspath(builddir_path), opts.update_link)
-        print 'updated link at: %s' % opts.update_link
+        print('updated link at: %s' % opts.update_link)
     return os.path.abspath(builddir_path)
 
 
 def action_ls(name, args):
     """list available build names or builds"""
 
-    parser = OptionParser("""\
-usage: %%prog %s [build-name]
-
+    parser = argparse.ArgumentParser(
+        prog=name, usage="%(prog)s [build-name]",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description="""\
 With no arguments, list the available build names on 'llvmlab'. With a build
-name, list the available builds for that builder.\
-""" % name)
+name, list the available builds for that builder.""")
+    parser.add_argument("build_names", metavar="build-name", nargs="*",
+                        help="name of a builder to list the builds of")
 
-    (opts, args) = parser.parse_args(args)
+    args = parser.parse_args(args).build_names
 
     if not len(args):
         available_buildnames = llvmlab.fetch_builders()
         available_buildnames.sort()
         for item in available_buildnames:
-            print item
+            print(item)
         return available_buildnames
 
     for name in args:
         if len(args) > 1:
             if name is not args[0]:
-                print
-            print '%s:' % name
+                print()
+            print('%s:' % name)
         available_builds = list(llvmlab.fetch_builds(name))
         available_builds.sort()
         available_builds.reverse()
         for build in available_builds:
-            print build.tobasename(include_suffix=False)
+            print(build.tobasename(include_suffix=False))
         min_rev = min([x.revision for x in available_builds])
         max_rev = max([x.revision for x in available_builds])
         note("Summary: found {} builds: r{}-r{}".format(len(available_builds),
@@ -453,13 +660,14 @@ DEFAULT_BUILDER = "clang-stage1-configure-RA"
 def action_bisect(name, args):
     """find first failing build using binary search"""
 
-    parser = OptionParser("""\
-usage: %%prog %(name)s [options] ... test command args ...
-
+    parser = argparse.ArgumentParser(
+        prog=name, usage="%(prog)s [options] ... test command args ...",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description="""\
 Look for the first published build where a test failed, using the builds on
 llvmlab. The command arguments are executed once per build tested, but each
 argument is first subject to string interpolation. The syntax is
-"%%(VARIABLE)FORMAT" where FORMAT is a standard printf format, and VARIABLE is
+"%(VARIABLE)FORMAT" where FORMAT is a standard printf format, and VARIABLE is
 one of:
 
   'sandbox'   - the path to the sandbox directory.
@@ -470,6 +678,9 @@ one of:
   'clang++'   - the path to the clang++ binary of the build if it exists.
   'libltodir' - the path to the directory containing libLTO.dylib, if it
    exists.
+  'lld', 'llc', 'opt'
+              - the path to the binary of the build with that name, if it
+   exists. The tools looked for can be changed with the 'tools' preference.
 
 Each test is run in a sandbox directory. By default, sandbox directories are
 temporary directories which are created and destroyed for each test (see
@@ -486,40 +697,55 @@ them.
 
 It is possible to run multiple distinct commands for each test by separating
 them in the command line arguments by '----'. The failure of any command causes
-the entire test to fail.\
-""" % locals())
-
-    parser.add_option("-b", "--build", dest="build_name", metavar="STR",
-                      help="name of build to fetch",
-                      action="store", default=DEFAULT_BUILDER)
-    parser.add_option("-s", "--sandbox", dest="sandbox",
-                      help="directory to use as a sandbox",
-                      action="store", default=None)
-    parser.add_option("-v", "--verbose", dest="verbose",
-                      help="output more test notermation",
-                      action="store_true", default=False)
-    parser.add_option("-V", "--very-verbose", dest="very_verbose",
-                      help="output even more test notermation",
-                      action="store_true", default=False)
-    parser.add_option("", "--show-output", dest="show_command_output",
-                      help="display command output",
-                      action="store_true", default=False)
-    parser.add_option("", "--single-step", dest="single_step",
-                      help="single step instead of binary stepping",
-                      action="store_true", default=False)
-    parser.add_option("", "--min-rev", dest="min_rev",
-                      help="minimum revision to test",
-                      type="int", action="store", default=None)
-    parser.add_option("", "--max-rev", dest="max_rev",
-                      help="maximum revision to test",
-                      type="int", action="store", default=None)
-
-    parser.disable_interspersed_args()
-
-    (opts, args) = parser.parse_args(args)
+the entire test to fail.""")
+
+    parser.add_argument("-b", "--build", dest="build_name", metavar="STR",
+                        help="name of build to fetch",
+                        action="store", default=DEFAULT_BUILDER)
+    parser.add_argument("-s", "--sandbox", dest="sandbox",
+                        help="directory to use as a sandbox",
+                        action="store", default=None)
+    parser.add_argument("-v", "--verbose", dest="verbose",
+                        help="output more test notermation",
+                        action="store_true", default=False)
+    parser.add_argument("-V", "--very-verbose", dest="very_verbose",
+                        help="output even more test notermation",
+                        action="store_true", default=False)
+    parser.add_argument("--show-output", dest="show_command_output",
+                        help="display command output",
+                        action="store_true", default=False)
+    parser.add_argument("--single-step", dest="single_step",
+                        help="single step instead of binary stepping",
+                        action="store_true", default=False)
+    parser.add_argument("--min-rev", dest="min_rev",
+                        help="minimum revision to test",
+                        type=int, action="store", default=None)
+    parser.add_argument("--max-rev", dest="max_rev",
+                        help="maximum revision to test",
+                        type=int, action="store", default=None)
+    parser.add_argument("-j", "--jobs", dest="jobs",
+                        help=("number of builds to test at once, each in its "
+                              "own sandbox"),
+                        type=int, action="store", default=1)
+    parser.add_argument("--no-prefetch", dest="no_prefetch",
+                        help=("don't download the next candidate builds in "
+                              "the background while testing"),
+                        action="store_true", default=False)
+    parser.add_argument("--no-memo", dest="no_memo",
+                        help=("retest builds that were already tested with "
+                              "the same command, e.g. after changing files "
+                              "the command uses"),
+                        action="store_true", default=False)
+    parser.add_argument("command", nargs=argparse.REMAINDER,
+                        help="test command and arguments")
+
+    opts = parser.parse_args(args)
+    args = opts.command
 
     if opts.build_name is None:
         parser.error("no build name given (see --build)")
+    if opts.jobs < 1:
+        parser.error("invalid number of jobs: %d" % opts.jobs)
 
     # Very verbose implies verbose.
     opts.verbose |= opts.very_verbose
@@ -538,80 +764,166 @@ the entire test to fail.\
         available_builds = [b for b in available_builds
                             if b.revision <= opts.max_rev]
 
+    # Download the candidates the search may test next while the current
+    # one is being tested.
+    prefetcher = None
+    if not opts.single_step and not opts.no_prefetch and opts.jobs == 1:
+        prefetcher = llvmlab.BuildPrefetcher()
+
+    # Reuse the results of earlier bisects with the same command, and record
+    # the new ones.
+    memo = None
+    if not opts.no_memo:
+        memo = ResultMemo.fromprefs(util.get_prefs())
+    used_memo = []
+
+    def get_memoized_result(item):
+        if memo is None:
+            return None
+        entry = memo.get(opts.build_name, item, args)
+        if entry is None:
+            return None
+
+        if not used_memo:
+            used_memo.append(True)
+            note('using results recorded by earlier runs, use --no-memo to '
+                 'test again')
+
+        # Print status.
+        print('%s: %s (already tested)' % (
+            ('FAIL', 'PASS')[entry['result']],
+            item.tobasename(include_suffix=False)))
+
+        return entry['result']
+
     def predicate(item):
+        test_result = get_memoized_result(item)
+        if test_result is not None:
+            return test_result
+
         # Run the sandboxed test.
         test_result, _ = execute_sandboxed_test(
             opts.sandbox, opts.build_name, item, args, verbose=opts.verbose,
             very_verbose=opts.very_verbose,
-            show_command_output=opts.show_command_output or opts.very_verbose)
+            show_command_output=opts.show_command_output or opts.very_verbose,
+            prefetcher=prefetcher, memo=memo)
 
         # Print status.
-        print '%s: %s' % (('FAIL', 'PASS')[test_result],
-                          item.tobasename(include_suffix=False))
+        print('%s: %s' % (('FAIL', 'PASS')[test_result],
+                          item.tobasename(include_suffix=False)))
 
         return test_result
 
-    if opts.single_step:
-        for item in available_builds:
-            if predicate(item):
-                break
-        else:
-            item = None
-    else:
-        if opts.min_rev is None or opts.max_rev is None:
-            # Gallop to find initial search range, under the assumption that we
-            # are most likely looking for something at the head of this list.
-            search_space = algorithm.gallop(predicate, available_builds)
+    async def async_predicate(item):
+        test_result = get_memoized_result(item)
+        if test_result is not None:
+            return test_result
+
+        try:
+            test_result, _ = await execute_sandboxed_test_async(
+                opts.sandbox, opts.build_name, item, args,
+                verbose=opts.verbose, very_verbose=opts.very_verbose,
+                show_command_output=(opts.show_command_output or
+                                     opts.very_verbose),
+                memo=memo)
+        except asyncio.CancelledError:
+            if opts.verbose:
+                note('cancelled %r, it no longer affects the result' % (
+                    item.tobasename(include_suffix=False),))
+            raise
+
+        # Print status.
+        print('%s: %s' % (('FAIL', 'PASS')[test_result],
+                          item.tobasename(include_suffix=False)))
+
+        return test_result
+
+    def evaluate(items):
+        # Test the candidates concurrently, cancelling the ones made
+        # irrelevant by the results that are already in.
+        return asyncio.run(algorithm.evaluate_concurrently(async_predicate,
+                                                           items))
+
+    parallel = opts.jobs > 1 and not opts.single_step
+
+    prefetch = prefetcher.prefetch if prefetcher is not None else None
+    try:
+        if opts.single_step:
+            for item in available_builds:
+                if predicate(item):
+                    break
+            else:
+                item = None
+        elif parallel:
+            if opts.min_rev is None or opts.max_rev is None:
+                search_space = algorithm.parallel_gallop(
+                    evaluate, available_builds, opts.jobs)
+            else:
+                search_space = available_builds
+            item = algorithm.parallel_bisect(evaluate, search_space,
+                                             opts.jobs)
         else:
-            # If both min and max revisions are specified,
-            # don't gallop - bisect the given range.
-            search_space = available_builds
-        item = algorithm.bisect(predicate, search_space)
+            if opts.min_rev is None or opts.max_rev is None:
+                # Gallop to find initial search range, under the assumption
+                # that we are most likely looking for something at the head of
+                # this list.
+                search_space = algorithm.gallop(predicate, available_builds,
+                                                prefetch)
+            else:
+                # If both min and max revisions are specified,
+                # don't gallop - bisect the given range.
+                search_space = available_builds
+            item = algorithm.bisect(predicate, search_space, prefetch)
+    finally:
+        if prefetcher is not None:
+            prefetcher.close()
 
     if item is None:
         fatal('unable to find any passing build!')
 
-    print '%s: first working build' % item.tobasename(include_suffix=False)
+    print('%s: first working build' % item.tobasename(include_suffix=False))
     index = available_builds.index(item)
     if index == 0:
-        print 'no failing builds!?'
+        print('no failing builds!?')
     else:
-        print '%s: next failing build' % available_builds[index-1].tobasename(
-            include_suffix=False)
+        print('%s: next failing build' % available_builds[index-1].tobasename(
+            include_suffix=False))
 
 
 def action_exec(name, args):
     """execute a command against a published root"""
 
-    parser = OptionParser("""\
-usage: %%prog %(name)s [options] ... test command args ...
-
+    parser = argparse.ArgumentParser(
+        prog=name, usage="%(prog)s [options] ... test command args ...",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description="""\
 Executes the given command against the latest published build. The syntax for
 commands (and exit code) is exactly the same as for the 'bisect' tool, so this
 command is useful for testing bisect test commands.
 
-See 'bisect' for more notermation on the exact test syntax.\
-""" % locals())
-
-    parser.add_option("-b", "--build", dest="build_name", metavar="STR",
-                      help="name of build to fetch",
-                      action="store", default=DEFAULT_BUILDER)
-    parser.add_option("-s", "--sandbox", dest="sandbox",
-                      help="directory to use as a sandbox",
-                      action="store", default=None)
-    parser.add_option("", "--min-rev", dest="min_rev",
-                      help="minimum revision to test",
-                      type="int", action="store", default=None)
-    parser.add_option("", "--max-rev", dest="max_rev",
-                      help="maximum revision to test",
-                      type="int", action="store", default=None)
-    parser.add_option("", "--near", dest="near_build",
-                      help="use a build near NAME",
-                      type="str", action="store", metavar="NAME", default=None)
-
-    parser.disable_interspersed_args()
-
-    (opts, args) = parser.parse_args(args)
+See 'bisect' for more notermation on the exact test syntax.""")
+
+    parser.add_argument("-b", "--build", dest="build_name", metavar="STR",
+                        help="name of build to fetch",
+                        action="store", default=DEFAULT_BUILDER)
+    parser.add_argument("-s", "--sandbox", dest="sandbox",
+                        help="directory to use as a sandbox",
+                        action="store", default=None)
+    parser.add_argument("--min-rev", dest="min_rev",
+                        help="minimum revision to test",
+                        type=int, action="store", default=None)
+    parser.add_argument("--max-rev", dest="max_rev",
+                        help="maximum revision to test",
+                        type=int, action="store", default=None)
+    parser.add_argument("--near", dest="near_build",
+                        help="use a build near NAME",
+                        type=str, action="store", metavar="NAME",
+                        default=None)
+    parser.add_argument("command", nargs=argparse.REMAINDER,
+                        help="test command and arguments")
+
+    opts = parser.parse_args(args)
+    args = opts.command
 
     if opts.build_name is None:
         parser.error("no build name given (see --build)")
@@ -643,8 +955,8 @@ See 'bisect' for more notermation on the exact test syntax.\
         opts.sandbox, opts.build_name, build, args, verbose=True,
         show_command_output=True)
 
-    print '%s: %s' % (('FAIL', 'PASS')[test_result],
-                      build.tobasename(include_suffix=False))
+    print('%s: %s' % (('FAIL', 'PASS')[test_result],
+                      build.tobasename(include_suffix=False)))
 
     raise SystemExit(test_result != True)
 
@@ -1,10 +1,23 @@
 """Integration with Google Cloud Storage.
 
 """
+import base64
+import collections
+import concurrent.futures
+import hashlib
+import io
 import os
+import tarfile
+import time
+
 import requests
 import urllib3
 
+try:
+    import google_crc32c
+except ImportError:
+    google_crc32c = None
+
 # Root URL to use for our queries.
 DEFAULT_GCS = "https://www.googleapis.com/storage/v1/"
 
@@ -15,6 +28,38 @@ DEFAULT_BUCKET = "llvm-build-artifacts"
 
 BUCKET = os.getenv("BUCKET", DEFAULT_BUCKET)
 
+# A bucket on a GCS compatible server.
+Source = collections.namedtuple('Source', ['server', 'bucket'])
+
+
+def parse_sources(spec):
+    """Parse a comma separated list of buckets, each given either by name, for
+    a bucket on GCS, or as a <server>/b/<bucket> URL.
+    """
+    sources = []
+    for entry in spec.split(','):
+        entry = entry.strip()
+        if not entry:
+            continue
+        if '://' not in entry:
+            sources.append(Source(GCS, entry))
+            continue
+        server, _, bucket = entry.rstrip('/').rpartition('/b/')
+        if not server or not bucket:
+            raise ValueError("invalid bucket URL: %r" % (entry,))
+        sources.append(Source(server + '/', bucket))
+    return sources
+
+# The buckets to look for builders in, in order of preference. More can be
+# added with EXTRA_BUCKETS.
+SOURCES = [Source(GCS, BUCKET)] + parse_sources(os.getenv("EXTRA_BUCKETS", ""))
+
+
+def get_objects_url(source=None):
+    if source is None:
+        source = SOURCES[0]
+    return source.server + "b/" + source.bucket + "/o"
+
 class HttpClient(object):
     def __init__(self):
         self.session = requests.Session()
@@ -31,51 +76,245 @@ class HttpClient(object):
 HTTP_CLIENT = HttpClient()
 
 
-def fetch_builders():
-    """Each build kind is stored as a folder in the GCS bucket.
-    List all the folders in the bucket, which is our list of possible
-    compilers.
-    """
+def list_folders(source):
+    """List all the folders in a bucket."""
     params = {'delimiter': "/", 'fields': "prefixes,nextPageToken"}
-    r = HTTP_CLIENT.get(GCS + "b/" + BUCKET + "/o", params=params)
+    folders = []
+    while True:
+        r = HTTP_CLIENT.get(get_objects_url(source), params=params)
+        r.raise_for_status()
+        reply_data = r.json()
+        folders.extend(reply_data.get('prefixes', []))
+        page_token = reply_data.get('nextPageToken')
+        if not page_token:
+            break
+        params['pageToken'] = page_token
+    return [x.replace("/", "") for x in folders]
+
+
+def fetch_builders(sources=None):
+    """Each build kind is stored as a folder in a GCS bucket.
+    List all the folders in all the buckets at once, which is our list of
+    possible compilers.
+
+    Returns a map of builder name to the source holding its builds. If several
+    buckets have the same builder, the first one in sources is used.
+    """
+    if sources is None:
+        sources = SOURCES
+    with concurrent.futures.ThreadPoolExecutor(len(sources)) as executor:
+        listings = list(executor.map(list_folders, sources))
+    builders = {}
+    for source, folders in zip(sources, listings):
+        for folder in folders:
+            builders.setdefault(folder, source)
+    return builders
+
+
+def builder_exists(project, source=None):
+    """Check whether a builder has any files, without listing them all."""
+    params = {'prefix': project + "/", 'maxResults': 1,
+              'fields': "items(name)"}
+    r = HTTP_CLIENT.get(get_objects_url(source), params=params)
     r.raise_for_status()
-    reply_data = r.json()
-    assert "nextPageToken" not in reply_data.keys(), "Too many builders!"
-    folders = reply_data['prefixes']
-    no_slashes = [x.replace("/", "") for x in folders]
-    return no_slashes
+    return bool(r.json().get('items'))
 
 
-def fetch_builds(project):
-    """Given a builder name, get the list of all the files stored for that
-    builder.
+def iter_build_pages(project, start_offset=None, page_token=None,
+                     source=None, match_glob=None):
+    """Given a builder name, yield (items, next_page_token) for each page of
+    files stored for that builder.
+
+    Listing starts at the first file whose name is lexicographically at or
+    after start_offset, if given, and resumes from page_token, if given. Only
+    files whose full name matches match_glob are listed, if given. The last
+    page has a next_page_token of None. The files are listed from the given
+    source, or the default bucket.
     """
     assert project is not None
-    all_data = {'items':[]}
     params = {'delimiter': "/",
              "fields": "nextPageToken,kind,items(name, mediaLink)",
              'prefix': project + "/"}
-    r = HTTP_CLIENT.get(GCS + "b/" + BUCKET + "/o", params=params)
-    r.raise_for_status()
-    reply_data = r.json()
-    all_data['items'].extend(reply_data['items'])
-    while reply_data.get('nextPageToken'):
-        params['pageToken'] = reply_data['nextPageToken']
-        r = HTTP_CLIENT.get(GCS + "b/" + BUCKET + "/o", params=params)
+    if start_offset is not None:
+        params['startOffset'] = start_offset
+    if match_glob is not None:
+        params['matchGlob'] = match_glob
+    while True:
+        if page_token is not None:
+            params['pageToken'] = page_token
+        r = HTTP_CLIENT.get(get_objects_url(source), params=params)
         r.raise_for_status()
         reply_data = r.json()
-        all_data['items'].extend(reply_data['items'])
+        page_token = reply_data.get('nextPageToken')
+        yield reply_data.get('items', []), page_token
+        if not page_token:
+            break
+
+
+def fetch_builds(project):
+    """Given a builder name, get the list of all the files stored for that
+    builder.
+    """
+    all_data = {'items':[]}
+    for items, _ in iter_build_pages(project):
+        all_data['items'].extend(items)
     return all_data
 
 #  Dunno what this could be moved up to?
 CHUNK_SIZE = 5124288
 
+# (connect, read) timeouts for downloads. The read timeout applies between
+# chunks, not to the whole download.
+DOWNLOAD_TIMEOUT = (10, 60)
+
+# How many times to resume a download after the connection breaks.
+MAX_DOWNLOAD_ATTEMPTS = 5
+
+
+class ChecksumError(Exception):
+    pass
+
+
+def parse_goog_hash(header):
+    """Parse an x-goog-hash header into a map of hash type to base64 value."""
+    hashes = {}
+    for part in header.split(','):
+        name, _, value = part.strip().partition('=')
+        if value:
+            hashes[name] = value
+    return hashes
+
+
+class ObjectDownload(object):
+    """
+    Iterate over the content of a GCS object in chunks.
+
+    If the connection breaks, the download resumes where it stopped with a
+    range request. Once all of the content has been read, it is verified
+    against the object's md5 and crc32c hashes from GCS. The sha256 of the
+    content is computed along the way.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.offset = 0
+        self.size = None
+        self.expected_hashes = None
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256()
+        self.crc32c = google_crc32c.Checksum() if google_crc32c else None
+
+    def __iter__(self):
+        attempt = 0
+        while True:
+            headers = {}
+            if self.offset:
+                headers['Range'] = 'bytes=%d-' % self.offset
+            try:
+                r = HTTP_CLIENT.get(self.url, headers=headers, stream=True,
+                                    timeout=DOWNLOAD_TIMEOUT)
+                r.raise_for_status()
+                if self.offset and r.status_code != 206:
+                    raise IOError("server ignored range request for %r" % (
+                        self.url,))
+                if self.expected_hashes is None:
+                    # The hashes are always those of the whole object.
+                    self.expected_hashes = parse_goog_hash(
+                        r.headers.get('x-goog-hash', ''))
+                if not self.offset and 'Content-Length' in r.headers:
+                    self.size = int(r.headers['Content-Length'])
+
+                for chunk in r.iter_content(CHUNK_SIZE):
+                    self.md5.update(chunk)
+                    self.sha256.update(chunk)
+                    if self.crc32c is not None:
+                        self.crc32c.update(chunk)
+                    self.offset += len(chunk)
+                    yield chunk
+            except (requests.exceptions.ConnectionError,
+                    requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError):
+                attempt += 1
+                if attempt >= MAX_DOWNLOAD_ATTEMPTS:
+                    raise
+                time.sleep(attempt)
+                continue
+            break
+        self.verify()
+
+    def verify(self):
+        if self.size is not None and self.offset != self.size:
+            raise ChecksumError("%r: expected %d bytes, got %d" % (
+                self.url, self.size, self.offset))
+        expected = self.expected_hashes or {}
+        actual = {'md5': base64.b64encode(self.md5.digest()).decode()}
+        if self.crc32c is not None:
+            actual['crc32c'] = base64.b64encode(self.crc32c.digest()).decode()
+        for name, value in actual.items():
+            if name in expected and expected[name] != value:
+                raise ChecksumError("%r: %s mismatch, expected %s, got %s" % (
+                    self.url, name, expected[name], value))
+
+
+class ChunkReader(io.RawIOBase):
+    """A file-like object that reads from an iterator of chunks.
+
+    Reads are served from a view of the current chunk, so reading a chunk in
+    small pieces doesn't copy the rest of it each time.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.chunk = memoryview(b'')
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.chunk:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            self.chunk = memoryview(chunk)
+        size = min(len(buffer), len(self.chunk))
+        buffer[:size] = self.chunk[:size]
+        self.chunk = self.chunk[size:]
+        return size
+
+    def drain(self):
+        """Read the rest of the chunks, e.g. to get them verified."""
+        for _ in self.chunks:
+            pass
+        self.chunk = memoryview(b'')
+
 
 def get_compiler(url, filename):
     """Get the compiler at the url, and save to filename."""
-    r = HTTP_CLIENT.get(url)
-    r.raise_for_status()
     with open(filename, 'wb') as fd:
-        for chunk in r.iter_content(CHUNK_SIZE):
+        for chunk in ObjectDownload(url):
             fd.write(chunk)
     return filename
+
+
+def stream_compiler(url, path):
+    """
+    Get the compiler tarball at the url and extract it to path as it is
+    downloaded, without writing the tarball to disk.
+
+    Returns the sha256 of the tarball.
+    """
+    download = ObjectDownload(url)
+    reader = ChunkReader(download)
+    archive = tarfile.open(fileobj=reader, mode='r|*')
+    try:
+        # Refuse members that would land outside of path. The 'tar' filter
+        # keeps the modes and symlinks the builds rely on.
+        if hasattr(tarfile, 'tar_filter'):
+            archive.extractall(path, filter='tar')
+        else:
+            archive.extractall(path)
+    finally:
+        archive.close()
+    # Read any trailing padding, which verifies the download.
+    reader.drain()
+    return download.sha256.hexdigest()
@@ -1,19 +1,35 @@
 """Utilities for accessing stuff from llvmlab."""
 
+import contextlib
+import fcntl
+import functools
+import hashlib
 import json
 import os
 import re
 import shutil
+import stat
+import tempfile
+import threading
 import time
 
 from . import shell
 from . import util
 from . import gcs
 
-from util import fatal
+from .util import fatal, warning
 
 
 class BuilderMap(object):
+    """
+    A map of builder names to the bucket holding their builds.
+
+    Each builder has its own timestamp of when it was last seen on the server,
+    so a builder whose entry expired can be checked on its own. Listing all
+    the buckets, which finds new builders, is only needed once the whole map
+    expires.
+    """
+
     # Expire the buildermap after 24 hours.
     expiration_time = 24 * 60 * 60
 
@@ -21,26 +37,575 @@ class BuilderMap(object):
     def frompath(klass, path):
         with open(path) as f:
             data = json.load(f)
-        return klass(data['builders'], data['timestamp'])
+        builders = dict((name, entry)
+                        for name, entry in data['builders'].items()
+                        if isinstance(entry, dict))
+        timestamp = data['timestamp']
+        # Maps written by older versions have no sources, relist them.
+        if len(builders) != len(data['builders']):
+            timestamp = 0
+        return klass(builders, timestamp)
+
+    @classmethod
+    def fromsources(klass, sources, timestamp):
+        builders = dict((name, {'source': list(source),
+                                'timestamp': timestamp})
+                        for name, source in sources.items())
+        return klass(builders, timestamp)
 
     def __init__(self, builders, timestamp):
+        # Map of builder name to its source and timestamp.
         self.builders = builders
         self.timestamp = timestamp
 
     def topath(self, path):
-        with open(path, 'w') as f:
+        # Write to a temporary file first, so readers never see a partial map.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w') as f:
             data = {'builders': self.builders,
                     'timestamp': self.timestamp}
             json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def get_source(self, name):
+        entry = self.builders.get(name)
+        if entry is None:
+            return None
+        return gcs.Source(*entry['source'])
+
+    def is_expired(self):
+        return time.time() > self.timestamp + self.expiration_time
+
+    def is_builder_expired(self, name):
+        return time.time() > (self.builders[name]['timestamp'] +
+                              self.expiration_time)
+
+    def touch(self, name):
+        self.builders[name]['timestamp'] = time.time()
+
+class BuildIndex(object):
+    """
+    A persistent local index of the builds stored for a builder.
+
+    Refreshing the index only lists the objects that can be newer than the
+    newest indexed build, and a full listing is only redone once the index
+    expires. The index is saved once per refresh, and an interrupted listing
+    resumes from its page token.
+    """
+
+    # Do a full listing after 24 hours, to pick up builds that were uploaded
+    # out of order.
+    expiration_time = 24 * 60 * 60
+
+    def __init__(self, builder, path, source=None):
+        if source is None:
+            source = gcs.SOURCES[0]
+        self.builder = builder
+        self.path = path
+        self.source = source
+        # Map of object name to media link.
+        self.items = {}
+        # Time of the last completed full listing.
+        self.timestamp = 0
+        # State of an interrupted refresh, if any: whether it is a full
+        # listing, and the [start_offset, match_glob, page_token] of the
+        # listings it has left.
+        self.listing = None
+
+        if os.path.exists(path):
+            with open(path) as f:
+                data = json.load(f)
+            # Start over if the builder moved to another bucket.
+            stored_source = gcs.SOURCES[0]
+            if data.get('source') is not None:
+                stored_source = gcs.Source(*data['source'])
+            if stored_source == source:
+                self.items = data['items']
+                self.timestamp = data['timestamp']
+                listing = data.get('listing')
+                # Ignore listings saved in an older format.
+                if listing is not None and 'listings' in listing:
+                    self.listing = listing
+
+    def save(self):
+        data = {'items': self.items,
+                'timestamp': self.timestamp,
+                'listing': self.listing,
+                'source': self.source}
+        shell.mkdir_p(os.path.dirname(self.path))
+        # Write to a temporary file first, so readers never see a partial
+        # index.
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.path))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmp_path, self.path)
 
     def is_expired(self):
         return time.time() > self.timestamp + self.expiration_time
 
+    def get_incremental_listings(self):
+        """
+        get_incremental_listings() -> [[start_offset, match_glob, None], ...]
+
+        Get the listings that find the builds newer than the newest indexed one.
+
+        Names sort lexicographically, so a newer build whose revision has as
+        many digits sorts after the newest build. A revision with more digits,
+        e.g. clang-d100000 after clang-d99999, can sort anywhere, so those
+        names are listed with a glob.
+        """
+        try:
+            newest = max(self.items, key=Build.frombasename)
+        except TypeError:
+            # Mixed naming schemes, whose revisions don't compare.
+            return [[max(self.items), None, None]]
+        build = Build.frombasename(newest)
+        basename = os.path.basename(newest)
+        m = None
+        if isinstance(build.revision, int):
+            m = re.search(r'-%s(%d)\b' % (build.revision_prefix, build.revision),
+                          basename)
+        if m is None:
+            return [[max(self.items), None, None]]
+
+        prefix = _escape_glob(newest[:len(newest) - len(basename) + m.start(1)])
+        digits = len(m.group(1))
+        return [[newest, prefix + '[0-9]' * digits + '[!0-9]*', None],
+                [None, prefix + '[0-9]' * (digits + 1) + '*', None]]
+
+    def refresh(self):
+        """Add any builds that are new on the server to the index."""
+        if self.listing is None:
+            if self.is_expired() or not self.items:
+                self.listing = {'full': True,
+                                'listings': [[None, None, None]]}
+            else:
+                self.listing = {'full': False,
+                                'listings': self.get_incremental_listings()}
+
+        num_new = 0
+        try:
+            listings = self.listing['listings']
+            while listings:
+                start_offset, match_glob, page_token = listings[0]
+                for items, page_token in gcs.iter_build_pages(
+                        self.builder, start_offset, page_token, self.source,
+                        match_glob):
+                    for item in items:
+                        if item['name'] not in self.items:
+                            self.items[item['name']] = item['mediaLink']
+                            num_new += 1
+                    listings[0][2] = page_token
+                listings.pop(0)
+
+            if self.listing['full']:
+                self.timestamp = time.time()
+            self.listing = None
+        finally:
+            # Also save an interrupted listing, so it can be resumed.
+            self.save()
+        return num_new
+
+
+def _escape_glob(text):
+    """Escape the characters of text that are special in a GCS match glob."""
+    return re.sub(r'([][*?{}\\])', r'[\1]', text)
+
+
+class BuildPrefetcher(object):
+    """
+    Downloads builds in the background, so they are ready by the time a bisect
+    gets to test them.
+    """
+
+    # How long close() waits for the downloads to stop before removing them.
+    close_timeout = 30
+
+    def __init__(self):
+        self.path = tempfile.mkdtemp(prefix='llvmlab-prefetch-')
+        self.lock = threading.Lock()
+        # Map of build basename to (thread, download path, state).
+        self.downloads = {}
+        # The threads of all downloads, including discarded ones that may
+        # still be running.
+        self.threads = []
+
+    def _download(self, build, download_path, state):
+        try:
+            with open(download_path, 'wb') as f:
+                for chunk in gcs.ObjectDownload(build.url):
+                    # Discarded downloads stop at the next chunk.
+                    if state['discarded']:
+                        break
+                    f.write(chunk)
+                else:
+                    state['ok'] = True
+        except Exception as e:
+            warning('unable to prefetch %r: %s' % (build.tobasename(), e))
+        with self.lock:
+            if state['discarded'] and os.path.exists(download_path):
+                os.remove(download_path)
+
+    def prefetch(self, builds):
+        """Start downloading builds, and drop unused prefetches of others."""
+        wanted = set(build.tobasename() for build in builds)
+        with self.lock:
+            for name, (thread, download_path, state) in \
+                    list(self.downloads.items()):
+                if name in wanted:
+                    continue
+                # The bisect went the other way, this build is not needed.
+                state['discarded'] = True
+                if not thread.is_alive() and os.path.exists(download_path):
+                    os.remove(download_path)
+                del self.downloads[name]
+
+            for build in builds:
+                name = build.tobasename()
+                if name in self.downloads or build.url is None:
+                    continue
+                download_path = os.path.join(self.path, name)
+                state = {'ok': False, 'discarded': False}
+                thread = threading.Thread(target=self._download,
+                                          args=(build, download_path, state))
+                thread.daemon = True
+                thread.start()
+                self.downloads[name] = (thread, download_path, state)
+                self.threads.append(thread)
+            self.threads = [thread for thread in self.threads
+                            if thread.is_alive()]
+
+    def take(self, build, root_path):
+        """
+        take(build, root_path) -> bool
+
+        Move the prefetched download of build to root_path, waiting for it to
+        finish if needed. Returns False if the build was not prefetched.
+        """
+        with self.lock:
+            download = self.downloads.pop(build.tobasename(), None)
+        if download is None:
+            return False
+        thread, download_path, state = download
+        thread.join()
+        if not state['ok']:
+            return False
+        shutil.move(download_path, root_path)
+        return True
+
+    def close(self, timeout=None):
+        """
+        Stop the downloads and remove them. Downloads still running after
+        timeout seconds, e.g. waiting on a stalled connection, are left to
+        fail once their files are gone.
+        """
+        if timeout is None:
+            timeout = self.close_timeout
+        with self.lock:
+            for thread, download_path, state in self.downloads.values():
+                state['discarded'] = True
+            self.downloads = {}
+            threads, self.threads = self.threads, []
+        deadline = time.time() + timeout
+        for thread in threads:
+            thread.join(max(0, deadline - time.time()))
+        shutil.rmtree(self.path, ignore_errors=True)
+
+
+def link_tree(src_path, dst_path):
+    """
+    Recreate the directory tree at src_path at dst_path, hardlinking files
+    instead of copying them where possible.
+    """
+    os.mkdir(dst_path)
+    for root, dirs, files in os.walk(src_path):
+        dst_root = os.path.join(dst_path, os.path.relpath(root, src_path))
+        for name in dirs + files:
+            src = os.path.join(root, name)
+            dst = os.path.join(dst_root, name)
+            if os.path.islink(src):
+                os.symlink(os.readlink(src), dst)
+            elif os.path.isdir(src):
+                os.mkdir(dst)
+            else:
+                try:
+                    os.link(src, dst)
+                except OSError:
+                    # E.g. the sandbox is on a different file system.
+                    shutil.copy2(src, dst)
+
+
+def get_tree_size(path):
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            size += os.lstat(os.path.join(root, name)).st_size
+    return size
+
+
+def get_tree_fingerprint(path):
+    """
+    Hash the names, sizes, modes and modification times of the files in the
+    tree at path, to detect changes made to them through hardlinks.
+    """
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            st = os.lstat(file_path)
+            digest.update(("%s\0%d\0%d\0%d\n" % (
+                os.path.relpath(file_path, path), st.st_size, st.st_mode,
+                st.st_mtime_ns)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def get_file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# The manifest of tool locations written into the root of extracted builds.
+MANIFEST_NAME = '.llvmlab-manifest.json'
+MANIFEST_VERSION = 1
+
+# Tools that are always looked for in builds. More can be listed in the
+# "tools" pref.
+DEFAULT_TOOLS = ['clang', 'clang++', 'libLTO.dylib']
+DEFAULT_EXTRA_TOOLS = 'lld, llc, opt'
+
+
+def get_tools():
+    """Get the names of the tools to look for in builds."""
+    prefs = util.get_prefs()
+    tools = list(DEFAULT_TOOLS)
+    for name in prefs.get("ci", "tools", DEFAULT_EXTRA_TOOLS).split(','):
+        name = name.strip()
+        if name and name not in tools:
+            tools.append(name)
+    return tools
+
+
+def scan_build_tools(path, tools):
+    """
+    scan_build_tools(path, tools) -> {tool: relative path or None}
+
+    Find the tools in the build extracted at path, in a single pass over its
+    tree. The first file with a tool's name is taken.
+    """
+    found = dict((name, None) for name in tools)
+    missing = set(tools)
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if name in missing:
+                found[name] = os.path.relpath(os.path.join(root, name), path)
+                missing.remove(name)
+        if not missing:
+            break
+    return found
+
+
+def write_build_manifest(path, tools=None):
+    """Scan the build extracted at path and record its tools in a manifest."""
+    if tools is None:
+        tools = get_tools()
+    found = scan_build_tools(path, tools)
+    fd, tmp_path = tempfile.mkstemp(dir=path, prefix=MANIFEST_NAME + '.')
+    with os.fdopen(fd, 'w') as f:
+        json.dump({'version': MANIFEST_VERSION, 'tools': found}, f, indent=2)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, os.path.join(path, MANIFEST_NAME))
+    return found
+
+
+def load_build_manifest(path, tools=None):
+    """
+    load_build_manifest(path, tools=None) -> {tool: path or None}
+
+    Get the paths of the tools in the build extracted at path from its
+    manifest. The build is only scanned if it has no manifest yet, or if the
+    manifest was written before some of the tools were configured.
+    """
+    if tools is None:
+        tools = get_tools()
+    found = None
+    try:
+        with open(os.path.join(path, MANIFEST_NAME)) as f:
+            data = json.load(f)
+        if data.get('version') == MANIFEST_VERSION and \
+                all(name in data['tools'] for name in tools):
+            found = data['tools']
+    except (IOError, ValueError):
+        pass
+    if found is None:
+        try:
+            found = write_build_manifest(path, tools)
+        except (IOError, OSError):
+            # E.g. the build is read-only.
+            found = scan_build_tools(path, tools)
+    return dict((name, os.path.join(path, found[name])
+                 if found.get(name) else None)
+                for name in tools)
+
+
+class ExtractedBuildCache(object):
+    """
+    A cache of extracted builds, shared by all llvmlab processes on a machine.
+
+    Each build is extracted once, into a directory named by the hash of its
+    tarball, so identical builds are only stored once. Sandboxes get a
+    hardlinked copy of the cached tree, whose files are made read-only so tests
+    can't modify the cache through them by accident. A test could still make a
+    file writable and change it, so the cached tree is checked against the
+    fingerprint taken when it was extracted before each use, and dropped if it
+    changed. The least recently used builds are evicted once the cache grows
+    beyond its maximum size.
+    """
+
+    # Default maximum size of the cache, in GB.
+    default_max_size = 20
+
+    @classmethod
+    def fromprefs(klass, prefs):
+        max_size = float(prefs.get("ci", "build_cache_size",
+                                   klass.default_max_size))
+        return klass(os.path.join(prefs.path, "ci", "extracted_builds"),
+                     int(max_size * (1 << 30)))
+
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.objects_path = os.path.join(path, "objects")
+        self.index_path = os.path.join(path, "index.json")
+        shell.mkdir_p(self.objects_path)
+
+    @contextlib.contextmanager
+    def locked_index(self):
+        """
+        Lock the cache against other processes and yield its index, which is
+        saved when the block exits.
+        """
+        with open(os.path.join(self.path, "lock"), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            index = {'names': {}, 'entries': {}}
+            if os.path.exists(self.index_path):
+                with open(self.index_path) as f:
+                    index = json.load(f)
+
+            yield index
+
+            fd, tmp_path = tempfile.mkstemp(dir=self.path)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(index, f)
+            os.rename(tmp_path, self.index_path)
+
+    def link(self, builder, build, dst_path):
+        """
+        link(builder, build, dst_path) -> bool
+
+        Link the cached extracted build to dst_path. Returns False if the build
+        is not in the cache.
+        """
+        name = "%s/%s" % (builder, build.tobasename())
+        with self.locked_index() as index:
+            key = index['names'].get(name)
+            object_path = os.path.join(self.objects_path, str(key))
+            if key not in index['entries'] or not os.path.exists(object_path):
+                return False
+            entry = index['entries'][key]
+            if entry.get('fingerprint') != get_tree_fingerprint(object_path):
+                warning('cached build %r was modified, fetching it again' % (
+                    name,))
+                shutil.rmtree(object_path, ignore_errors=True)
+                del index['entries'][key]
+                del index['names'][name]
+                return False
+            entry['last_used'] = time.time()
+            link_tree(object_path, dst_path)
+        return True
+
+    def add(self, builder, build, tarball_path):
+        """Extract the build tarball into the cache, if it isn't there yet."""
+        name = "%s/%s" % (builder, build.tobasename())
+        key = get_file_digest(tarball_path)
+        object_path = os.path.join(self.objects_path, key)
+        with self.locked_index() as index:
+            if key in index['entries'] and os.path.exists(object_path):
+                index['names'][name] = key
+                return
+
+        # Extract without holding the lock, so other processes can use the
+        # cache in the meantime.
+        tmp_path = tempfile.mkdtemp(dir=self.path, prefix="extract-")
+        if shell.execute(['tar', '-xf', tarball_path, '-C', tmp_path]):
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            fatal('unable to extract %r to %r' % (tarball_path, tmp_path))
+        self._insert(name, key, tmp_path)
+
+    def add_from_url(self, builder, build, url):
+        """Download and extract the build into the cache in one pass."""
+        name = "%s/%s" % (builder, build.tobasename())
+        tmp_path = tempfile.mkdtemp(dir=self.path, prefix="extract-")
+        try:
+            key = gcs.stream_compiler(url, tmp_path)
+        except:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+        self._insert(name, key, tmp_path)
+
+    def _insert(self, name, key, tmp_path):
+        """Move an extracted build into the cache."""
+        object_path = os.path.join(self.objects_path, key)
+        # Linked copies of the build get the manifest too.
+        write_build_manifest(tmp_path)
+        for root, dirs, files in os.walk(tmp_path):
+            for file_name in files:
+                file_path = os.path.join(root, file_name)
+                if not os.path.islink(file_path):
+                    mode = os.stat(file_path).st_mode
+                    os.chmod(file_path, mode & ~(stat.S_IWUSR | stat.S_IWGRP |
+                                                 stat.S_IWOTH))
+        size = get_tree_size(tmp_path)
+        fingerprint = get_tree_fingerprint(tmp_path)
+
+        with self.locked_index() as index:
+            if key in index['entries'] and os.path.exists(object_path):
+                # Another process extracted the same build first.
+                shutil.rmtree(tmp_path, ignore_errors=True)
+            else:
+                os.rename(tmp_path, object_path)
+                index['entries'][key] = {'size': size,
+                                         'fingerprint': fingerprint,
+                                         'last_used': time.time()}
+            index['names'][name] = key
+            self._evict(index, key)
+
+    def _evict(self, index, keep_key):
+        entries = index['entries']
+        total_size = sum(entry['size'] for entry in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k]['last_used']):
+            if total_size <= self.max_size:
+                break
+            if key == keep_key:
+                continue
+            shutil.rmtree(os.path.join(self.objects_path, key),
+                          ignore_errors=True)
+            total_size -= entries.pop(key)['size']
+        index['names'] = dict((name, key)
+                              for name, key in index['names'].items()
+                              if key in entries)
+
+
 BUILD_NAME_REGEX = re.compile(
     r"((apple-)?clang)-([0-9]+)(\.([0-9]+))?(\.([0-9]+))?"
     r"-([A-Z][A-Za-z]+)(\.(.*))?")
 
 
+@functools.total_ordering
 class Build(object):
     @staticmethod
     def frombasename(str, url=None):
@@ -139,39 +704,50 @@ class Build(object):
                          (self.name, self.revision, self.sha, self.timestamp,
                           self.build, self.suffix))
 
-    def __cmp__(self, other):
-        return cmp((self.revision, self.timestamp,
-                    self.build, self.suffix, self.name),
-                   ((other.revision, other.timestamp,
-                    other.build, other.suffix, other.name)))
+    def _sort_key(self):
+        # Unknown fields sort first.
+        return tuple((value is not None, value)
+                     for value in (self.revision, self.timestamp,
+                                   self.build, self.suffix, self.name))
+
+    def __eq__(self, other):
+        return self._sort_key() == other._sort_key()
+
+    def __lt__(self, other):
+        return self._sort_key() < other._sort_key()
+
+    def __hash__(self):
+        return hash(self._sort_key())
+
 
+def get_builder_map_path():
+    return os.path.join(util.get_prefs().path, "ci", "build_map.json")
 
-def load_builder_map(reload=False):
+
+def load_builder_map(reload=False, allow_expired=False):
     """
     load_builder_map() -> BuilderMap
 
     Load a map of builder names to the server url that holds those artifacts.
+    The buckets are listed again if the map expired, unless allow_expired is
+    set, or if reload is set.
     """
 
-    prefs = util.get_prefs()
-
     # Load load the builder map if present (and not reloading)
-    data_path = os.path.join(prefs.path, "ci")
-    buildermap_path = os.path.join(data_path, "build_map.json")
+    buildermap_path = get_builder_map_path()
+    data_path = os.path.dirname(buildermap_path)
     if not reload and os.path.exists(buildermap_path):
         buildermap = BuilderMap.frompath(buildermap_path)
 
         # If the buildermap is not out-of-date, return it.
-        if not buildermap.is_expired():
+        if allow_expired or not buildermap.is_expired():
             return buildermap
 
-    # Otherwise, we didn't have a buildermap or it is out of date, compute it.
-    builders = {}
-    for build in gcs.fetch_builders():
-        builders[build] = build
+    # Otherwise, we didn't have a buildermap or it is out of date, compute it
+    # by listing all the buckets.
+    buildermap = BuilderMap.fromsources(gcs.fetch_builders(), time.time())
 
-    # Create the buildermap and save it.
-    buildermap = BuilderMap(builders, time.time())
+    # Save the buildermap.
     if not os.path.exists(data_path):
         shell.mkdir_p(data_path)
     buildermap.topath(buildermap_path)
@@ -179,6 +755,34 @@ def load_builder_map(reload=False):
     return buildermap
 
 
+def get_builder_source(name):
+    """
+    get_builder_source(name) -> gcs.Source
+
+    Get the bucket holding the builds of the named builder. When the builder's
+    entry in the builder map expires, only that builder is checked again. The
+    whole map is only reloaded if the builder isn't known, or is gone.
+    """
+    buildermap = load_builder_map(allow_expired=True)
+    source = buildermap.get_source(name)
+    if source is not None and buildermap.is_builder_expired(name):
+        if gcs.builder_exists(name, source):
+            buildermap.touch(name)
+            buildermap.topath(get_builder_map_path())
+        else:
+            source = None
+
+    # If the builder isn't in the builder map, do a forced reload of the
+    # builder map.
+    if source is None:
+        source = load_builder_map(reload=True).get_source(name)
+
+    # If the builder doesn't exist, report an error.
+    if source is None:
+        fatal("unknown builder name: %r" % (name,))
+    return source
+
+
 def fetch_builders():
     """
     fetch_builders() -> [builder-name, ...]
@@ -209,24 +813,16 @@ def fetch_builds(name):
         cache_build_path = os.path.join(cache_path, name)
         items = os.listdir(cache_build_path)
         assert False, "Unimplemented?" + str(items)
-    # Otherwise, load the builder map.
-    buildermap = load_builder_map()
+    # Otherwise, find the bucket with the builder's builds.
+    source = get_builder_source(name)
 
-    # If the builder isn't in the builder map, do a forced load of the builder
-    # map.
-    if name not in buildermap.builders:
-        buildermap = load_builder_map(reload=True)
-
-    # If the builder doesn't exist, report an error.
-    builder_artifacts = buildermap.builders.get(name)
-    if builder_artifacts is None:
-        fatal("unknown builder name: %r" % (name,))
-
-    # Otherwise, load the builder list.
-    server_builds = gcs.fetch_builds(builder_artifacts)
+    # Refresh the local index of the builder's builds.
+    index_path = os.path.join(prefs.path, "ci", "build_index", name + ".json")
+    build_index = BuildIndex(name, index_path, source)
+    build_index.refresh()
     builds = []
-    for path in server_builds['items']:
-        build = Build.frombasename(path['name'], path['mediaLink'])
+    for name, media_link in build_index.items.items():
+        build = Build.frombasename(name, media_link)
 
         # Ignore any links which don't at least have a revision component.
         if build.revision is not None:
@@ -242,41 +838,65 @@ def fetch_builds(name):
     return builds
 
 
-def fetch_build_to_path(builder, build, root_path, builddir_path):
+def fetch_build_to_path(builder, build, root_path, builddir_path,
+                        prefetcher=None):
+    """
+    Fetch the build tarball to root_path and extract it to builddir_path.
+
+    If the build cache is enabled, builddir_path is linked from the cached
+    extracted build instead, and the tarball is only downloaded if the build
+    is not cached yet.
+    """
     path = build.tobasename()
 
-    # Check whether we are using a build cache and get the cached build path if
-    # so.
+    # Check whether we are using a build cache and use the cached build if so.
     prefs = util.get_prefs()
+    build_cache = None
     cache_build_path = None
     if prefs.getboolean("ci", "cache_builds"):
+        build_cache = ExtractedBuildCache.fromprefs(prefs)
+        if build_cache.link(builder, build, builddir_path):
+            return
+        # Tarballs cached by older versions of llvmlab.
         cache_path = os.path.join(prefs.path, "ci", "build_cache")
         cache_build_path = os.path.join(cache_path, builder, path)
 
     # Copy the build from the cache or download it.
     if cache_build_path and os.path.exists(cache_build_path):
         shutil.copy(cache_build_path, root_path)
+    elif prefetcher is not None and prefetcher.take(build, root_path):
+        pass
+    elif prefs.getboolean("ci", "stream_builds", True):
+        # Check that the builder exists.
+        get_builder_source(builder)
+
+        # Extract the build while it is being downloaded.
+        try:
+            if build_cache is not None:
+                build_cache.add_from_url(builder, build, build.url)
+                if build_cache.link(builder, build, builddir_path):
+                    return
+            else:
+                os.mkdir(builddir_path)
+                gcs.stream_compiler(build.url, builddir_path)
+                write_build_manifest(builddir_path)
+                return
+        except Exception as e:
+            shutil.rmtree(builddir_path, ignore_errors=True)
+            fatal('unable to download and extract %r: %s' % (path, e))
+        gcs.get_compiler(build.url, root_path)
     else:
-        # Load the builder map.
-        buildermap = load_builder_map()
-
-        # If the builder isn't in the builder map, do a forced reload of the
-        # builder map.
-        if builder not in buildermap.builders:
-            buildermap = load_builder_map(reload=True)
-
-        # If the builder doesn't exist, report an error.
-        builder_artifacts = buildermap.builders.get(builder)
-        if builder_artifacts is None:
-            fatal("unknown builder name: %r" % (builder,))
+        # Check that the builder exists.
+        get_builder_source(builder)
 
         # Otherwise create the build url.
         gcs.get_compiler(build.url, root_path)
 
-        # Copy the build into the cache, if enabled.
-        if cache_build_path is not None:
-            shell.mkdir_p(os.path.dirname(cache_build_path))
-            shutil.copy(root_path, cache_build_path)
+    # Add the build to the cache, if enabled, and use the cached copy.
+    if build_cache is not None:
+        build_cache.add(builder, build, root_path)
+        if build_cache.link(builder, build, builddir_path):
+            return
 
     # Create the directory for the build.
     os.mkdir(builddir_path)
@@ -284,3 +904,4 @@ def fetch_build_to_path(builder, build, root_path, builddir_path):
     # Extract the build.
     if shell.execute(['tar', '-xf', root_path, '-C', builddir_path]):
         fatal('unable to extract %r to %r' % (root_path, builddir_path))
+    write_build_manifest(builddir_path)
@@ -37,23 +37,24 @@ class Tool(object):
                              if name.startswith('action_'))
 
     def usage(self, name):
-        print >>sys.stderr, "Usage: %s command [options]" % (
-            os.path.basename(name))
-        print >>sys.stderr
-        print >>sys.stderr, "Available commands:"
+        print("Usage: %s command [options]" % (
+            os.path.basename(name)), file=sys.stderr)
+        print(file=sys.stderr)
+        print("Available commands:", file=sys.stderr)
         cmds_width = max(map(len, self.commands))
         for name, func in sorted(self.commands.items()):
             if name.endswith("-debug"):
                 continue
 
-            print >>sys.stderr, "  %-*s - %s" % (cmds_width, name,
-                                                 func.__doc__)
+            print("  %-*s - %s" % (cmds_width, name, func.__doc__),
+                  file=sys.stderr)
         sys.exit(1)
 
     def main(self, args):
         if len(args) < 2 or args[1] not in self.commands:
             if len(args) >= 2:
-                print >>sys.stderr, "error: invalid command %r\n" % args[1]
+                print("error: invalid command %r\n" % args[1],
+                      file=sys.stderr)
             self.usage(args[0])
 
         cmd = args[1]
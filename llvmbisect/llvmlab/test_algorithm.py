@@ -0,0 +1,107 @@
+import asyncio
+import itertools
+import unittest
+
+from . import algorithm
+
+
+def make_evaluate(predicate, jobs, rounds):
+    """Make an evaluate function for the parallel searches, which checks that
+    they test at most jobs items at once and records each round."""
+    def evaluate(items):
+        assert 0 < len(items) <= jobs, (items, jobs)
+        rounds.append(items)
+        return [predicate(item) for item in items]
+    return evaluate
+
+
+class TestParallelSearch(unittest.TestCase):
+
+    # (number of items, jobs) to compare, for every position of the first
+    # passing item, including none.
+    cases = [(n, jobs) for n in range(0, 34) for jobs in (1, 2, 3, 4, 7)]
+
+    def test_parallel_bisect(self):
+        for n, jobs in self.cases:
+            for first in range(n + 1):
+                items = list(range(n))
+                predicate = lambda item: item >= first
+                rounds = []
+                result = algorithm.parallel_bisect(
+                    make_evaluate(predicate, jobs, rounds), items, jobs)
+                expected = algorithm.bisect(predicate, items)
+                # bisect() assumes the last item passes, so it returns it
+                # when none does.
+                self.assertEqual(result, expected, (n, jobs, first))
+                # No item is tested twice.
+                tested = list(itertools.chain(*rounds))
+                self.assertEqual(len(tested), len(set(tested)),
+                                 (n, jobs, first))
+
+    def test_parallel_bisect_rounds(self):
+        for n, jobs in [(1000, 1), (1000, 3), (1000, 7), (5000, 15)]:
+            rounds = []
+            algorithm.parallel_bisect(
+                make_evaluate(lambda item: item >= 617, jobs, rounds),
+                list(range(n)), jobs)
+            # Each round narrows the range down to one of jobs + 1 segments.
+            max_rounds = 1
+            while (jobs + 1) ** (max_rounds - 1) < n:
+                max_rounds += 1
+            self.assertLessEqual(len(rounds), max_rounds, (n, jobs))
+
+    def test_parallel_gallop(self):
+        for n, jobs in self.cases:
+            for first in range(n + 1):
+                items = list(range(n))
+                predicate = lambda item: item >= first
+                rounds = []
+                result = algorithm.parallel_gallop(
+                    make_evaluate(predicate, jobs, rounds), items, jobs)
+                self.assertEqual(result, algorithm.gallop(predicate, items),
+                                 (n, jobs, first))
+
+
+class TestEvaluateConcurrently(unittest.TestCase):
+
+    def run_evaluate(self, num_items, first, delays):
+        started, finished = [], []
+
+        async def predicate(item):
+            started.append(item)
+            await asyncio.sleep(delays[item] * 0.001)
+            finished.append(item)
+            return item >= first
+
+        results = asyncio.run(algorithm.evaluate_concurrently(
+            predicate, list(range(num_items))))
+        return results, started, finished
+
+    def test_results(self):
+        # Each item finishes after the given number of milliseconds.
+        for delays in [(1, 2, 3, 4, 5, 6), (6, 5, 4, 3, 2, 1),
+                       (3, 1, 4, 1, 5, 9), (2, 7, 1, 8, 2, 8)]:
+            for first in range(len(delays) + 1):
+                results, started, _ = self.run_evaluate(len(delays), first,
+                                                        delays)
+                # Cancelled evaluations get the results implied by
+                # monotonicity.
+                self.assertEqual(results,
+                                 [i >= first for i in range(len(delays))],
+                                 (delays, first))
+                self.assertEqual(sorted(started), list(range(len(delays))))
+
+    def test_cancel(self):
+        # Item 1 passes first, so the slow items after it are cancelled.
+        results, _, finished = self.run_evaluate(4, 1, (1, 2, 500, 500))
+        self.assertEqual(results, [False, True, True, True])
+        self.assertEqual(finished, [0, 1])
+
+        # Item 2 fails first, so the slow items before it are cancelled.
+        results, _, finished = self.run_evaluate(4, 3, (500, 500, 1, 2))
+        self.assertEqual(results, [False, False, False, True])
+        self.assertEqual(finished, [2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
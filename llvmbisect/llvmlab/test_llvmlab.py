@@ -1,16 +1,26 @@
 # RUN: pythong test_llvmlab.py
 import unittest
 
+import asyncio
+import fnmatch
+import io
 import os
 import shutil
+import tarfile
 import tempfile
+import threading
+import time
+from unittest import mock
+
 from . import ci
+from . import gcs
+from . import llvmlab
 
 class TestLLVMLabCI(unittest.TestCase):
 
     def setUp(self):
         self.workdir = tempfile.mkdtemp()
-        print self.workdir
+        print(self.workdir)
         os.chdir(self.workdir)
 
     def tearDown(self):
@@ -45,6 +55,499 @@ class TestLLVMLabCI(unittest.TestCase):
         self.assertTrue(os.path.isdir(path), "Fetch did not get a compiler?")
 
 
+class FakeGCSResponse(object):
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class FakeGCS(object):
+    """Serves object listings, two objects per page."""
+
+    def __init__(self, names):
+        self.names = list(names)
+        self.listed = []
+        self.fail_after = None
+
+    def get(self, url, params):
+        if self.fail_after is not None and len(self.listed) >= self.fail_after:
+            raise IOError("connection reset")
+        names = sorted(name for name in self.names
+                       if name.startswith(params['prefix'])
+                       and name >= params.get('startOffset', '')
+                       and fnmatch.fnmatchcase(name,
+                                               params.get('matchGlob', '*')))
+        start = int(params.get('pageToken', 0))
+        page = names[start:start + 2]
+        self.listed.extend(page)
+        data = {'items': [{'name': name, 'mediaLink': 'link/' + name}
+                          for name in page]}
+        if start + 2 < len(names):
+            data['nextPageToken'] = str(start + 2)
+        return FakeGCSResponse(data)
+
+
+class TestBuildIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.index_path = os.path.join(self.workdir, "index.json")
+        self.server = FakeGCS("builder/clang-d%d-g%x.tar.gz" % (distance, distance)
+                              for distance in range(99990, 100000))
+        patcher = mock.patch.object(gcs, 'HTTP_CLIENT', self.server)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def refresh(self):
+        self.server.listed = []
+        return llvmlab.BuildIndex("builder", self.index_path).refresh()
+
+    def test_incremental_refresh(self):
+        self.assertEqual(self.refresh(), 10)
+        self.assertEqual(self.refresh(), 0)
+        self.assertEqual(self.server.listed, ["builder/clang-d99999-g1869f.tar.gz"])
+
+        # Revisions with more digits sort before the newest build.
+        self.server.names.append("builder/clang-d100003-g186a3.tar.gz")
+        self.assertEqual(self.refresh(), 1)
+        self.server.names.append("builder/clang-d100010-g186aa.tar.gz")
+        self.assertEqual(self.refresh(), 1)
+        # Only the newest builds are listed, not the older ones.
+        self.assertEqual(self.server.listed,
+                         ["builder/clang-d100003-g186a3.tar.gz",
+                          "builder/clang-d100010-g186aa.tar.gz"])
+
+    def test_interrupted_refresh(self):
+        self.server.fail_after = 4
+        with mock.patch.object(llvmlab.BuildIndex, 'save', autospec=True,
+                               side_effect=llvmlab.BuildIndex.save) as save:
+            self.assertRaises(IOError, self.refresh)
+            # The index is saved once, even when interrupted.
+            self.assertEqual(save.call_count, 1)
+
+        # The listing resumes from where it stopped.
+        self.server.fail_after = None
+        self.assertEqual(self.refresh(), 6)
+        self.assertEqual(len(self.server.listed), 6)
+        build_index = llvmlab.BuildIndex("builder", self.index_path)
+        self.assertEqual(len(build_index.items), 10)
+        self.assertFalse(build_index.is_expired())
+
+
+class FakeFolderServer(object):
+    """Serves the folders of several buckets, two folders per page."""
+
+    def __init__(self, folders_by_url):
+        self.folders_by_url = folders_by_url
+        self.requests = []
+        # Every bucket waits for the others on its first page, so listing
+        # them one after the other times out.
+        self.barrier = threading.Barrier(len(folders_by_url), timeout=5)
+
+    def get(self, url, params):
+        self.requests.append((url, dict(params)))
+        start = int(params.get('pageToken', 0))
+        if not start:
+            self.barrier.wait()
+        folders = self.folders_by_url[url]
+        data = {'prefixes': [folder + "/"
+                             for folder in folders[start:start + 2]]}
+        if start + 2 < len(folders):
+            data['nextPageToken'] = str(start + 2)
+        return FakeGCSResponse(data)
+
+
+class TestFetchBuilders(unittest.TestCase):
+
+    def setUp(self):
+        self.sources = [gcs.Source("https://a/", "bucket"),
+                        gcs.Source("https://b/", "bucket")]
+        self.server = FakeFolderServer({
+            gcs.get_objects_url(self.sources[0]): ["a1", "a2", "a3", "both"],
+            gcs.get_objects_url(self.sources[1]): ["b1", "both"],
+        })
+        patcher = mock.patch.object(gcs, 'HTTP_CLIENT', self.server)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_list_folders(self):
+        self.server.barrier = threading.Barrier(1)
+        self.assertEqual(gcs.list_folders(self.sources[0]),
+                         ["a1", "a2", "a3", "both"])
+        self.assertEqual([params.get('pageToken')
+                          for _, params in self.server.requests], [None, "2"])
+
+    def test_fetch_builders(self):
+        builders = gcs.fetch_builders(self.sources)
+        # Builders in several buckets come from the first one.
+        self.assertEqual(builders, {"a1": self.sources[0],
+                                    "a2": self.sources[0],
+                                    "a3": self.sources[0],
+                                    "both": self.sources[0],
+                                    "b1": self.sources[1]})
+        self.assertEqual(len(self.server.requests), 3)
+
+
+class TestBuilderMap(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.path = os.path.join(self.workdir, "build_map.json")
+        self.source = gcs.Source("https://a/", "bucket")
+        expired = time.time() - 2 * llvmlab.BuilderMap.expiration_time
+        buildermap = llvmlab.BuilderMap.fromsources(
+            {"old": self.source, "new": self.source}, expired)
+        buildermap.touch("new")
+        buildermap.topath(self.path)
+        for name, kwargs in [('get_builder_map_path',
+                              {'return_value': self.path}),
+                             ('fatal', {'side_effect': ValueError})]:
+            patcher = mock.patch.object(llvmlab, name, **kwargs)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_builder_timestamp(self):
+        with mock.patch.object(gcs, 'builder_exists',
+                               return_value=True) as builder_exists, \
+                mock.patch.object(gcs, 'fetch_builders') as fetch_builders:
+            self.assertEqual(llvmlab.get_builder_source("new"), self.source)
+            builder_exists.assert_not_called()
+
+            # Only the expired builder is checked, not the whole map.
+            self.assertEqual(llvmlab.get_builder_source("old"), self.source)
+            builder_exists.assert_called_once_with("old", self.source)
+            fetch_builders.assert_not_called()
+            buildermap = llvmlab.BuilderMap.frompath(self.path)
+            self.assertFalse(buildermap.is_builder_expired("old"))
+            self.assertTrue(buildermap.is_expired())
+
+    def test_builder_gone(self):
+        other_source = gcs.Source("https://b/", "bucket")
+        with mock.patch.object(gcs, 'builder_exists', return_value=False), \
+                mock.patch.object(gcs, 'fetch_builders',
+                                  return_value={"old": other_source}):
+            self.assertEqual(llvmlab.get_builder_source("old"), other_source)
+            self.assertRaises(ValueError, llvmlab.get_builder_source, "new")
+
+
+class TestResultMemo(unittest.TestCase):
+
+    def setUp(self):
+        # Results are keyed by the working directory, which other tests may
+        # have left pointing at a removed directory, so don't go back to it.
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.addCleanup(os.chdir, os.path.dirname(os.path.abspath(__file__)))
+        os.chdir(self.workdir)
+        self.memo = ci.ResultMemo(os.path.join(self.workdir, "memo"))
+        self.build = llvmlab.Build.frombasename(
+            "clang-r219899-t2014-10-15_20-42-53-b808.tgz")
+
+    def record(self, args, timed_out=False):
+        command = ci.Command(args, "stdout.log", "stderr.log", {})
+        command.result = True
+        command.timed_out = timed_out
+        self.memo.record("builder", self.build, args, True, [command])
+
+    def test_script_change(self):
+        script = os.path.join(self.workdir, "test.sh")
+        with open(script, "w") as f:
+            f.write("exit 0\n")
+        args = ["bash", script]
+        self.record(args)
+        self.assertTrue(self.memo.get("builder", self.build, args)['result'])
+
+        # Editing the script invalidates the result.
+        with open(script, "w") as f:
+            f.write("exit 1 # changed\n")
+        self.assertIsNone(self.memo.get("builder", self.build, args))
+
+    def test_timed_out(self):
+        args = ["sleep", "100"]
+        self.record(args, timed_out=True)
+        self.assertIsNone(self.memo.get("builder", self.build, args))
+
+
+class TestCommand(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+
+    def make_command(self, script):
+        return ci.Command(["sh", "-c", script],
+                          os.path.join(self.workdir, "stdout.log"),
+                          os.path.join(self.workdir, "stderr.log"),
+                          dict(os.environ))
+
+    def read_log(self, name):
+        with open(os.path.join(self.workdir, name)) as f:
+            return f.read()
+
+    def test_execute(self):
+        command = self.make_command("echo out; echo err >&2")
+        asyncio.run(command.execute())
+        self.assertTrue(command.result)
+        self.assertFalse(command.timed_out)
+        self.assertEqual(self.read_log("stdout.log"), "out\n")
+        self.assertEqual(self.read_log("stderr.log"), "err\n")
+        self.assertEqual(sorted(command.metrics),
+                         ["sys_time", "user_time", "wall_time"])
+
+        command = self.make_command("exit 3")
+        asyncio.run(command.execute())
+        self.assertFalse(command.result)
+
+    def test_max_time(self):
+        timeout = ci.Command.get_timeout(["result", "max_time(5)",
+                                          "max_time(0.2)"])
+        self.assertEqual(timeout, 0.2)
+        command = self.make_command("sleep 100 & wait")
+        start_time = time.time()
+        asyncio.run(command.execute(timeout=timeout))
+        self.assertLess(time.time() - start_time, 10)
+        self.assertTrue(command.timed_out)
+        self.assertFalse(command.result)
+
+
+class TestBuildPrefetcher(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.workdir)
+        self.prefetcher = llvmlab.BuildPrefetcher()
+        self.addCleanup(self.prefetcher.close)
+        # Downloads of builds named "slow" never finish on their own.
+        patcher = mock.patch.object(gcs, 'ObjectDownload',
+                                    side_effect=self.download)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def download(url):
+        for _ in range(1000 if "slow" in url else 2):
+            time.sleep(0.01)
+            yield url.encode()
+
+    def make_build(self, name):
+        return llvmlab.Build.frombasename(
+            "clang-r%d-b1.tgz" % name, "link/%d" % name)
+
+    def test_take(self):
+        builds = [self.make_build(1), self.make_build(2)]
+        self.prefetcher.prefetch(builds)
+        root_path = os.path.join(self.workdir, "build.tgz")
+        self.assertTrue(self.prefetcher.take(builds[0], root_path))
+        with open(root_path, 'rb') as f:
+            self.assertEqual(f.read(), b"link/1link/1")
+        self.assertFalse(self.prefetcher.take(builds[0], root_path))
+
+    def test_close(self):
+        slow = llvmlab.Build.frombasename("clang-r1-b1.tgz", "slow/1")
+        self.prefetcher.prefetch([slow])
+        # A discarded download is still waited for.
+        self.prefetcher.prefetch([self.make_build(2)])
+        threads = list(self.prefetcher.threads)
+        start_time = time.time()
+        self.prefetcher.close()
+        self.assertLess(time.time() - start_time, 5)
+        self.assertFalse(any(thread.is_alive() for thread in threads))
+        self.assertFalse(os.path.exists(self.prefetcher.path))
+
+
+class TestBuildManifest(unittest.TestCase):
+
+    tools = ['clang', 'clang++', 'libLTO.dylib', 'opt']
+
+    def setUp(self):
+        self.sandbox = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.sandbox)
+        self.build = llvmlab.Build.frombasename(
+            "clang-r219899-t2014-10-15_20-42-53-b808.tgz")
+        self.path = os.path.join(self.sandbox,
+                                 self.build.tobasename(include_suffix=False))
+        for name in ['bin/clang', 'bin/clang++', 'lib/libLTO.dylib',
+                     'lib/clang/bin/clang']:
+            os.makedirs(os.path.join(self.path, os.path.dirname(name)),
+                        exist_ok=True)
+            with open(os.path.join(self.path, name), 'w') as f:
+                f.write("#!/bin/sh\necho %s\n" % name)
+            os.chmod(os.path.join(self.path, name), 0o755)
+        patcher = mock.patch.object(llvmlab, 'get_tools',
+                                    return_value=self.tools)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def expected_tools(self):
+        return {'clang': os.path.join(self.path, 'bin/clang'),
+                'clang++': os.path.join(self.path, 'bin/clang++'),
+                'libLTO.dylib': os.path.join(self.path, 'lib/libLTO.dylib'),
+                'opt': None}
+
+    def test_manifest(self):
+        found = llvmlab.write_build_manifest(self.path)
+        # The shallowest match is taken, and missing tools are recorded.
+        self.assertEqual(found['clang'], 'bin/clang')
+        self.assertIsNone(found['opt'])
+
+        with mock.patch.object(llvmlab, 'scan_build_tools') as scan:
+            self.assertEqual(llvmlab.load_build_manifest(self.path),
+                             self.expected_tools())
+            scan.assert_not_called()
+
+        # Tools configured later have the build scanned again.
+        tools = self.tools + ['llc']
+        self.assertIsNone(llvmlab.load_build_manifest(self.path, tools)['llc'])
+        with mock.patch.object(llvmlab, 'scan_build_tools') as scan:
+            llvmlab.load_build_manifest(self.path, tools)
+            scan.assert_not_called()
+
+    def test_missing_manifest(self):
+        manifest_path = os.path.join(self.path, llvmlab.MANIFEST_NAME)
+        with mock.patch.object(llvmlab, 'write_build_manifest',
+                               side_effect=OSError):
+            # E.g. a read-only build is scanned every time.
+            self.assertEqual(llvmlab.load_build_manifest(self.path),
+                             self.expected_tools())
+        self.assertFalse(os.path.exists(manifest_path))
+
+        self.assertEqual(llvmlab.load_build_manifest(self.path),
+                         self.expected_tools())
+        self.assertTrue(os.path.exists(manifest_path))
+
+    def test_tool_lookup(self):
+        llvmlab.write_build_manifest(self.path)
+        args = ['%(clang)s', '----', 'sh', '-c',
+                'echo %(clang++)s %(libltodir)s $TEST_OPT']
+        for manifest in (True, False):
+            if not manifest:
+                os.remove(os.path.join(self.path, llvmlab.MANIFEST_NAME))
+            result, commands = ci.execute_sandboxed_test(
+                self.sandbox, "builder", self.build, args,
+                add_path_variables=False, reuse_sandbox=True)
+            self.assertTrue(result)
+            with open(commands[0].stdout_path) as f:
+                self.assertEqual(f.read(), "bin/clang\n")
+            with open(commands[1].stdout_path) as f:
+                self.assertEqual(f.read(), "%s %s None\n" % (
+                    os.path.join(self.path, 'bin/clang++'),
+                    os.path.join(self.path, 'lib')))
+
+
+class TestExtractedBuildCache(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.cache = llvmlab.ExtractedBuildCache(
+            os.path.join(self.workdir, "cache"), 1 << 30)
+        self.build = llvmlab.Build.frombasename(
+            "clang-r219899-t2014-10-15_20-42-53-b808.tgz")
+        self.tarball = os.path.join(self.workdir, "build.tgz")
+        with tarfile.open(self.tarball, 'w:gz') as archive:
+            data = b'clang\n'
+            info = tarfile.TarInfo('bin/clang')
+            info.size = len(data)
+            info.mode = 0o755
+            archive.addfile(info, io.BytesIO(data))
+        patcher = mock.patch.object(llvmlab, 'write_build_manifest')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def read_clang(self, path):
+        with open(os.path.join(path, 'bin', 'clang')) as f:
+            return f.read()
+
+    def test_link(self):
+        view = os.path.join(self.workdir, "view")
+        self.assertFalse(self.cache.link("builder", self.build, view))
+        self.cache.add("builder", self.build, self.tarball)
+        self.assertTrue(self.cache.link("builder", self.build, view))
+        self.assertEqual(self.read_clang(view), 'clang\n')
+        mode = os.stat(os.path.join(view, 'bin', 'clang')).st_mode
+        self.assertEqual(mode & 0o222, 0)
+
+    def test_modified_view(self):
+        self.cache.add("builder", self.build, self.tarball)
+        view = os.path.join(self.workdir, "view")
+        self.assertTrue(self.cache.link("builder", self.build, view))
+
+        # Changing a file of the view changes the cached one too, so the
+        # cached build is dropped.
+        path = os.path.join(view, 'bin', 'clang')
+        os.chmod(path, 0o755)
+        with open(path, 'a') as f:
+            f.write('modified\n')
+        view2 = os.path.join(self.workdir, "view2")
+        with mock.patch.object(llvmlab, 'warning'):
+            self.assertFalse(self.cache.link("builder", self.build, view2))
+
+        self.cache.add("builder", self.build, self.tarball)
+        self.assertTrue(self.cache.link("builder", self.build, view2))
+        self.assertEqual(self.read_clang(view2), 'clang\n')
+
+
+class TestStreamCompiler(unittest.TestCase):
+
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.workdir)
+
+    def make_chunks(self, members, chunk_size=1000):
+        data = io.BytesIO()
+        with tarfile.open(fileobj=data, mode='w:gz') as archive:
+            for name, content in members:
+                info = tarfile.TarInfo(name)
+                info.size = len(content)
+                info.mode = 0o755
+                archive.addfile(info, io.BytesIO(content))
+        data = data.getvalue()
+        return [data[i:i + chunk_size] for i in range(0, len(data), chunk_size)]
+
+    def stream(self, chunks):
+        download = mock.MagicMock()
+        download.__iter__.return_value = iter(chunks)
+        with mock.patch.object(gcs, 'ObjectDownload', return_value=download):
+            gcs.stream_compiler('url', self.workdir)
+
+    def test_chunk_reader(self):
+        reader = gcs.ChunkReader([b'abc', b'', b'defg', b'h'])
+        self.assertEqual(reader.read(2), b'ab')
+        # Reads don't span chunks, but read everything eventually.
+        self.assertEqual(reader.read(4), b'c')
+        self.assertEqual(reader.read(), b'defgh')
+        self.assertEqual(reader.read(1), b'')
+
+    def test_stream_compiler(self):
+        content = os.urandom(100000)
+        self.stream(self.make_chunks([('bin/clang', content)]))
+        path = os.path.join(self.workdir, 'bin/clang')
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertTrue(os.access(path, os.X_OK))
+
+    @unittest.skipUnless(hasattr(tarfile, 'tar_filter'),
+                         "extraction filters are not supported")
+    def test_stream_compiler_outside_path(self):
+        chunks = self.make_chunks([('../outside', b'data')])
+        self.assertRaises(tarfile.FilterError, self.stream, chunks)
+        self.assertFalse(os.path.exists(
+            os.path.join(os.path.dirname(self.workdir), 'outside')))
+
+
 def run_tests():
     suite = unittest.TestLoader().loadTestsFromTestCase(TestLLVMLabCI)
     unittest.TextTestRunner(verbosity=2).run(suite)
@@ -1,4 +1,4 @@
-import ConfigParser
+import configparser
 import datetime
 import inspect
 import os
@@ -15,7 +15,7 @@ def _write_message(kind, message):
     file,line,_,_,_ = inspect.getframeinfo(f)
     location = '%s:%d' % (os.path.basename(file), line)
 
-    print >>sys.stderr, '%s: %s: %s' % (location, kind, message)
+    print('%s: %s: %s' % (location, kind, message), file=sys.stderr)
 
 note = lambda message: _write_message('note', message)
 warning = lambda message: _write_message('warning', message)
@@ -38,7 +38,7 @@ def list_split(list, item):
     return parts
 
 def pairs(l):
-    return zip(l, l[1:])
+    return list(zip(l, l[1:]))
 
 ###
 
@@ -108,7 +108,7 @@ class Preferences(object):
     def __init__(self, path):
         self.path = path
         self.config_path = os.path.join(path, "config")
-        self.options = ConfigParser.RawConfigParser()
+        self.options = configparser.RawConfigParser()
 
         # Load the config file, if present.
         if os.path.exists(self.config_path):
@@ -150,28 +150,14 @@ def get_prefs():
 
 ###
 
+import queue
 import threading
-import Queue
 
 def detect_num_cpus():
     """
-    Detects the number of CPUs on a system. Cribbed from pp.
+    Detects the number of CPUs on a system.
     """
-    # Linux, Unix and MacOS:
-    if hasattr(os, "sysconf"):
-        if os.sysconf_names.has_key("SC_NPROCESSORS_ONLN"):
-            # Linux & Unix:
-            ncpus = os.sysconf("SC_NPROCESSORS_ONLN")
-            if isinstance(ncpus, int) and ncpus > 0:
-                return ncpus
-        else: # OSX:
-            return int(os.popen2("sysctl -n hw.ncpu")[1].read())
-    # Windows:
-    if os.environ.has_key("NUMBER_OF_PROCESSORS"):
-        ncpus = int(os.environ["NUMBER_OF_PROCESSORS"])
-        if ncpus > 0:
-            return ncpus
-    return 1 # Default
+    return os.cpu_count() or 1
 
 def execute_task_on_threads(fn, iterable, num_threads = None):
     """execute_task_on_threads(fn, iterable) -> iterable
@@ -205,7 +191,7 @@ def execute_task_on_threads(fn, iterable, num_threads = None):
             # Otherwise, execute the task and push to the output queue.
             try:
                 output = (None, fn(item))
-            except Exception, e:
+            except Exception:
                 output = ('error', sys.exc_info())
 
             output_queue.put(output)
@@ -216,8 +202,8 @@ def execute_task_on_threads(fn, iterable, num_threads = None):
 
     # Create two queues, one for feeding items to the works and another for
     # consuming the output.
-    work_queue = Queue.Queue()
-    output_queue = Queue.Queue()
+    work_queue = queue.Queue()
+    output_queue = queue.Queue()
 
     # Create our unique sentinel object.
     _sentinel = []
@@ -273,7 +259,7 @@ class orderedset(object):
     def remove(self, item):
         del self.base[item]
 
-    def __nonzero__(self):
+    def __bool__(self):
         return bool(self.base)
 
     def __len__(self):
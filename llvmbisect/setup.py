@@ -36,5 +36,7 @@ setup(
 
     scripts = ['bin/llvmlab'],
 
+    python_requires='>=3.7',
+
     install_requires=['requests'],
 )
@@ -323,6 +323,13 @@ resource "kubernetes_secret" "operational_metrics_secrets" {
   depends_on = [kubernetes_namespace.operational_metrics]
 }
 
+resource "kubernetes_manifest" "revert_index_pvc" {
+  manifest = yamldecode(file("./cronjobs/revert_index_pvc.yaml"))
+  provider = kubernetes.llvm-premerge-us-central
+
+  depends_on = [kubernetes_namespace.operational_metrics]
+}
+
 resource "kubernetes_manifest" "process_llvm_commits_cronjob" {
   manifest = yamldecode(file("./cronjobs/process_llvm_commits_cronjob.yaml"))
   provider = kubernetes.llvm-premerge-us-central
@@ -331,6 +338,7 @@ resource "kubernetes_manifest" "process_llvm_commits_cronjob" {
     kubernetes_namespace.operational_metrics,
     kubernetes_secret.operational_metrics_secrets,
     kubernetes_service_account.operational_metrics_ksa,
+    kubernetes_manifest.revert_index_pvc,
   ]
 }
 
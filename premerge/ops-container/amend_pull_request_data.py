@@ -1,6 +1,8 @@
+import concurrent.futures
 import datetime
 import logging
 import os
+import time
 from typing import Any
 
 from google.cloud import bigquery
@@ -15,6 +17,42 @@ LLVM_PULL_REQUESTS_TABLE = "llvm_pull_requests"
 LLVM_REVIEWS_TABLE = "llvm_reviews"
 LLVM_REPOSITORY_SNAPSHOT_TABLE = "llvm_repository_snapshots"
 
+# The GitHub search API returns at most this many results for a single query,
+# regardless of pagination.
+GITHUB_SEARCH_RESULT_LIMIT = 1000
+
+# How many date ranges to query the GitHub search API for at a time.
+DEFAULT_SEARCH_CONCURRENCY = 4
+
+OPEN_PULL_REQUEST_SEARCH_TEMPLATE = (
+    "repo:llvm/llvm-project is:pr is:open base:main"
+    " created:{start_timestamp}..{end_timestamp}"
+)
+
+OPEN_PULL_REQUEST_GRAPHQL_QUERY = """
+query($cursor: String, $search_query: String!) {{
+  search(
+    query: $search_query,
+    type: ISSUE,
+    first: 100,
+    after: $cursor
+  ) {{
+    issueCount
+    pageInfo {{
+      hasNextPage
+      endCursor
+    }}
+    nodes {{
+      ... on PullRequest {{
+        {requested_pull_request_data}
+      }}
+    }}
+  }}
+}}
+""".format(
+    requested_pull_request_data=operational_metrics_lib.PULL_REQUEST_GRAPHQL_DATA,
+)
+
 OPEN_PULL_REQUEST_PREDICATE = (
     "LLVMPull.pull_request_state = 'OPEN' AND NOT LLVMPull.is_stale_data"
 )
@@ -32,44 +70,41 @@ AND NOT EXISTS(
 """
 
 
-def fetch_open_pull_requests_from_github(
+def _format_search_timestamp(timestamp: datetime.datetime) -> str:
+  """Format a timestamp for use in a GitHub search qualifier."""
+  return timestamp.astimezone(datetime.timezone.utc).strftime(
+      "%Y-%m-%dT%H:%M:%SZ"
+  )
+
+
+def fetch_open_pull_requests_created_in_range(
     github_token: str,
-    cutoff_timestamp: datetime.datetime,
-) -> list[dict[str, Any]]:
-  """Fetch open pull requests from the GitHub GraphQL API.
+    start_timestamp: datetime.datetime,
+    end_timestamp: datetime.datetime,
+) -> tuple[
+    list[dict[str, Any]], list[tuple[datetime.datetime, datetime.datetime]]
+]:
+  """Fetch open pull requests created within an inclusive date range.
+
+  If the range matches more pull requests than the search API will return, no
+  pull requests are fetched and the range is instead split in two.
 
   Args:
     github_token: The GitHub API token to use for authentication.
-    cutoff_timestamp: The cutoff timestamp to use for the query.
+    start_timestamp: The earliest creation timestamp to query for.
+    end_timestamp: The latest creation timestamp to query for.
 
   Returns:
-    A list of open pull requests from the GitHub GraphQL API.
+    A tuple containing:
+    - The open pull requests created within the range.
+    - The disjoint subranges that still need to be queried, if the range had
+      to be split.
   """
-
-  search_query = """
-  query($cursor: String) {{
-    search(
-      query: "repo:llvm/llvm-project is:pr is:open base:main created:>{cutoff_timestamp}",
-      type: ISSUE,
-      first: 100,
-      after: $cursor
-    ) {{
-      issueCount
-      pageInfo {{
-        hasNextPage
-        endCursor
-      }}
-      nodes {{
-        ... on PullRequest {{
-          {requested_pull_request_data}
-        }}
-      }}
-    }}
-  }}
-  """.format(
-      cutoff_timestamp=cutoff_timestamp.strftime("%Y-%m-%dT%H:%M:%SZ"),
-      requested_pull_request_data=operational_metrics_lib.PULL_REQUEST_GRAPHQL_DATA,
+  search_query = OPEN_PULL_REQUEST_SEARCH_TEMPLATE.format(
+      start_timestamp=_format_search_timestamp(start_timestamp),
+      end_timestamp=_format_search_timestamp(end_timestamp),
   )
+  range_seconds = int((end_timestamp - start_timestamp).total_seconds())
 
   has_next_page = True
   cursor = None
@@ -77,19 +112,104 @@ def fetch_open_pull_requests_from_github(
   while has_next_page:
     variables = {
         "cursor": cursor,
+        "search_query": search_query,
     }
     response = operational_metrics_lib.query_github_graphql_api(
-        query=search_query,
+        query=OPEN_PULL_REQUEST_GRAPHQL_QUERY,
         variables=variables,
         github_token=github_token,
     )
-
     response_data = response.json()["data"]["search"]
+
+    # Results past the search limit can't be paginated to, so split the range
+    # into two halves that can each be queried in full. Ranges are inclusive
+    # with a resolution of one second, so a single second can't be split.
+    if (
+        cursor is None
+        and response_data["issueCount"] > GITHUB_SEARCH_RESULT_LIMIT
+        and range_seconds > 0
+    ):
+      midpoint = start_timestamp + datetime.timedelta(
+          seconds=range_seconds // 2
+      )
+      return [], [
+          (start_timestamp, midpoint),
+          (midpoint + datetime.timedelta(seconds=1), end_timestamp),
+      ]
+
     pull_requests.extend(response_data["nodes"])
     has_next_page = response_data["pageInfo"]["hasNextPage"]
     cursor = response_data["pageInfo"]["endCursor"]
 
-  return pull_requests
+  return pull_requests, []
+
+
+def fetch_open_pull_requests_from_github(
+    github_token: str,
+    cutoff_timestamp: datetime.datetime,
+    end_timestamp: datetime.datetime | None = None,
+    max_workers: int = DEFAULT_SEARCH_CONCURRENCY,
+) -> list[dict[str, Any]]:
+  """Fetch open pull requests from the GitHub GraphQL API.
+
+  The search is split into disjoint creation date ranges that each stay under
+  the search API's result limit, which are queried concurrently.
+
+  Args:
+    github_token: The GitHub API token to use for authentication.
+    cutoff_timestamp: The cutoff timestamp to use for the query.
+    end_timestamp: The latest creation timestamp to query for. Defaults to the
+      current time.
+    max_workers: The maximum number of date ranges to query concurrently.
+
+  Returns:
+    A list of open pull requests from the GitHub GraphQL API.
+  """
+  start_timestamp = cutoff_timestamp.replace(microsecond=0)
+  if end_timestamp is None:
+    end_timestamp = datetime.datetime.now(tz=cutoff_timestamp.tzinfo)
+  end_timestamp = end_timestamp.replace(microsecond=0)
+
+  start_time = time.monotonic()
+  num_ranges = 0
+  pull_requests_by_number = {}
+  with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+    pending = {
+        pool.submit(
+            fetch_open_pull_requests_created_in_range,
+            github_token,
+            start_timestamp,
+            end_timestamp,
+        )
+    }
+    while pending:
+      done, pending = concurrent.futures.wait(
+          pending, return_when=concurrent.futures.FIRST_COMPLETED
+      )
+      for future in done:
+        num_ranges += 1
+        pull_requests, subranges = future.result()
+        # Ranges are disjoint, but a pull request can still be returned twice
+        # if results shift between pages while they're being fetched.
+        for pull_request in pull_requests:
+          pull_requests_by_number[pull_request["number"]] = pull_request
+        for subrange_start, subrange_end in subranges:
+          pending.add(
+              pool.submit(
+                  fetch_open_pull_requests_created_in_range,
+                  github_token,
+                  subrange_start,
+                  subrange_end,
+              )
+          )
+
+  logging.info(
+      "Fetched %d open pull requests across %d date ranges in %.2f seconds",
+      len(pull_requests_by_number),
+      num_ranges,
+      time.monotonic() - start_time,
+  )
+  return list(pull_requests_by_number.values())
 
 
 def get_pull_requests_by_age_from_bigquery(
@@ -22,12 +22,16 @@ class TestAmendPullRequestData(unittest.TestCase):
       nodes: list[dict[str, Any]],
       has_next_page: bool = False,
       end_cursor: str | None = None,
+      issue_count: int | None = None,
   ) -> unittest.mock.MagicMock:
     """Creates a mock response for the GitHub GraphQL API."""
     mock_response = unittest.mock.MagicMock()
     mock_response.json.return_value = {
         "data": {
             "search": {
+                "issueCount": (
+                    len(nodes) if issue_count is None else issue_count
+                ),
                 "nodes": nodes,
                 "pageInfo": {
                     "hasNextPage": has_next_page,
@@ -66,6 +70,54 @@ class TestAmendPullRequestData(unittest.TestCase):
     self.assertEqual(pull_requests, [{"number": 1234}, {"number": 5678}])
     self.assertEqual(mock_query_github_graphql_api.call_count, 2)
 
+  @unittest.mock.patch.object(
+      operational_metrics_lib, "query_github_graphql_api"
+  )
+  def test_fetch_open_pull_requests_from_github_splits_date_range(
+      self, mock_query_github_graphql_api
+  ):
+    """Test splitting date ranges that exceed the search result limit."""
+    cutoff_timestamp = datetime.datetime(
+        2025, 1, 1, 0, 0, 0, tzinfo=datetime.timezone.utc
+    )
+    end_timestamp = datetime.datetime(
+        2025, 1, 1, 0, 0, 10, tzinfo=datetime.timezone.utc
+    )
+    responses_by_range = {
+        "2025-01-01T00:00:00Z..2025-01-01T00:00:10Z": (
+            self._create_mock_graphql_response(
+                nodes=[{"number": 1}], issue_count=1500
+            )
+        ),
+        "2025-01-01T00:00:00Z..2025-01-01T00:00:05Z": (
+            self._create_mock_graphql_response(
+                nodes=[{"number": 1}, {"number": 2}]
+            )
+        ),
+        "2025-01-01T00:00:06Z..2025-01-01T00:00:10Z": (
+            self._create_mock_graphql_response(nodes=[{"number": 3}])
+        ),
+    }
+
+    def query_side_effect(query, variables, github_token):
+      del query, github_token  # Unused.
+      date_range = variables["search_query"].split("created:")[1]
+      return responses_by_range[date_range]
+
+    mock_query_github_graphql_api.side_effect = query_side_effect
+
+    pull_requests = (
+        amend_pull_request_data.fetch_open_pull_requests_from_github(
+            github_token="dummy_token",
+            cutoff_timestamp=cutoff_timestamp,
+            end_timestamp=end_timestamp,
+        )
+    )
+    self.assertCountEqual(
+        pull_requests, [{"number": 1}, {"number": 2}, {"number": 3}]
+    )
+    self.assertEqual(mock_query_github_graphql_api.call_count, 3)
+
   def test_mark_stale_pull_request_data_in_bigquery(self):
     """Test marking stale pull request data in BigQuery."""
     mock_bq_client = unittest.mock.MagicMock()
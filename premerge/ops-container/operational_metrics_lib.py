@@ -67,6 +67,10 @@ class LLVMCommitData:
   is_revert: bool = False
   pull_request_reverted: int | None = None
   commit_reverted: str | None = None
+  is_reland: bool = False
+  original_commit: str | None = None
+  times_reverted: int = 0
+  times_relanded: int = 0
 
 
 @dataclasses.dataclass
@@ -6,6 +6,7 @@ from typing import Any, Optional
 import git
 from google.cloud import bigquery
 import operational_metrics_lib
+import revert_index
 
 REPOSITORY_URL = "https://github.com/llvm/llvm-project.git"
 
@@ -24,6 +25,11 @@ GITHUB_API_BATCH_SIZE = 35
 # for reviews. This is to allow time for any new GitHub events to propogate.
 LOOKBACK_DAYS = 2
 
+# Where to persist the revert index between runs. The index is rebuilt from the
+# full history if no previous index exists, so the cronjob keeps it on a
+# persistent volume.
+REVERT_INDEX_PATH = os.environ.get("REVERT_INDEX_PATH", "./revert_index.json")
+
 # Template GraphQL subquery to check if a commit has an associated pull request
 # and whether that pull request has been reviewed and approved.
 COMMIT_GRAPHQL_SUBQUERY_TEMPLATE = """
@@ -120,12 +126,24 @@ def parse_commit_revert_info(
 
 def extract_initial_commit_data(
     commit: git.Commit,
+    commit_revert_index: revert_index.RevertIndex | None = None,
 ) -> operational_metrics_lib.LLVMCommitData:
   # Parse commit message for revert information
   is_revert, pull_request_reverted, commit_reverted = parse_commit_revert_info(
       commit.message
   )
 
+  # Look up where this commit sits in its revert chain, if it has one
+  is_reland = False
+  original_commit = None
+  chain_summary = revert_index.RevertChainSummary()
+  if commit_revert_index is not None:
+    entry = commit_revert_index.get_entry(commit.hexsha)
+    if entry is not None:
+      is_reland = entry.kind == revert_index.RELAND_KIND
+      original_commit = entry.root_commit
+    chain_summary = commit_revert_index.get_chain_summary(commit.hexsha)
+
   # Add entry
   return operational_metrics_lib.LLVMCommitData(
       commit_sha=commit.hexsha,
@@ -142,24 +160,30 @@ def extract_initial_commit_data(
       is_revert=is_revert,
       pull_request_reverted=pull_request_reverted,
       commit_reverted=commit_reverted,
+      is_reland=is_reland,
+      original_commit=original_commit,
+      times_reverted=chain_summary.times_reverted,
+      times_relanded=chain_summary.times_relanded,
   )
 
 
 def extract_commit_data(
     scraped_commits: list[git.Commit],
     api_data: dict[str, Any],
+    commit_revert_index: revert_index.RevertIndex | None = None,
 ) -> list[operational_metrics_lib.LLVMCommitData]:
   """Extract commit data from scraped Git commits and GitHub API data.
 
   Args:
     scraped_commits: List of commits scraped from cloned LLVM repository.
     api_data: JSON response from GitHub API.
+    commit_revert_index: Index used to resolve revert and reland chains.
 
   Returns:
     List of LLVMCommitData objects for each commit found.
   """
   commit_map = {
-      commit.hexsha: extract_initial_commit_data(commit)
+      commit.hexsha: extract_initial_commit_data(commit, commit_revert_index)
       for commit in scraped_commits
   }
   for commit_sha, commit_data in api_data.items():
@@ -284,9 +308,14 @@ def main() -> None:
     logging.info("No new commits found. Exiting.")
     return
 
+  logging.info("Updating revert index at %s", REVERT_INDEX_PATH)
+  commit_revert_index = revert_index.RevertIndex.load(REVERT_INDEX_PATH)
+  commit_revert_index.update(repo.working_dir)
+  commit_revert_index.save(REVERT_INDEX_PATH)
+
   logging.info("Fetching GitHub API data for discovered commits.")
   api_data = fetch_commit_data_from_github(github_token, commits)
-  commit_data = extract_commit_data(commits, api_data)
+  commit_data = extract_commit_data(commits, api_data, commit_revert_index)
   pull_request_data = extract_pull_request_data(api_data)
   review_data = extract_review_data(api_data)
 
@@ -6,6 +6,7 @@ import unittest.mock
 import parameterized
 import process_llvm_commits
 import requests
+import revert_index
 
 
 class TestProcessLLVMCommits(unittest.TestCase):
@@ -223,6 +224,28 @@ class TestProcessLLVMCommits(unittest.TestCase):
     self.assertEqual(commit_data.pull_request_reverted, 123)
     self.assertIsNone(commit_data.commit_reverted)
 
+  def test_extract_initial_commit_data_with_revert_index(self):
+    """Test that initial commit data includes resolved revert chains."""
+    index = revert_index.RevertIndex()
+    index.add_commit('a' * 40, 'Foo (#100)')
+    index.add_commit(
+        'b' * 40, f'Revert "Foo"\n\nThis reverts commit {"a" * 40}.'
+    )
+    index.add_commit('c' * 40, 'Reland "Foo" (#101)')
+    commit = self._create_mock_commit(
+        hexsha='c' * 40, message='Reland "Foo" (#101)'
+    )
+
+    commit_data = process_llvm_commits.extract_initial_commit_data(
+        commit, index
+    )
+
+    self.assertFalse(commit_data.is_revert)
+    self.assertTrue(commit_data.is_reland)
+    self.assertEqual(commit_data.original_commit, 'a' * 40)
+    self.assertEqual(commit_data.times_reverted, 1)
+    self.assertEqual(commit_data.times_relanded, 1)
+
   @unittest.mock.patch.object(requests, 'post', autospec=True)
   def test_fetch_commit_data_from_github(self, mock_post):
     """Test fetching GitHub API data for a list of commits."""
@@ -0,0 +1,331 @@
+import collections
+import dataclasses
+import json
+import logging
+import os
+import re
+import subprocess
+import tempfile
+from typing import Iterator
+
+INDEX_FORMAT_VERSION = 1
+
+REVERT_KIND = "revert"
+RELAND_KIND = "reland"
+
+# Separators used to delimit commits and fields in the `git log` output. Neither
+# can appear in a commit message.
+_FIELD_SEPARATOR = "\x1f"
+_RECORD_SEPARATOR = "\x1e"
+
+# Only messages that start with one of these words are parsed further, which
+# keeps the full history pass to a cheap prefix check for most commits.
+_REVERT_OR_RELAND_PREFIX = re.compile(
+    r"^\s*\[?(?:revert|reland|recommit)", flags=re.IGNORECASE
+)
+_REVERT_SUBJECT = re.compile(
+    r"^Revert \"(?P<title>.*)\"( \(#\d+\))?$", flags=re.IGNORECASE
+)
+_RELAND_SUBJECT = re.compile(
+    r"^\[?(?:Reland|Recommit)(?:ed)?\]?:?\s+\"?(?P<title>.*?)\"?( \(#\d+\))?$",
+    flags=re.IGNORECASE,
+)
+_REVERTED_PULL_REQUEST = re.compile(
+    r"Reverts? (?:llvm\/llvm-project)?#(\d+)", flags=re.IGNORECASE
+)
+_REVERTED_COMMIT = re.compile(
+    r"This reverts commit (\w+)", flags=re.IGNORECASE
+)
+_SQUASHED_PULL_REQUEST = re.compile(r"\(#(\d+)\)$")
+
+
+@dataclasses.dataclass
+class RevertIndexEntry:
+  """A revert or reland, resolved to the start of its chain."""
+
+  kind: str
+  root_commit: str | None
+  root_title: str | None = None
+
+
+@dataclasses.dataclass
+class RevertChainSummary:
+  """How many times a commit was reverted and relanded."""
+
+  times_reverted: int = 0
+  times_relanded: int = 0
+
+
+def _normalize_title(title: str) -> str:
+  """Strip a trailing pull request number from a commit title."""
+  return _SQUASHED_PULL_REQUEST.sub("", title).strip()
+
+
+def iter_commit_messages(
+    repo_path: str,
+    revision_range: str = "HEAD",
+) -> Iterator[tuple[str, str]]:
+  """Stream commit hashes and messages from `git log`, oldest first.
+
+  Args:
+    repo_path: The path to the git repository to read.
+    revision_range: The revision range to pass to `git log`.
+
+  Yields:
+    Tuples of commit hash and full commit message.
+  """
+  process = subprocess.Popen(
+      [
+          "git",
+          "-C",
+          repo_path,
+          "log",
+          "--reverse",
+          f"--format=%H{_FIELD_SEPARATOR}%B{_RECORD_SEPARATOR}",
+          revision_range,
+      ],
+      stdout=subprocess.PIPE,
+      text=True,
+      errors="replace",
+  )
+  buffer = ""
+  for chunk in iter(lambda: process.stdout.read(1 << 16), ""):
+    buffer += chunk
+    *records, buffer = buffer.split(_RECORD_SEPARATOR)
+    for record in records:
+      commit_sha, _, message = record.lstrip("\n").partition(_FIELD_SEPARATOR)
+      yield commit_sha, message
+
+  if process.wait() != 0:
+    raise subprocess.CalledProcessError(process.returncode, process.args)
+
+
+class RevertIndex:
+  """Index of reverts and relands, keyed by commit hash.
+
+  The index is built from commit messages in a single streaming `git log` pass,
+  oldest commit first, and can be updated incrementally from the last indexed
+  commit. Each revert or reland is resolved back to the original commit that
+  started its chain, so a revert of a revert counts as a reland.
+  """
+
+  def __init__(self):
+    self.clear()
+
+  def clear(self) -> None:
+    """Remove all indexed commits."""
+    self.last_indexed_sha: str | None = None
+    self.entries: dict[str, RevertIndexEntry] = {}
+    self.commit_by_pull_request: dict[int, str] = {}
+    self.commit_by_title: dict[str, str] = {}
+    self.chains: dict[str, RevertChainSummary] = collections.defaultdict(
+        RevertChainSummary
+    )
+
+  def _resolve_commit(self, commit_sha: str) -> str:
+    """Resolve an abbreviated commit hash against indexed reverts."""
+    if len(commit_sha) >= 40 or commit_sha in self.entries:
+      return commit_sha
+    for indexed_sha in self.entries:
+      if indexed_sha.startswith(commit_sha):
+        return indexed_sha
+    return commit_sha
+
+  def _record(self, commit_sha: str, entry: RevertIndexEntry) -> None:
+    """Record a revert or reland and update its chain's counts."""
+    self.entries[commit_sha] = entry
+    if entry.root_commit is None:
+      return
+    chain = self.chains[entry.root_commit]
+    if entry.kind == REVERT_KIND:
+      chain.times_reverted += 1
+    else:
+      chain.times_relanded += 1
+
+  def add_commit(self, commit_sha: str, message: str) -> None:
+    """Add a single commit to the index.
+
+    Commits must be added oldest first, so that reverted commits are indexed
+    before the commits that revert them.
+
+    Args:
+      commit_sha: The hash of the commit.
+      message: The full commit message.
+    """
+    self.last_indexed_sha = commit_sha
+    subject = message.split("\n", 1)[0].strip()
+
+    pull_request_match = _SQUASHED_PULL_REQUEST.search(subject)
+    if pull_request_match:
+      self.commit_by_pull_request[int(pull_request_match.group(1))] = (
+          commit_sha
+      )
+
+    if not _REVERT_OR_RELAND_PREFIX.match(subject):
+      return
+
+    revert_match = _REVERT_SUBJECT.match(subject)
+    if revert_match:
+      title = _normalize_title(revert_match.group("title"))
+      commit_match = _REVERTED_COMMIT.search(message)
+      pull_request_match = _REVERTED_PULL_REQUEST.search(message)
+      if commit_match:
+        reverted_commit = self._resolve_commit(commit_match.group(1))
+      elif pull_request_match:
+        reverted_commit = self.commit_by_pull_request.get(
+            int(pull_request_match.group(1))
+        )
+      else:
+        reverted_commit = self.commit_by_title.get(title)
+
+      # A revert of a revert relands the original change, and a revert of a
+      # reland reverts it again.
+      reverted_entry = self.entries.get(reverted_commit)
+      if reverted_entry is not None:
+        kind = (
+            RELAND_KIND if reverted_entry.kind == REVERT_KIND else REVERT_KIND
+        )
+        entry = RevertIndexEntry(
+            kind=kind,
+            root_commit=reverted_entry.root_commit,
+            root_title=reverted_entry.root_title,
+        )
+      else:
+        entry = RevertIndexEntry(
+            kind=REVERT_KIND, root_commit=reverted_commit, root_title=title
+        )
+        if reverted_commit is not None:
+          self.commit_by_title.setdefault(title, reverted_commit)
+      self._record(commit_sha, entry)
+      return
+
+    reland_match = _RELAND_SUBJECT.match(subject)
+    if reland_match:
+      title = _normalize_title(reland_match.group("title"))
+      self._record(
+          commit_sha,
+          RevertIndexEntry(
+              kind=RELAND_KIND,
+              root_commit=self.commit_by_title.get(title),
+              root_title=title,
+          ),
+      )
+
+  def update(self, repo_path: str, revision: str = "HEAD") -> int:
+    """Index all commits since the last indexed commit.
+
+    The index is rebuilt from scratch if the last indexed commit is not in the
+    repository, e.g. because the history was rewritten.
+
+    Args:
+      repo_path: The path to the git repository to index.
+      revision: The revision to index up to.
+
+    Returns:
+      The number of commits that were indexed.
+    """
+    num_commits = 0
+    if self.last_indexed_sha is not None:
+      try:
+        for commit_sha, message in iter_commit_messages(
+            repo_path, f"{self.last_indexed_sha}..{revision}"
+        ):
+          self.add_commit(commit_sha, message)
+          num_commits += 1
+      except subprocess.CalledProcessError:
+        logging.warning(
+            "Last indexed commit %s not found, rebuilding the revert index.",
+            self.last_indexed_sha,
+        )
+        self.clear()
+        num_commits = 0
+
+    if self.last_indexed_sha is None:
+      for commit_sha, message in iter_commit_messages(repo_path, revision):
+        self.add_commit(commit_sha, message)
+        num_commits += 1
+
+    logging.info(
+        "Indexed %d commits, %d reverts and relands in total",
+        num_commits,
+        len(self.entries),
+    )
+    return num_commits
+
+  def get_entry(self, commit_sha: str) -> RevertIndexEntry | None:
+    """Get the revert or reland entry for a commit, if it is one."""
+    return self.entries.get(commit_sha)
+
+  def get_chain_summary(self, commit_sha: str) -> RevertChainSummary:
+    """Get revert and reland counts for the chain a commit belongs to.
+
+    Args:
+      commit_sha: The hash of an original commit, or of a revert or reland.
+
+    Returns:
+      The counts for the chain's original commit.
+    """
+    entry = self.entries.get(commit_sha)
+    root_commit = entry.root_commit if entry is not None else commit_sha
+    if root_commit is None:
+      return RevertChainSummary()
+    if root_commit in self.chains:
+      return self.chains[root_commit]
+
+    # Reverts sometimes reference the original commit by an abbreviated hash.
+    for chain_root, chain in self.chains.items():
+      if len(chain_root) >= 7 and root_commit.startswith(chain_root):
+        return chain
+    return RevertChainSummary()
+
+  def save(self, index_path: str) -> None:
+    """Atomically write the index to a JSON file."""
+    data = {
+        "version": INDEX_FORMAT_VERSION,
+        "last_indexed_sha": self.last_indexed_sha,
+        "entries": {
+            commit_sha: dataclasses.asdict(entry)
+            for commit_sha, entry in self.entries.items()
+        },
+        "commit_by_pull_request": self.commit_by_pull_request,
+        "commit_by_title": self.commit_by_title,
+    }
+    index_dir = os.path.dirname(os.path.abspath(index_path))
+    with tempfile.NamedTemporaryFile(
+        "w", dir=index_dir, delete=False
+    ) as index_file:
+      json.dump(data, index_file)
+    os.replace(index_file.name, index_path)
+
+  @classmethod
+  def load(cls, index_path: str) -> "RevertIndex":
+    """Load an index from a JSON file.
+
+    An empty index is returned if the file does not exist or was written with
+    a different format version.
+
+    Args:
+      index_path: The path to the JSON file to load.
+
+    Returns:
+      The loaded index.
+    """
+    index = cls()
+    if not os.path.exists(index_path):
+      return index
+
+    with open(index_path) as index_file:
+      data = json.load(index_file)
+    if data.get("version") != INDEX_FORMAT_VERSION:
+      logging.warning("Ignoring revert index with outdated format version.")
+      return index
+
+    index.last_indexed_sha = data["last_indexed_sha"]
+    index.commit_by_pull_request = {
+        int(number): commit_sha
+        for number, commit_sha in data["commit_by_pull_request"].items()
+    }
+    index.commit_by_title = data["commit_by_title"]
+    for commit_sha, entry in data["entries"].items():
+      index._record(commit_sha, RevertIndexEntry(**entry))
+    return index
@@ -0,0 +1,133 @@
+import os
+import subprocess
+import tempfile
+import unittest
+
+import revert_index
+
+
+class TestRevertIndex(unittest.TestCase):
+
+  def _create_repo(self, messages: list[str]) -> tuple[str, list[str]]:
+    """Creates a git repository with one empty commit per message."""
+    repo_path = self.enterContext(tempfile.TemporaryDirectory())
+    subprocess.run(['git', 'init', '-q', repo_path], check=True)
+    for message in messages:
+      self._commit(repo_path, message)
+    return repo_path, self._get_commit_shas(repo_path)
+
+  def _commit(self, repo_path: str, message: str) -> None:
+    subprocess.run(
+        [
+            'git',
+            '-C',
+            repo_path,
+            '-c',
+            'user.name=Test',
+            '-c',
+            'user.email=test@example.com',
+            'commit',
+            '-q',
+            '--allow-empty',
+            '-m',
+            message,
+        ],
+        check=True,
+    )
+
+  def _get_commit_shas(self, repo_path: str) -> list[str]:
+    return subprocess.run(
+        ['git', '-C', repo_path, 'rev-list', '--reverse', 'HEAD'],
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.split()
+
+  def test_iter_commit_messages(self):
+    """Test streaming commit messages from git, oldest first."""
+    repo_path, shas = self._create_repo(['Foo\n\nBody', 'Bar'])
+
+    self.assertEqual(
+        list(revert_index.iter_commit_messages(repo_path)),
+        [(shas[0], 'Foo\n\nBody\n'), (shas[1], 'Bar\n')],
+    )
+
+  def test_revert_chain(self):
+    """Test that reverts of reverts are resolved as relands."""
+    index = revert_index.RevertIndex()
+    index.add_commit('a' * 40, 'Foo (#100)')
+    index.add_commit('b' * 40, 'Revert "Foo"\n\nThis reverts commit aaaaaaa.')
+    index.add_commit(
+        'c' * 40, f'Revert "Revert "Foo""\n\nThis reverts commit {"b" * 40}.'
+    )
+    index.add_commit(
+        'd' * 40, f'Revert "Reland Foo"\n\nThis reverts commit {"c" * 40}.'
+    )
+
+    self.assertIsNone(index.get_entry('a' * 40))
+    self.assertEqual(index.get_entry('b' * 40).kind, revert_index.REVERT_KIND)
+    self.assertEqual(index.get_entry('c' * 40).kind, revert_index.RELAND_KIND)
+    self.assertEqual(index.get_entry('d' * 40).kind, revert_index.REVERT_KIND)
+    # The original commit is referenced by an abbreviated hash.
+    for commit_sha in ['b' * 40, 'c' * 40, 'd' * 40]:
+      self.assertEqual(index.get_entry(commit_sha).root_commit, 'aaaaaaa')
+    self.assertEqual(
+        index.get_chain_summary('a' * 40),
+        revert_index.RevertChainSummary(times_reverted=2, times_relanded=1),
+    )
+
+  def test_revert_by_pull_request_and_reland_by_title(self):
+    """Test resolving reverted pull requests and relands by title."""
+    index = revert_index.RevertIndex()
+    index.add_commit('a' * 40, 'Foo (#100)')
+    index.add_commit(
+        'b' * 40, 'Revert "Foo" (#101)\n\nReverts llvm/llvm-project#100'
+    )
+    index.add_commit('c' * 40, 'Reland "Foo" (#102)')
+    index.add_commit('d' * 40, '[Reland] Unknown change')
+
+    self.assertEqual(index.get_entry('b' * 40).root_commit, 'a' * 40)
+    self.assertEqual(index.get_entry('c' * 40).kind, revert_index.RELAND_KIND)
+    self.assertEqual(index.get_entry('c' * 40).root_commit, 'a' * 40)
+    self.assertIsNone(index.get_entry('d' * 40).root_commit)
+    self.assertEqual(
+        index.get_chain_summary('c' * 40),
+        revert_index.RevertChainSummary(times_reverted=1, times_relanded=1),
+    )
+
+  def test_incremental_update_and_persistence(self):
+    """Test that the index is saved, reloaded and updated incrementally."""
+    repo_path, shas = self._create_repo(['Foo (#100)'])
+    index_path = os.path.join(repo_path, 'revert_index.json')
+
+    index = revert_index.RevertIndex()
+    self.assertEqual(index.update(repo_path), 1)
+    index.save(index_path)
+
+    self._commit(repo_path, f'Revert "Foo"\n\nThis reverts commit {shas[0]}.')
+    index = revert_index.RevertIndex.load(index_path)
+    self.assertEqual(index.last_indexed_sha, shas[0])
+    self.assertEqual(index.update(repo_path), 1)
+    index.save(index_path)
+
+    index = revert_index.RevertIndex.load(index_path)
+    self.assertEqual(index.get_chain_summary(shas[0]).times_reverted, 1)
+    self.assertEqual(index.update(repo_path), 0)
+
+  def test_update_from_unknown_commit(self):
+    """Test that the index is rebuilt if the last indexed commit is gone."""
+    repo_path, shas = self._create_repo(
+        ['Foo (#100)', 'Revert "Foo"\n\nThis reverts commit abc1234.']
+    )
+    index = revert_index.RevertIndex()
+    index.add_commit('a' * 40, 'Revert "Bar"\n\nThis reverts commit abc1234.')
+
+    with self.assertLogs(level='WARNING'):
+      self.assertEqual(index.update(repo_path), 2)
+    self.assertEqual(index.last_indexed_sha, shas[1])
+    self.assertIsNone(index.get_entry('a' * 40))
+    self.assertEqual(index.get_entry(shas[1]).kind, revert_index.REVERT_KIND)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Per-machine cache of extracted CI build artifacts, such as host compilers.
+Artifacts are stored once by the SHA-256 of their content, and jobs get a read-only view
+made of hardlinks, so many jobs using the same stage 1 compiler fetch and extract it once.
+The least recently used artifacts are evicted to stay within a disk budget.
+
+The cache is only used when ARTIFACT_CACHE_DIR is set, e.g. in the environment of the CI
+agents, so that fetching an artifact on a developer machine doesn't fill its disk. A job
+that makes a file of its view writable and changes it changes the cached copy too, so the
+sizes, modes and modification times of the cached files are checked before each use, and
+an artifact that was changed is fetched again.
+"""
+
+import argparse
+import contextlib
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from artifact_transfer import ArtifactTransfer
+
+logger = logging.getLogger(__name__)
+
+# Cache directory of the command line, jobs only use a cache when ARTIFACT_CACHE_DIR is set
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "clangci-artifacts"
+
+# Disk budget in GB, 0 disables the cache
+DEFAULT_MAX_SIZE_GB = 50
+
+
+class ArtifactCache:
+    """The cache directory holds:
+    - objects/<sha256>/: an extracted artifact, with read-only files,
+    - objects/<sha256>.json: its size, S3 keys and the fingerprint of its files, its mtime is
+      when it was last used,
+    - names/<hash of key and ETag>: the SHA-256 of the artifact with that key and ETag,
+    - locks/: lock files, so concurrent jobs fetch each artifact once.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_DIR, max_size=DEFAULT_MAX_SIZE_GB * 1024 ** 3):
+        self.path = Path(path)
+        self.max_size = max_size
+        self.objects_dir = self.path / "objects"
+        self.names_dir = self.path / "names"
+        self.locks_dir = self.path / "locks"
+        for directory in (self.objects_dir, self.names_dir, self.locks_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+
+    @classmethod
+    def from_env(cls):
+        """Get the cache configured by ARTIFACT_CACHE_DIR and ARTIFACT_CACHE_MAX_GB, or None if it is disabled"""
+        cache_dir = os.environ.get("ARTIFACT_CACHE_DIR")
+        max_size_gb = float(os.environ.get("ARTIFACT_CACHE_MAX_GB", DEFAULT_MAX_SIZE_GB))
+        if not cache_dir or max_size_gb <= 0:
+            return None
+        return cls(cache_dir, int(max_size_gb * 1024 ** 3))
+
+    @contextlib.contextmanager
+    def _locked(self, name):
+        with open(self.locks_dir / name, 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _name_path(self, info):
+        # The ETag changes whenever the artifact is uploaded again
+        return self.names_dir / hashlib.sha256(f"{info.key}\0{info.etag}".encode()).hexdigest()
+
+    def lookup(self, info):
+        """Get the SHA-256 of a resolved artifact if it is in the cache, or None"""
+        try:
+            sha256 = self._name_path(info).read_text().strip()
+        except FileNotFoundError:
+            return None
+        return sha256 if (self.objects_dir / sha256).is_dir() else None
+
+    @staticmethod
+    def _get_fingerprint(path):
+        """Hash the names, sizes, modes and modification times of the files under path"""
+        digest = hashlib.sha256()
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                file_path = Path(root, name)
+                st = file_path.lstat()
+                digest.update(f"{file_path.relative_to(path)}\0{st.st_size}\0{st.st_mode}\0"
+                              f"{st.st_mtime_ns}\n".encode())
+        return digest.hexdigest()
+
+    def _is_intact(self, sha256):
+        """Check that the files of a cached artifact weren't changed through a view"""
+        try:
+            metadata = json.loads((self.objects_dir / f"{sha256}.json").read_text())
+        except FileNotFoundError:
+            return False
+        return metadata.get("fingerprint") == self._get_fingerprint(self.objects_dir / sha256)
+
+    def _insert(self, transfer, info, dest_dir):
+        """Download and extract an artifact into the cache, link it into dest_dir, and return
+        its SHA-256"""
+        tmp_dir = Path(tempfile.mkdtemp(prefix="tmp-", dir=self.objects_dir))
+        try:
+            info = transfer.extract_object(info, tmp_dir)
+            size = 0
+            for root, _, files in os.walk(tmp_dir):
+                for name in files:
+                    path = Path(root, name)
+                    if not path.is_symlink():
+                        mode = path.stat().st_mode
+                        # Files are shared by hardlinks, so they must not be changed
+                        path.chmod(mode & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+                        size += path.stat().st_size
+            fingerprint = self._get_fingerprint(tmp_dir)
+
+            with self._locked("index"):
+                object_dir = self.objects_dir / info.sha256
+                metadata_path = self.objects_dir / f"{info.sha256}.json"
+                metadata = json.loads(metadata_path.read_text()) if metadata_path.exists() else {"keys": []}
+                if object_dir.exists() and metadata.get("fingerprint"):
+                    # Another artifact name had the same content
+                    shutil.rmtree(tmp_dir)
+                else:
+                    if object_dir.exists():
+                        shutil.rmtree(object_dir)
+                    tmp_dir.rename(object_dir)
+                    metadata["fingerprint"] = fingerprint
+                metadata["size"] = size
+                metadata["keys"] = sorted(set(metadata["keys"]) | {info.key})
+                metadata_path.write_text(json.dumps(metadata, indent=2))
+                self._name_path(info).write_text(info.sha256)
+                self._use_locked(info.sha256, dest_dir)
+        finally:
+            if tmp_dir.exists():
+                shutil.rmtree(tmp_dir)
+        logger.info(f"Cached {info.key} as {info.sha256} ({size // 1024 ** 2} MB)")
+        return info.sha256
+
+    def fetch(self, transfer, name, dest_dir):
+        """Make the artifact with the given name, following pointers, available in dest_dir.
+
+        The artifact is downloaded into the cache unless it is there already, and dest_dir
+        gets read-only hardlinks to it. Returns the ObjectInfo of the artifact.
+        """
+        info = transfer.resolve(name)
+        with self._locked(self._name_path(info).name):
+            # Other jobs evict artifacts under the index lock, so check and link the cached
+            # artifact under it too
+            with self._locked("index"):
+                sha256 = self.lookup(info)
+                if sha256 is not None and not self._is_intact(sha256):
+                    logger.warning(f"Cached {info.key} ({sha256}) was changed, fetching it again")
+                    self._remove_locked(sha256)
+                    sha256 = None
+                if sha256 is not None:
+                    logger.info(f"Using cached {info.key} ({sha256})")
+                    self._use_locked(sha256, dest_dir)
+            if sha256 is None:
+                sha256 = self._insert(transfer, info, dest_dir)
+        return info._replace(sha256=sha256)
+
+    def _use_locked(self, sha256, dest_dir):
+        # Mark it as used before evicting, and link it while it cannot be evicted
+        os.utime(self.objects_dir / f"{sha256}.json")
+        self._evict_locked(keep=sha256)
+        self._link_tree(self.objects_dir / sha256, Path(dest_dir))
+
+    def evict(self):
+        """Remove the least recently used artifacts until the cache fits in its budget"""
+        with self._locked("index"):
+            self._evict_locked()
+
+    def _evict_locked(self, keep=None):
+        entries = []
+        for metadata_path in self.objects_dir.glob("*.json"):
+            metadata = json.loads(metadata_path.read_text())
+            entries.append((metadata_path.stat().st_mtime, metadata_path.stem, metadata["size"]))
+        total_size = sum(size for _, _, size in entries)
+
+        for _, sha256, size in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            if sha256 == keep:
+                continue
+            logger.info(f"Evicting {sha256} ({size // 1024 ** 2} MB) from the artifact cache")
+            self._remove_locked(sha256)
+            total_size -= size
+
+        # Forget the names of evicted artifacts
+        for name_path in self.names_dir.iterdir():
+            if not (self.objects_dir / name_path.read_text().strip()).is_dir():
+                name_path.unlink()
+
+    def _remove_locked(self, sha256):
+        (self.objects_dir / f"{sha256}.json").unlink(missing_ok=True)
+        shutil.rmtree(self.objects_dir / sha256, ignore_errors=True)
+
+    @staticmethod
+    def _link_tree(src, dest):
+        """Recreate the directories of src in dest, with hardlinks to its files"""
+        for root, dirs, files in os.walk(src):
+            target = dest / Path(root).relative_to(src)
+            target.mkdir(parents=True, exist_ok=True)
+            for name in files + [name for name in dirs if Path(root, name).is_symlink()]:
+                path = Path(root, name)
+                # Replace rather than write to existing files, which may be links into the cache
+                if (target / name).is_symlink() or (target / name).exists():
+                    (target / name).unlink()
+                if path.is_symlink():
+                    os.symlink(os.readlink(path), target / name)
+                    continue
+                try:
+                    os.link(path, target / name)
+                except OSError:
+                    # E.g. the cache is on another file system
+                    shutil.copy2(path, target / name)
+
+
+def fetch_artifact(s3_bucket, name, dest_dir):
+    """Make an artifact available in dest_dir, through the machine's artifact cache unless it is
+    disabled. Returns the ObjectInfo of the artifact."""
+    transfer = ArtifactTransfer(s3_bucket)
+    cache = ArtifactCache.from_env()
+    if cache is None:
+        return transfer.extract(name, dest_dir)
+    return cache.fetch(transfer, name, dest_dir)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Manage the artifact cache of this machine')
+    parser.add_argument('--cache-dir', default=os.environ.get("ARTIFACT_CACHE_DIR") or DEFAULT_CACHE_DIR,
+                        help='Cache directory')
+    parser.add_argument('--max-size-gb', type=float,
+                        default=float(os.environ.get("ARTIFACT_CACHE_MAX_GB", DEFAULT_MAX_SIZE_GB)),
+                        help='Disk budget of the cache in GB')
+    parser.add_argument('command', choices=['list', 'evict'])
+    args = parser.parse_args()
+
+    cache = ArtifactCache(args.cache_dir, int(args.max_size_gb * 1024 ** 3))
+    if args.command == 'evict':
+        cache.evict()
+    for metadata_path in sorted(cache.objects_dir.glob("*.json"), key=lambda path: path.stat().st_mtime):
+        metadata = json.loads(metadata_path.read_text())
+        last_used = time.strftime('%Y-%m-%d %H:%M', time.localtime(metadata_path.stat().st_mtime))
+        print(f"{metadata_path.stem} {metadata['size'] // 1024 ** 2:>8} MB  {last_used}  {' '.join(metadata['keys'])}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
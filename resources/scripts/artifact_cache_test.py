@@ -0,0 +1,116 @@
+import hashlib
+import os
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import artifact_cache
+from artifact_transfer import ObjectInfo
+
+
+class FakeTransfer:
+    """Stands in for ArtifactTransfer, serving artifacts made of a single file"""
+
+    def __init__(self, artifacts):
+        # Artifact name to content of its bin/clang
+        self.artifacts = artifacts
+        self.extracted = []
+
+    def resolve(self, name):
+        content = self.artifacts[name]
+        return ObjectInfo(name, f"clangci/{name}", len(content),
+                          hashlib.md5(content).hexdigest(), True, None, None)
+
+    def extract_object(self, info, dest_dir):
+        self.extracted.append(info.name)
+        content = self.artifacts[info.name]
+        (Path(dest_dir) / "bin").mkdir(parents=True)
+        (Path(dest_dir) / "bin" / "clang").write_bytes(content)
+        return info._replace(sha256=hashlib.sha256(content).hexdigest())
+
+
+class ArtifactCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.workdir.name)
+        self.transfer = FakeTransfer({"a": b"a" * 100, "b": b"b" * 100, "a-copy": b"a" * 100})
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def make_cache(self, max_size=1000):
+        return artifact_cache.ArtifactCache(self.path / "cache", max_size)
+
+    def test_hit_and_miss(self):
+        cache = self.make_cache()
+        info = cache.fetch(self.transfer, "a", self.path / "view1")
+        self.assertEqual(info.sha256, hashlib.sha256(b"a" * 100).hexdigest())
+        cache.fetch(self.transfer, "a", self.path / "view2")
+        self.assertEqual(self.transfer.extracted, ["a"])
+        # The views share the cached, read-only files.
+        view1, view2 = (self.path / view / "bin" / "clang" for view in ("view1", "view2"))
+        self.assertEqual(view1.stat().st_ino, view2.stat().st_ino)
+        self.assertEqual(view1.stat().st_mode & 0o222, 0)
+
+        # Artifacts with the same content are stored once.
+        cache.fetch(self.transfer, "a-copy", self.path / "view3")
+        self.assertEqual(self.transfer.extracted, ["a", "a-copy"])
+        self.assertEqual(len(list(cache.objects_dir.glob("*.json"))), 1)
+
+    def test_modified_view(self):
+        cache = self.make_cache()
+        cache.fetch(self.transfer, "a", self.path / "view1")
+        path = self.path / "view1" / "bin" / "clang"
+        path.chmod(0o644)
+        with open(path, "ab") as f:
+            f.write(b"modified")
+
+        cache.fetch(self.transfer, "a", self.path / "view2")
+        self.assertEqual(self.transfer.extracted, ["a", "a"])
+        self.assertEqual((self.path / "view2" / "bin" / "clang").read_bytes(), b"a" * 100)
+
+    def test_vanished_object(self):
+        cache = self.make_cache()
+        cache.fetch(self.transfer, "a", self.path / "view1")
+        # E.g. another job evicted it
+        cache.max_size = 0
+        cache.evict()
+        self.assertEqual(list(cache.objects_dir.iterdir()), [])
+        cache.max_size = 1000
+        cache.fetch(self.transfer, "a", self.path / "view2")
+        self.assertEqual(self.transfer.extracted, ["a", "a"])
+
+    def test_eviction(self):
+        cache = self.make_cache(max_size=150)
+        sha256_a = cache.fetch(self.transfer, "a", self.path / "view1").sha256
+        sha256_b = cache.fetch(self.transfer, "b", self.path / "view2").sha256
+        # The least recently used artifact is evicted, the one just fetched is kept.
+        self.assertFalse((cache.objects_dir / sha256_a).exists())
+        self.assertTrue((cache.objects_dir / sha256_b).exists())
+        # Views of evicted artifacts stay intact.
+        self.assertEqual((self.path / "view1" / "bin" / "clang").read_bytes(), b"a" * 100)
+
+        # The names of evicted artifacts are forgotten.
+        self.assertIsNone(cache.lookup(self.transfer.resolve("a")))
+        self.assertEqual(cache.lookup(self.transfer.resolve("b")), sha256_b)
+        self.assertEqual(len(os.listdir(cache.names_dir)), 1)
+
+        # An artifact larger than the budget is still kept while it is used.
+        cache.max_size = 50
+        cache.fetch(self.transfer, "a", self.path / "view3")
+        self.assertFalse((cache.objects_dir / sha256_b).exists())
+        self.assertTrue((cache.objects_dir / sha256_a).exists())
+
+    def test_from_env(self):
+        environ = {key: value for key, value in os.environ.items() if not key.startswith("ARTIFACT_CACHE_")}
+        with mock.patch.dict(os.environ, environ, clear=True):
+            self.assertIsNone(artifact_cache.ArtifactCache.from_env())
+            os.environ["ARTIFACT_CACHE_DIR"] = str(self.path / "cache")
+            self.assertEqual(artifact_cache.ArtifactCache.from_env().path, self.path / "cache")
+            os.environ["ARTIFACT_CACHE_MAX_GB"] = "0"
+            self.assertIsNone(artifact_cache.ArtifactCache.from_env())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -13,6 +13,9 @@ import logging
 import shutil
 from pathlib import Path
 
+from artifact_cache import fetch_artifact
+from artifact_package import EXTENSIONS
+
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -72,57 +75,52 @@ class ArtifactManager:
     def construct_artifact_names(job_name, git_distance, git_sha):
         """Construct mainline and bisection artifact names. In the case of
         a bisection job the artifact can come from either the mainline stage 1 job or the
-        bisection version of the stage 1 job, so we return two artifact names to check."""
-        tar_name = f"clang-d{git_distance}-g{git_sha}.tar.gz"
+        bisection version of the stage 1 job, so we return two lists of artifact names to check.
+        Each list has a name for each extension, since the artifact may have been packaged with
+        any codec."""
+        tar_names = [f"clang-d{git_distance}-g{git_sha}{extension}" for extension in EXTENSIONS]
 
         if "/bisect/" in job_name:
             mainline_job_name = job_name.replace("/bisect/", "/")
-            bisection_artifact = f"{job_name}/{tar_name}"
-            mainline_artifact = f"{mainline_job_name}/{tar_name}"
-            return mainline_artifact, bisection_artifact
+            bisection_artifacts = [f"{job_name}/{tar_name}" for tar_name in tar_names]
+            mainline_artifacts = [f"{mainline_job_name}/{tar_name}" for tar_name in tar_names]
+            return mainline_artifacts, bisection_artifacts
         else:
-            # Not a bisection job, so just return the mainline artifact name
-            return f"{job_name}/{tar_name}", None
+            # Not a bisection job, so just return the mainline artifact names
+            return [f"{job_name}/{tar_name}" for tar_name in tar_names], None
+
+    def fetch_any_artifact(self, artifact_names):
+        """Fetch the first of the artifacts that exists, and return its name or None"""
+        for artifact_name in artifact_names:
+            if self.fetch_artifact(artifact_name):
+                return artifact_name
+        return None
 
     def fetch_artifact(self, artifact_name):
         """Attempt to fetch a specific artifact."""
+        host_compiler_dir = self.workspace / "host-compiler"
         try:
             logger.info(f"Attempting to fetch artifact: {artifact_name}")
 
-            local_name = "host-compiler.tar.gz"
-
-            # Download the artifact from S3
-            download_cmd = ["aws", "s3", "cp", f"{self.s3_bucket}/clangci/{artifact_name}", local_name]
-            try:
-                self.run_cmd(self.workspace, download_cmd)
-            except subprocess.CalledProcessError:
-                logger.warning(f"Failed to fetch artifact: {artifact_name}")
-                return False
-
-            # Determine if the compiler package is actually a pointer to another file stored.
-            # If so, download the file at the pointer
-            if Path(local_name).stat().st_size < 1000:
-                logger.info("Artifact is a pointer file, following to actual artifact...")
-                with open(local_name, "r") as pointer:
-                    package = pointer.read().strip()
-                    download_cmd = ["aws", "s3", "cp", f"{self.s3_bucket}/clangci/{package}", local_name]
-                    self.run_cmd(self.workspace, download_cmd)
-
-            logger.info("Decompressing artifact...")
-            host_compiler_dir = self.workspace / "host-compiler"
-
             if host_compiler_dir.exists():
                 shutil.rmtree(host_compiler_dir)
 
-            host_compiler_dir.mkdir()
-            self.run_cmd(host_compiler_dir, ['tar', 'zxf', f"../{local_name}"])
-            os.unlink(local_name)
+            # Download the artifact from S3, following pointers to other artifacts,
+            # unless it is in the artifact cache of this machine already
+            fetch_artifact(self.s3_bucket, artifact_name, host_compiler_dir)
 
             logger.info(f"Successfully fetched and extracted artifact: {artifact_name}")
             return True
 
+        except subprocess.CalledProcessError as e:
+            logger.warning(f"Failed to fetch artifact: {artifact_name}: {e.stderr.strip()}")
+            if host_compiler_dir.exists():
+                shutil.rmtree(host_compiler_dir)
+            return False
         except Exception as e:
             logger.error(f"Error fetching artifact {artifact_name}: {e}")
+            if host_compiler_dir.exists():
+                shutil.rmtree(host_compiler_dir)
             return False
 
     def fetch_with_fallback(self, job_name, provided_artifact=None):
@@ -151,26 +149,28 @@ class ArtifactManager:
             # Try to download the artifact using the associated job name to find the artifact.
             # If it's a bisection job, we can check both the mainline build and the bisection build
             git_distance, git_sha = self.get_git_info()
-            mainline_artifact, bisection_artifact = ArtifactManager.construct_artifact_names(
+            mainline_artifacts, bisection_artifacts = ArtifactManager.construct_artifact_names(
                 job_name, git_distance, git_sha
             )
 
             # Try primary artifact first
-            if self.fetch_artifact(mainline_artifact):
+            mainline_artifact = self.fetch_any_artifact(mainline_artifacts)
+            if mainline_artifact:
                 return True, mainline_artifact, False
 
             # No primary artifact found and we're not checking for a bisection job, so return
-            if bisection_artifact is None:
-                return False, mainline_artifact, True
+            if bisection_artifacts is None:
+                return False, mainline_artifacts[0], True
 
             # Try bisection artifact as fallback
             logger.info("Primary artifact not found, trying to find bisection job artifact...")
-            if self.fetch_artifact(bisection_artifact):
+            bisection_artifact = self.fetch_any_artifact(bisection_artifacts)
+            if bisection_artifact:
                 return True, bisection_artifact, False
 
             # Neither found, we need stage 1 build
             logger.info("No artifacts found, stage 1 build needed")
-            return False, bisection_artifact, True
+            return False, bisection_artifacts[0], True
 
 
 def main():
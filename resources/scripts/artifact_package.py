@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Packaging of CI build artifacts.
+Archives a directory with tar, in a stable file order, and compresses it with a configurable
+codec, on all cores where the codec supports it. The codec is recorded in the properties
+file of the build, so consumers can pick the matching decompressor.
+"""
+
+import argparse
+import fnmatch
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# The compress command gets the level appended as -<level>
+Codec = namedtuple('Codec', ['name', 'extension', 'compress', 'decompress', 'default_level'])
+
+CODECS = {
+    'zstd': Codec('zstd', '.tar.zst', ['zstd', '-q', '-T0'], ['zstd', '-dc'], 9),
+    'pigz': Codec('pigz', '.tar.gz', ['pigz'], ['pigz', '-dc'], 6),
+    'gzip': Codec('gzip', '.tar.gz', ['gzip'], ['gzip', '-dc'], 6),
+    'pixz': Codec('pixz', '.tar.xz', ['pixz'], ['pixz', '-d'], 6),
+    'xz': Codec('xz', '.tar.xz', ['xz', '-T0'], ['xz', '-dc'], 6),
+}
+
+DEFAULT_CODEC = 'pigz'
+
+# The extensions packages can have, the one of the default codec first, so consumers
+# can look for an artifact whatever codec it was packaged with
+EXTENSIONS = list(dict.fromkeys([CODECS[DEFAULT_CODEC].extension] +
+                                [codec.extension for codec in CODECS.values()]))
+
+# Codecs to use instead when one is not installed, which produce the same format
+FALLBACKS = {
+    'pigz': 'gzip',
+    'pixz': 'xz',
+}
+
+# The .a's are big and we don't need them later. Drop the LLVM and clang
+# libraries, but keep the libraries from compiler-rt.
+DEFAULT_EXCLUDES = ['*libLLVM*.a', '*libclang[A-Z]*.a']
+
+PackageInfo = namedtuple('PackageInfo', ['path', 'codec', 'level', 'files', 'input_size', 'size', 'sha256',
+                                         'seconds'])
+
+
+class PackagingError(Exception):
+    pass
+
+
+def get_codec(name):
+    """Get the codec with the given name, or the one producing the same format if it is not installed"""
+    if name not in CODECS:
+        raise PackagingError(f"Unknown codec {name}, expected one of {', '.join(CODECS)}")
+    codec = CODECS[name]
+    if shutil.which(codec.compress[0]) is None:
+        if name not in FALLBACKS:
+            raise PackagingError(f"{codec.compress[0]} is not installed")
+        logger.warning(f"{codec.compress[0]} is not installed, using {FALLBACKS[name]} instead")
+        return get_codec(FALLBACKS[name])
+    return codec
+
+
+def list_files(src_dir, excludes=()):
+    """List the paths under src_dir in a stable order, each directory before its content,
+    leaving out those whose name matches one of the exclude patterns."""
+    paths = ['.']
+    input_size = 0
+    for root, dirs, files in os.walk(src_dir):
+        dirs[:] = sorted(name for name in dirs if not any(fnmatch.fnmatch(name, pattern) for pattern in excludes))
+        rel_root = Path(os.path.relpath(root, src_dir))
+        for name in sorted(dirs + files):
+            if any(fnmatch.fnmatch(name, pattern) for pattern in excludes):
+                continue
+            paths.append(f"./{rel_root / name}" if str(rel_root) != '.' else f"./{name}")
+            path = Path(root, name)
+            if not path.is_symlink() and path.is_file():
+                input_size += path.stat().st_size
+    return paths, input_size
+
+
+def package(src_dir, output, codec_name=DEFAULT_CODEC, level=None, excludes=DEFAULT_EXCLUDES, verbose=False):
+    """Archive the content of src_dir to output with the given codec, and return a PackageInfo.
+    With verbose, tar lists each file it archives."""
+    codec = get_codec(codec_name)
+    level = level if level is not None else codec.default_level
+    output = Path(output)
+    paths, input_size = list_files(src_dir, excludes)
+
+    start_time = time.time()
+    tmp_output = output.with_name(output.name + '.part')
+    with tempfile.NamedTemporaryFile('wb', prefix='package-', suffix='.list') as file_list:
+        file_list.write(b''.join(os.fsencode(path) + b'\0' for path in paths))
+        file_list.flush()
+        try:
+            with open(tmp_output, 'wb') as out:
+                tar = subprocess.Popen(['tar', '-cvf' if verbose else '-cf', '-', '--null', '--no-recursion',
+                                        '-T', file_list.name], cwd=src_dir, stdout=subprocess.PIPE)
+                compressor = subprocess.Popen(codec.compress + [f"-{level}"], stdin=tar.stdout, stdout=out)
+                tar.stdout.close()
+                compressor.wait()
+                tar.wait()
+            failed = [' '.join(process.args) for process in (tar, compressor) if process.returncode != 0]
+            if failed:
+                raise PackagingError(f"Packaging {src_dir} failed: {', '.join(failed)}")
+            os.replace(tmp_output, output)
+        finally:
+            if tmp_output.exists():
+                tmp_output.unlink()
+    seconds = time.time() - start_time
+
+    sha256 = hashlib.sha256()
+    with open(output, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha256.update(chunk)
+    info = PackageInfo(str(output), codec, level, len(paths), input_size, output.stat().st_size,
+                       sha256.hexdigest(), seconds)
+    logger.info(f"Packaged {info.files} files, {input_size // 1024 ** 2} MB, into {output.name}, "
+                f"{info.size // 1024 ** 2} MB, with {codec.name} -{level} in {seconds:.1f}s")
+    return info
+
+
+def write_properties(prop_fd, info):
+    """Write the codec of a package, and its checksum, to a properties file"""
+    prop_fd.write(f"ARTIFACT_CODEC={info.codec.name}\n")
+    prop_fd.write(f"ARTIFACT_DECOMPRESS={' '.join(info.codec.decompress)}\n")
+    prop_fd.write(f"ARTIFACT_SHA256={info.sha256}\n")
+    prop_fd.write(f"ARTIFACT_SIZE={info.size}\n")
+
+
+def benchmark(src_dir, codecs, excludes=DEFAULT_EXCLUDES):
+    """Package src_dir with each (codec name, level) and measure the size, and the time to
+    compress and decompress. Codecs that are not installed are skipped."""
+    results = []
+    with tempfile.TemporaryDirectory(prefix='package-benchmark-') as tmp_dir:
+        for codec_name, level in codecs:
+            if shutil.which(CODECS[codec_name].compress[0]) is None:
+                logger.warning(f"Skipping {codec_name}, it is not installed")
+                continue
+            info = package(src_dir, Path(tmp_dir, codec_name + CODECS[codec_name].extension), codec_name, level,
+                           excludes)
+            start_time = time.time()
+            with open(info.path, 'rb') as f:
+                subprocess.run(info.codec.decompress, stdin=f, stdout=subprocess.DEVNULL, check=True)
+            results.append({
+                'codec': codec_name,
+                'level': info.level,
+                'size': info.size,
+                'ratio': round(info.input_size / info.size, 2) if info.size else 0,
+                'compress_seconds': round(info.seconds, 2),
+                'decompress_seconds': round(time.time() - start_time, 2),
+            })
+            os.unlink(info.path)
+    return results
+
+
+def parse_codec(spec):
+    """Parse a codec given as name or name:level"""
+    name, _, level = spec.partition(':')
+    if name not in CODECS:
+        raise argparse.ArgumentTypeError(f"unknown codec {name}, expected one of {', '.join(CODECS)}")
+    return name, int(level) if level else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Package CI build artifacts')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    package_parser = subparsers.add_parser('package', help='Package a directory')
+    package_parser.add_argument('src_dir', help='Directory to package')
+    package_parser.add_argument('output', help='Package to write')
+    package_parser.add_argument('--codec', type=parse_codec, default=(DEFAULT_CODEC, None),
+                                help=f"Codec as name or name:level, one of {', '.join(CODECS)}")
+    package_parser.add_argument('--verbose', action='store_true', help='List the files as they are archived')
+
+    benchmark_parser = subparsers.add_parser('benchmark', help='Compare the size and time of codecs')
+    benchmark_parser.add_argument('src_dir', help='Directory to package')
+    benchmark_parser.add_argument('--codec', type=parse_codec, action='append', dest='codecs',
+                                  help='Codec as name or name:level (can be repeated, all codecs by default)')
+
+    for subparser in (package_parser, benchmark_parser):
+        subparser.add_argument('--exclude', action='append', help='Pattern of file names to leave out')
+    args = parser.parse_args()
+    excludes = args.exclude if args.exclude is not None else DEFAULT_EXCLUDES
+
+    try:
+        if args.command == 'package':
+            package(args.src_dir, args.output, args.codec[0], args.codec[1], excludes, args.verbose)
+        else:
+            codecs = args.codecs or [(name, None) for name in CODECS]
+            print(f"{'codec':<6} {'level':>5} {'size MB':>9} {'ratio':>6} {'compress s':>11} {'decompress s':>13}")
+            for result in benchmark(args.src_dir, codecs, excludes):
+                print(f"{result['codec']:<6} {result['level']:>5} {result['size'] / 1024 ** 2:>9.1f} "
+                      f"{result['ratio']:>6} {result['compress_seconds']:>11} {result['decompress_seconds']:>13}")
+    except (PackagingError, subprocess.CalledProcessError) as e:
+        logger.error(e)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    sys.exit(main())
@@ -0,0 +1,105 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import artifact_manager
+import artifact_package
+
+
+class ArtifactPackageTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.workdir.name)
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def write(self, name, size):
+        path = self.path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x" * size)
+
+    def test_list_files(self):
+        for name, size in [("lib/libLLVMSupport.a", 1000), ("lib/libclangAST.a", 1000),
+                           ("lib/clang/lib/libclang_rt.asan.a", 10), ("bin/clang", 20),
+                           ("bin/b", 1), ("include/llvm/a.h", 2)]:
+            self.write(name, size)
+        os.symlink("clang", self.path / "bin" / "clang++")
+        os.symlink("include", self.path / "headers")
+
+        paths, input_size = artifact_package.list_files(self.path, artifact_package.DEFAULT_EXCLUDES)
+        # Each directory comes before its content, in sorted order.
+        self.assertEqual(paths, [".", "./bin", "./headers", "./include", "./lib", "./bin/b", "./bin/clang",
+                                 "./bin/clang++", "./include/llvm", "./include/llvm/a.h", "./lib/clang",
+                                 "./lib/clang/lib", "./lib/clang/lib/libclang_rt.asan.a"])
+        # Symlinks aren't counted, or followed.
+        self.assertEqual(input_size, 33)
+
+        # Directories can be excluded too.
+        paths, input_size = artifact_package.list_files(self.path, ["lib"])
+        self.assertNotIn("./lib", paths)
+        self.assertNotIn("./lib/clang", paths)
+        self.assertEqual(input_size, 23)
+
+    def test_get_codec(self):
+        with mock.patch.object(shutil, "which", return_value="/usr/bin/tool"):
+            self.assertEqual(artifact_package.get_codec("pigz").name, "pigz")
+        with mock.patch.object(shutil, "which", side_effect=lambda name: None if name in ("pigz", "pixz", "zstd")
+                               else f"/usr/bin/{name}"):
+            self.assertEqual(artifact_package.get_codec("pigz").name, "gzip")
+            self.assertEqual(artifact_package.get_codec("pixz").name, "xz")
+            with self.assertRaisesRegex(artifact_package.PackagingError, "not installed"):
+                artifact_package.get_codec("zstd")
+        with self.assertRaisesRegex(artifact_package.PackagingError, "Unknown codec"):
+            artifact_package.get_codec("lz4")
+
+    def test_write_properties(self):
+        info = artifact_package.PackageInfo("clang.tar.zst", artifact_package.CODECS["zstd"], 9, 3, 100, 50,
+                                            "abc123", 1.5)
+        properties = io.StringIO()
+        artifact_package.write_properties(properties, info)
+        self.assertEqual(properties.getvalue(),
+                         "ARTIFACT_CODEC=zstd\nARTIFACT_DECOMPRESS=zstd -dc\n"
+                         "ARTIFACT_SHA256=abc123\nARTIFACT_SIZE=50\n")
+
+    @unittest.skipUnless(shutil.which("gzip"), "gzip is not installed")
+    def test_package(self):
+        self.write("src/bin/clang", 100)
+        info = artifact_package.package(self.path / "src", self.path / "clang.tar.gz", "gzip")
+        self.assertEqual(info.files, 3)
+        self.assertEqual(info.input_size, 100)
+        # The partial output is renamed into place.
+        self.assertEqual(sorted(os.listdir(self.path)), ["clang.tar.gz", "src"])
+
+
+class ArtifactManagerTest(unittest.TestCase):
+    def test_construct_artifact_names(self):
+        mainline, bisection = artifact_manager.ArtifactManager.construct_artifact_names(
+            "llvm.org/bisect/clang-stage1", "100", "abc")
+        self.assertEqual(mainline, ["llvm.org/clang-stage1/clang-d100-gabc.tar.gz",
+                                    "llvm.org/clang-stage1/clang-d100-gabc.tar.zst",
+                                    "llvm.org/clang-stage1/clang-d100-gabc.tar.xz"])
+        self.assertEqual(bisection[0], "llvm.org/bisect/clang-stage1/clang-d100-gabc.tar.gz")
+
+        mainline, bisection = artifact_manager.ArtifactManager.construct_artifact_names(
+            "llvm.org/clang-stage1", "100", "abc")
+        self.assertEqual(len(mainline), 3)
+        self.assertIsNone(bisection)
+
+    def test_fetch_with_fallback(self):
+        manager = artifact_manager.ArtifactManager("/workspace", "s3://bucket")
+        available = {"llvm.org/bisect/clang-stage1/clang-d100-gabc.tar.zst"}
+        with mock.patch.object(manager, "get_git_info", return_value=("100", "abc")), \
+                mock.patch.object(manager, "fetch_artifact", side_effect=available.__contains__):
+            self.assertEqual(manager.fetch_with_fallback("llvm.org/bisect/clang-stage1"),
+                             (True, "llvm.org/bisect/clang-stage1/clang-d100-gabc.tar.zst", False))
+            self.assertEqual(manager.fetch_with_fallback("llvm.org/clang-stage2"),
+                             (False, "llvm.org/clang-stage2/clang-d100-gabc.tar.gz", True))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Parallel, verified transfer of CI build artifacts from S3.
+Resolves pointer files, downloads artifacts as ranged parts in parallel and streams
+them through the matching decompressor into tar while the parts arrive.
+This is shared by artifact_manager.py, zorg/jenkins/monorepo_build.py and tasktool.
+"""
+
+import base64
+import concurrent.futures
+import contextlib
+import hashlib
+import itertools
+import json
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+from collections import namedtuple
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Artifacts smaller than this are pointers, holding the name of the actual artifact
+POINTER_MAX_SIZE = 1000
+
+# Size of each ranged request, and how many of them run at once
+PART_SIZE = 64 * 1024 * 1024
+MAX_PARALLEL_PARTS = 8
+
+CHUNK_SIZE = 1024 * 1024
+
+# An artifact as stored in S3. The ETag and SHA-256 checksum are those reported by
+# S3, etag_is_md5 tells whether the ETag is the MD5 of the content, sha256 is the
+# hex digest of the downloaded content.
+ObjectInfo = namedtuple('ObjectInfo', ['name', 'key', 'size', 'etag', 'etag_is_md5', 'checksum_sha256',
+                                       'sha256'])
+
+
+class TransferError(Exception):
+    pass
+
+
+def parse_s3_url(url):
+    """Split an s3://bucket/path URL into the bucket and the path"""
+    if not url or not url.startswith('s3://'):
+        raise TransferError(f"Not an S3 URL: {url}")
+    bucket, _, path = url[len('s3://'):].partition('/')
+    return bucket, path.strip('/')
+
+
+def get_decompressor(header):
+    """Get the command that decompresses a stream starting with header, or None if
+    the stream is not compressed. Parallel decompressors are used when available."""
+    if header.startswith(b'\x1f\x8b'):
+        return ['pigz', '-dc'] if shutil.which('pigz') else ['gzip', '-dc']
+    if header.startswith(b'\x28\xb5\x2f\xfd'):
+        return ['zstd', '-dc']
+    if header.startswith(b'\xfd7zXZ\x00'):
+        return ['pixz', '-d'] if shutil.which('pixz') else ['xz', '-dc']
+    if header.startswith(b'BZh'):
+        return ['pbzip2', '-dc'] if shutil.which('pbzip2') else ['bzip2', '-dc']
+    return None
+
+
+class VerifiedDownload:
+    """Iterate over the content of an artifact in order, in chunks.
+
+    The artifact is fetched as ranged parts in parallel, into a temporary directory.
+    Once all of it was read, its size and checksums are verified against S3.
+    """
+
+    def __init__(self, transfer, info, workdir=None):
+        self.transfer = transfer
+        self.info = info
+        self.workdir = workdir
+        self.size = 0
+        self.md5 = hashlib.md5()
+        self.sha256 = hashlib.sha256()
+
+    def _iter_parts(self, workdir):
+        ranges = [(start, min(start + self.transfer.part_size, self.info.size) - 1)
+                  for start in range(0, self.info.size, self.transfer.part_size)]
+        with concurrent.futures.ThreadPoolExecutor(self.transfer.max_parallel_parts) as executor:
+            futures = [executor.submit(self.transfer.download_part, self.info, start, end,
+                                       Path(workdir) / f"part{index}")
+                       for index, (start, end) in enumerate(ranges)]
+            try:
+                for future in futures:
+                    yield future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def __iter__(self):
+        with tempfile.TemporaryDirectory(prefix='artifact-', dir=self.workdir) as workdir:
+            # Wait for the downloads still running before the directory is removed
+            with contextlib.closing(self._iter_parts(workdir)) as parts:
+                for part in parts:
+                    with open(part, 'rb') as f:
+                        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                            self.md5.update(chunk)
+                            self.sha256.update(chunk)
+                            self.size += len(chunk)
+                            yield chunk
+                    os.unlink(part)
+        self.verify()
+
+    def verify(self):
+        if self.size != self.info.size:
+            raise TransferError(f"{self.info.key}: expected {self.info.size} bytes, got {self.size}")
+        if self.info.etag_is_md5 and self.md5.hexdigest() != self.info.etag:
+            raise TransferError(f"{self.info.key}: MD5 mismatch, expected {self.info.etag}, "
+                                f"got {self.md5.hexdigest()}")
+        checksum = base64.b64encode(self.sha256.digest()).decode()
+        if self.info.checksum_sha256 and '-' not in self.info.checksum_sha256 \
+                and checksum != self.info.checksum_sha256:
+            raise TransferError(f"{self.info.key}: SHA-256 mismatch, expected {self.info.checksum_sha256}, "
+                                f"got {checksum}")
+
+
+class ArtifactTransfer:
+    def __init__(self, s3_bucket, prefix='clangci', part_size=PART_SIZE,
+                 max_parallel_parts=MAX_PARALLEL_PARTS):
+        self.bucket, path = parse_s3_url(s3_bucket)
+        self.prefix = '/'.join(part for part in (path, prefix) if part)
+        self.part_size = part_size
+        self.max_parallel_parts = max_parallel_parts
+        # Whether the AWS CLI can get SHA-256 checksums
+        self.checksum_mode = True
+
+    def run_aws(self, args):
+        """Run an AWS CLI command and return its output"""
+        result = subprocess.run(['aws'] + args, capture_output=True, text=True, check=True)
+        return result.stdout
+
+    def head(self, name):
+        """Get the size and checksums of an artifact"""
+        key = f"{self.prefix}/{name}"
+        args = ['s3api', 'head-object', '--bucket', self.bucket, '--key', key]
+        metadata = None
+        if self.checksum_mode:
+            try:
+                # Getting the SHA-256 checksum needs AWS CLI 1.27.32 / 2.9.6 or later
+                metadata = json.loads(self.run_aws(args + ['--checksum-mode', 'ENABLED']))
+            except subprocess.CalledProcessError as e:
+                if 'checksum-mode' not in (e.stderr or ''):
+                    raise
+                logger.warning("This AWS CLI can't get SHA-256 checksums, upgrade it to verify downloads fully")
+                self.checksum_mode = False
+        if metadata is None:
+            metadata = json.loads(self.run_aws(args))
+        etag = metadata.get('ETag', '').strip('"')
+        # The ETag is the MD5 of the content, unless the artifact was uploaded in parts
+        # or is encrypted with KMS or a customer provided key
+        etag_is_md5 = bool(etag) and '-' not in etag \
+            and metadata.get('ServerSideEncryption') in (None, 'AES256') \
+            and 'SSECustomerAlgorithm' not in metadata
+        return ObjectInfo(name, key, metadata['ContentLength'], etag, etag_is_md5,
+                          metadata.get('ChecksumSHA256'), None)
+
+    def resolve(self, name):
+        """Get the artifact with the given name, following it if it is a pointer to another artifact"""
+        info = self.head(name)
+        if info.size < POINTER_MAX_SIZE:
+            target = self.run_aws(['s3', 'cp', f"s3://{self.bucket}/{info.key}", '-']).strip()
+            logger.info(f"Artifact {name} is a pointer to {target}")
+            info = self.head(target)
+        return info
+
+    def download_part(self, info, start, end, path):
+        """Download bytes start to end of an artifact to path"""
+        args = ['s3api', 'get-object', '--bucket', self.bucket, '--key', info.key,
+                '--range', f"bytes={start}-{end}"]
+        # Make sure all the parts come from the same upload of the artifact
+        if info.etag:
+            args += ['--if-match', f'"{info.etag}"']
+        self.run_aws(args + [str(path)])
+        return path
+
+    def download(self, name, path):
+        """Download an artifact to path, following pointers. Returns its ObjectInfo."""
+        path = Path(path)
+        download = VerifiedDownload(self, self.resolve(name), path.parent)
+        tmp_path = path.with_name(path.name + '.part')
+        try:
+            with open(tmp_path, 'wb') as f:
+                for chunk in download:
+                    f.write(chunk)
+            os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        return download.info._replace(sha256=download.sha256.hexdigest())
+
+    def extract(self, name, dest_dir):
+        """Download an artifact, following pointers, and extract it into dest_dir as it is downloaded.
+        Returns its ObjectInfo. If this fails, dest_dir may hold part of the artifact."""
+        return self.extract_object(self.resolve(name), dest_dir)
+
+    def extract_object(self, info, dest_dir):
+        """Like extract, for an artifact that was already resolved"""
+        dest_dir = Path(dest_dir)
+        dest_dir.mkdir(parents=True, exist_ok=True)
+        download = VerifiedDownload(self, info, dest_dir.parent)
+        chunks = iter(download)
+        # Pick the decompressor from the magic number at the start of the artifact
+        first_chunk = next(chunks, b'')
+        decompressor = get_decompressor(first_chunk)
+        logger.info(f"Extracting {download.info.key} with {decompressor[0] if decompressor else 'tar'}")
+
+        processes = []
+        if decompressor:
+            processes.append(subprocess.Popen(decompressor, stdin=subprocess.PIPE, stdout=subprocess.PIPE))
+            processes.append(subprocess.Popen(['tar', 'xf', '-'], cwd=dest_dir, stdin=processes[0].stdout))
+            processes[0].stdout.close()
+        else:
+            processes.append(subprocess.Popen(['tar', 'xf', '-'], cwd=dest_dir, stdin=subprocess.PIPE))
+
+        try:
+            try:
+                for chunk in itertools.chain([first_chunk], chunks):
+                    processes[0].stdin.write(chunk)
+            except BrokenPipeError:
+                # The decompressor or tar failed, which is reported below
+                pass
+            finally:
+                try:
+                    processes[0].stdin.close()
+                except BrokenPipeError:
+                    pass
+        except BaseException:
+            for process in processes:
+                process.kill()
+            raise
+        finally:
+            for process in processes:
+                process.wait()
+
+        failed = [' '.join(process.args) for process in processes if process.returncode != 0]
+        if failed:
+            raise TransferError(f"Extracting {download.info.key} failed: {', '.join(failed)}")
+        return download.info._replace(sha256=download.sha256.hexdigest())
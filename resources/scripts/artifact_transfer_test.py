@@ -0,0 +1,174 @@
+import base64
+import bz2
+import gzip
+import hashlib
+import io
+import json
+import lzma
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import artifact_transfer
+
+
+class FakeS3Transfer(artifact_transfer.ArtifactTransfer):
+    """Serves artifacts from memory instead of running the AWS CLI"""
+
+    def __init__(self, **kwargs):
+        super().__init__('s3://bucket', **kwargs)
+        # Key to (content, extra head-object metadata)
+        self.objects = {}
+        self.commands = []
+        self.old_cli = False
+
+    def put(self, name, content, **metadata):
+        self.objects[f"{self.prefix}/{name}"] = (content, metadata)
+
+    def run_aws(self, args):
+        self.commands.append(args)
+        if args[:2] == ['s3api', 'head-object']:
+            if self.old_cli and '--checksum-mode' in args:
+                raise subprocess.CalledProcessError(252, args, stderr="Unknown options: --checksum-mode, ENABLED")
+            key = args[args.index('--key') + 1]
+            if key not in self.objects:
+                raise subprocess.CalledProcessError(254, args, stderr="Not Found")
+            content, metadata = self.objects[key]
+            return json.dumps(dict({'ContentLength': len(content),
+                                    'ETag': f'"{hashlib.md5(content).hexdigest()}"'}, **metadata))
+        if args[:2] == ['s3', 'cp']:
+            return self.objects[args[2][len('s3://bucket/'):]][0].decode()
+        if args[:2] == ['s3api', 'get-object']:
+            content, _ = self.objects[args[args.index('--key') + 1]]
+            start, end = map(int, args[args.index('--range') + 1][len('bytes='):].split('-'))
+            # Finish the later parts first
+            time.sleep(0.01 / (1 + start // self.part_size))
+            Path(args[-1]).write_bytes(content[start:end + 1])
+            return '{}'
+        raise AssertionError(f"Unexpected command {args}")
+
+
+def make_tar(files):
+    data = io.BytesIO()
+    with tarfile.open(fileobj=data, mode='w') as archive:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            info.mode = 0o755
+            archive.addfile(info, io.BytesIO(content))
+    return data.getvalue()
+
+
+class ArtifactTransferTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.path = Path(self.workdir.name)
+        self.transfer = FakeS3Transfer(part_size=1000, max_parallel_parts=4)
+        self.content = os.urandom(5500)
+        self.tar = make_tar({'bin/clang': self.content})
+
+    def tearDown(self):
+        self.workdir.cleanup()
+
+    def test_pointer(self):
+        artifact = gzip.compress(self.tar)
+        self.transfer.put('job/clang-d1-gabc.tar.gz', artifact)
+        self.transfer.put('job/latest', b'job/clang-d1-gabc.tar.gz\n')
+        info = self.transfer.extract('job/latest', self.path / 'out')
+        self.assertEqual(info.key, 'clangci/job/clang-d1-gabc.tar.gz')
+        self.assertEqual(info.sha256, hashlib.sha256(artifact).hexdigest())
+        self.assertEqual((self.path / 'out' / 'bin' / 'clang').read_bytes(), self.content)
+
+    def test_download_parts(self):
+        content = os.urandom(10500)
+        self.transfer.put('job/artifact', content)
+        info = self.transfer.download('job/artifact', self.path / 'artifact')
+        self.assertEqual((self.path / 'artifact').read_bytes(), content)
+        self.assertEqual(info.sha256, hashlib.sha256(content).hexdigest())
+        ranges = [args[args.index('--range') + 1] for args in self.transfer.commands
+                  if args[:2] == ['s3api', 'get-object']]
+        self.assertEqual(len(ranges), 11)
+        self.assertIn('bytes=10000-10499', ranges)
+        # No part is left behind.
+        self.assertEqual(os.listdir(self.path), ['artifact'])
+
+    def test_get_decompressor(self):
+        with mock.patch.object(shutil, 'which', return_value=None):
+            self.assertEqual(artifact_transfer.get_decompressor(gzip.compress(b'')), ['gzip', '-dc'])
+            self.assertEqual(artifact_transfer.get_decompressor(lzma.compress(b'')), ['xz', '-dc'])
+            self.assertEqual(artifact_transfer.get_decompressor(bz2.compress(b'')), ['bzip2', '-dc'])
+        with mock.patch.object(shutil, 'which', return_value='/usr/bin/tool'):
+            self.assertEqual(artifact_transfer.get_decompressor(gzip.compress(b'')), ['pigz', '-dc'])
+            self.assertEqual(artifact_transfer.get_decompressor(lzma.compress(b'')), ['pixz', '-d'])
+            self.assertEqual(artifact_transfer.get_decompressor(bz2.compress(b'')), ['pbzip2', '-dc'])
+        self.assertEqual(artifact_transfer.get_decompressor(b'\x28\xb5\x2f\xfd\x00'), ['zstd', '-dc'])
+        self.assertIsNone(artifact_transfer.get_decompressor(self.tar))
+
+    def test_extract_codecs(self):
+        artifacts = {'plain.tar': self.tar, 'gzip.tar.gz': gzip.compress(self.tar),
+                     'xz.tar.xz': lzma.compress(self.tar), 'bzip2.tar.bz2': bz2.compress(self.tar)}
+        if shutil.which('zstd'):
+            artifacts['zstd.tar.zst'] = subprocess.run(['zstd', '-c'], input=self.tar, capture_output=True,
+                                                       check=True).stdout
+        for name, content in artifacts.items():
+            self.transfer.put(name, content)
+            info = self.transfer.extract(name, self.path / name)
+            self.assertEqual((self.path / name / 'bin' / 'clang').read_bytes(), self.content, name)
+            self.assertEqual(info.sha256, hashlib.sha256(content).hexdigest(), name)
+
+    def test_size_mismatch(self):
+        self.transfer.put('artifact.tar', self.tar)
+        info = self.transfer.resolve('artifact.tar')._replace(size=len(self.tar) + 1)
+        with self.assertRaisesRegex(artifact_transfer.TransferError, 'bytes'):
+            self.transfer.extract_object(info, self.path / 'out')
+
+    def test_md5_mismatch(self):
+        self.transfer.put('artifact.tar', self.tar, ETag='"0123456789abcdef0123456789abcdef"')
+        with self.assertRaisesRegex(artifact_transfer.TransferError, 'MD5 mismatch'):
+            self.transfer.extract('artifact.tar', self.path / 'out')
+
+    def test_sha256(self):
+        checksum = base64.b64encode(hashlib.sha256(self.tar).digest()).decode()
+        self.transfer.put('good.tar', self.tar, ChecksumSHA256=checksum)
+        self.transfer.extract('good.tar', self.path / 'good')
+
+        self.transfer.put('bad.tar', self.tar, ChecksumSHA256=base64.b64encode(b'x' * 32).decode())
+        with self.assertRaisesRegex(artifact_transfer.TransferError, 'SHA-256 mismatch'):
+            self.transfer.extract('bad.tar', self.path / 'bad')
+
+    def test_etag_is_md5(self):
+        other_etag = '"0123456789abcdef0123456789abcdef"'
+        cases = {'plain': ({}, True),
+                 'sse-s3': ({'ServerSideEncryption': 'AES256'}, True),
+                 'multipart': ({'ETag': '"0123456789abcdef0123456789abcdef-3"'}, False),
+                 'sse-kms': ({'ETag': other_etag, 'ServerSideEncryption': 'aws:kms'}, False),
+                 'sse-c': ({'ETag': other_etag, 'SSECustomerAlgorithm': 'AES256'}, False)}
+        for name, (metadata, etag_is_md5) in cases.items():
+            self.transfer.put(name, self.tar, **metadata)
+            self.assertEqual(self.transfer.head(name).etag_is_md5, etag_is_md5, name)
+            # ETags that aren't MD5s don't fail the verification
+            self.transfer.extract(name, self.path / name)
+
+    def test_old_cli(self):
+        self.transfer.old_cli = True
+        self.transfer.put('artifact.tar', self.tar)
+        with self.assertLogs(artifact_transfer.logger, 'WARNING'):
+            self.transfer.head('artifact.tar')
+        self.transfer.head('artifact.tar')
+        heads = [args for args in self.transfer.commands if args[:2] == ['s3api', 'head-object']]
+        # The option is only tried once.
+        self.assertEqual(['--checksum-mode' in args for args in heads], [True, False, False])
+
+    def test_missing(self):
+        with self.assertRaises(subprocess.CalledProcessError):
+            self.transfer.extract('missing.tar', self.path / 'out')
+
+
+if __name__ == "__main__":
+    unittest.main()
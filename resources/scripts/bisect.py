@@ -1,12 +1,58 @@
 #!/usr/bin/env python3
+import heapq
 import json
+import random
+import re
 import subprocess
 import sys
 import math
 import argparse
 from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Iterable
+
+
+class ArtifactIndex:
+    """Lists the commits that already have a compiler artifact
+
+    Artifacts are named clang-d{distance}-g{sha}.tar.gz, or .tar.zst or
+    .tar.xz depending on their codec, see artifact_package.py. Each location
+    is either an S3 prefix such as s3://bucket/clangci/job/, listed with the
+    AWS CLI, a local directory holding artifacts, or a file with one artifact
+    name per line.
+    """
+
+    NAME_PATTERN = re.compile(r'clang-d\d+-g([0-9a-f]+)\.tar\.(?:gz|zst|xz)')
+
+    def __init__(self, locations: Iterable[str]):
+        self.locations = list(locations)
+
+    def _list_names(self, location: str) -> List[str]:
+        if location.startswith('s3://'):
+            result = subprocess.run(['aws', 's3', 'ls', '--recursive', location],
+                                    capture_output=True, text=True, check=True)
+            return result.stdout.splitlines()
+        path = Path(location)
+        if path.is_dir():
+            return [str(artifact) for artifact in path.rglob('clang-*.tar.*')]
+        return path.read_text().splitlines()
+
+    def get_artifact_shas(self) -> set:
+        """Get the abbreviated SHAs of all the artifacts"""
+        shas = set()
+        for location in self.locations:
+            for name in self._list_names(location):
+                match = self.NAME_PATTERN.search(name)
+                if match:
+                    shas.add(match.group(1))
+        return shas
+
+    def find_commits(self, commits: List[str]) -> List[str]:
+        """Get the commits that have an artifact, in order"""
+        shas = self.get_artifact_shas()
+        lengths = {len(sha) for sha in shas}
+        return [commit for commit in commits
+                if any(commit[:length] in shas for length in lengths)]
 
 
 class BisectionManager:
@@ -14,8 +60,16 @@ class BisectionManager:
         self.workspace_dir = Path(workspace_dir)
         self.repo_path = Path(repo_path)
         self.state_file = self.workspace_dir / "bisection_state.json"
+        # Updates to the state are appended here, one JSON object per line, so
+        # results from parallel jobs never rewrite the whole state.
+        self.events_file = self.workspace_dir / "bisection_events.jsonl"
+        # The commits in the range, one per line, so the state stays small
+        self.commits_file = self.workspace_dir / "bisection_commits.txt"
         self.bisection_log = self.workspace_dir / "bisection.log"
         self.restart_log = self.workspace_dir / "restart_instructions.log"
+        self._commits = None
+        self._commit_positions = None
+        self._commit_info = {}
 
     def _print(self, message: str) -> None:
         """Print non-JSON output to stderr so it appears in CI logs"""
@@ -23,11 +77,20 @@ class BisectionManager:
 
     def initialize_bisection(self, good_commit: str, bad_commit: str,
                              test_job: Optional[str] = None, session_id: Optional[str] = None,
-                             verbose: bool = True) -> Dict[str, Any]:
-        """Initialize a new bisection session"""
+                             verbose: bool = True,
+                             artifact_index: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Initialize a new bisection session
+
+        If artifact index locations are given, each step tests the commit
+        nearest the midpoint that already has a compiler artifact, see
+        ArtifactIndex.
+        """
 
         # Get commit range
         commits = self._get_commit_range(good_commit, bad_commit)
+        self.commits_file.write_text("\n".join(commits) + "\n")
+        self._set_commits(commits, good_commit, bad_commit)
+        artifact_commits = ArtifactIndex(artifact_index).find_commits(commits[1:-1]) if artifact_index else []
         estimated_steps = math.ceil(math.log2(len(commits))) if len(commits) > 1 else 0
 
         state = {
@@ -37,10 +100,16 @@ class BisectionManager:
             "bad_commit": bad_commit,
             "current_good": good_commit,
             "current_bad": bad_commit,
-            "commits_to_test": commits[1:-1],  # Exclude the boundary commits
+            "commit_range": {
+                "index_file": self.commits_file.name,
+                "count": len(commits)
+            },
             "estimated_steps": estimated_steps,
             "completed_steps": 0,
             "test_results": {},
+            "in_flight": {},
+            "artifact_index": artifact_index or [],
+            "artifact_commits": artifact_commits,
             "start_time": datetime.now().isoformat(),
             "last_updated": datetime.now().isoformat(),
             "metadata": {
@@ -58,6 +127,9 @@ class BisectionManager:
         # Determine first commit to test
         self._update_next_action(state)
         self._save_state(state)
+        # Start a new event log for the new state
+        with open(self.events_file, 'w'):
+            pass
 
         if verbose:
             session_type = "CONTINUED" if session_id else "STARTED"
@@ -66,6 +138,8 @@ class BisectionManager:
                 self._print(f"Continuing session: {session_id}")
             self._print(f"Session ID: {state['session_id']}")
             self._print(f"Total commits in range: {len(commits)}, estimated {estimated_steps} steps")
+            if artifact_index:
+                self._print(f"Commits with existing artifacts: {len(artifact_commits)}")
 
             # Initialize log files
             self._initialize_logs(state, test_job, session_type)
@@ -87,6 +161,7 @@ class BisectionManager:
                 'type': 'test_commit',
                 'commit': state['next_action']['commit'],
                 'commit_info': state['next_action']['commit_info'],
+                'has_artifact': state['next_action'].get('has_artifact', False),
                 'progress': state['next_action']['progress'],
                 'bisection_range': state['next_action']['bisection_range'],
                 'session_id': state['session_id'],
@@ -206,39 +281,102 @@ Range: {step_info['bisection_range']['current_good']}..{step_info['bisection_ran
 
         state = self._load_state()
 
-        if not state.get("next_action") or state["next_action"].get("commit") != commit:
+        # Results of jobs started by dispatch_jobs can arrive in any order
+        dispatched = commit in state["in_flight"]
+        if not dispatched and (not state.get("next_action") or state["next_action"].get("commit") != commit):
             raise ValueError(f"Unexpected commit {commit}. Expected {state.get('next_action', {}).get('commit')}")
 
         # Normalize result to boolean (True = good, False = bad)
         is_good = result.upper() in ["SUCCESS", "PASSED", "STABLE", "GOOD", "TRUE"]
+        in_range = self._is_in_range(state, commit)
 
         # Record the result
-        state["test_results"][commit] = {
+        self._record_event(state, {
+            "type": "result",
+            "commit": commit,
             "result": result,
             "is_good": is_good,
-            "timestamp": datetime.now().isoformat(),
             "step_number": state["completed_steps"] + 1
-        }
-
-        state["completed_steps"] += 1
-        state["last_updated"] = datetime.now().isoformat()
+        })
 
-        # Update bisection boundaries based on result
-        if is_good:
+        # Report how the bisection boundaries were updated
+        if not in_range:
+            self._print(f"Commit {commit} is no longer in the bisection range, result recorded only")
+        elif is_good:
             # This commit is good, so the failure is in later commits
-            state["current_good"] = commit
             self._print(f"✅ Commit {commit} is GOOD - failure is in later commits")
         else:
             # This commit is bad, so the failure is in earlier commits
-            state["current_bad"] = commit
             self._print(f"❌ Commit {commit} is BAD - failure is in earlier commits")
 
         # Update what to test next
         self._update_next_action(state)
-        self._save_state(state)
 
         return state
 
+    def dispatch_jobs(self, jobs: int) -> Dict[str, Any]:
+        """Pick commits to test in parallel, at quantile points of the remaining range
+
+        Up to `jobs` commits are in flight at once. Jobs whose commits are no
+        longer in the bisection range are reported for cancellation, so their
+        slots can be reused. Call this again after each recorded result.
+        """
+        state = self._load_state()
+
+        # Cancel jobs made irrelevant by the results that came back
+        cancel = [commit for commit in state["in_flight"]
+                  if state["next_action"]["type"] == "complete" or not self._is_in_range(state, commit)]
+        for commit in cancel:
+            self._record_event(state, {"type": "cancel", "commit": commit})
+
+        if state["next_action"]["type"] == "complete":
+            return {
+                'type': 'complete',
+                'failing_commit': state['next_action']['failing_commit'],
+                'cancel': cancel
+            }
+
+        untested = self._get_untested_commits(state)
+        free_slots = jobs - len(state["in_flight"])
+        artifact_commits = set(state.get("artifact_commits", []))
+        commits = self._pick_quantile_commits(untested, set(state["in_flight"]), jobs,
+                                              artifact_commits)[:max(free_slots, 0)]
+        for commit in commits:
+            self._record_event(state, {"type": "dispatch", "commit": commit})
+        commit_infos = self._get_commit_infos(commits)
+
+        if commits:
+            self._print(f"Dispatching {len(commits)} test jobs, {len(state['in_flight'])} in flight, "
+                        f"{len(untested)} commits left in range")
+
+        return {
+            'type': 'dispatch',
+            'commits': [{'commit': commit,
+                         'commit_info': commit_infos[commit],
+                         'has_artifact': commit in artifact_commits}
+                        for commit in commits],
+            'cancel': cancel,
+            'in_flight': list(state["in_flight"]),
+            'bisection_range': {
+                'current_good': state['current_good'],
+                'current_bad': state['current_bad'],
+                'remaining_commits': len(untested)
+            },
+            'session_id': state['session_id']
+        }
+
+    def refresh_artifacts(self) -> Dict[str, Any]:
+        """Query the artifact index again, to pick up artifacts built since the bisection started"""
+        state = self._load_state()
+        if not state.get("artifact_index"):
+            raise ValueError("No artifact index was given when the bisection was initialized")
+
+        commits = ArtifactIndex(state["artifact_index"]).find_commits(self._get_commits(state)[1:-1])
+        self._record_event(state, {"type": "artifacts", "commits": commits})
+        self._update_next_action(state)
+        self._print(f"Commits with existing artifacts: {len(commits)}")
+        return state
+
     def generate_final_report(self) -> Dict[str, Any]:
         """Generate comprehensive final report"""
 
@@ -288,8 +426,10 @@ TEST RESULTS SUMMARY:
 """
 
         # Add test results to report
+        commit_infos = self._get_commit_infos(list(state['test_results']))
         for commit, result in state['test_results'].items():
-            report += f"- {commit}: {result['result']} (step {result['step_number']})\n"
+            report += (f"- {commit}: {result['result']} (step {result['step_number']}) "
+                       f"{commit_infos[commit]['subject']}\n")
 
         report += "\n=== END REPORT ===\n"
 
@@ -337,6 +477,67 @@ TEST RESULTS SUMMARY:
         return self._load_state()
 
     # Private helper methods
+    def _set_commits(self, commits: List[str], good_commit: str, bad_commit: str) -> None:
+        self._commits = commits
+        self._commit_positions = {commit: index for index, commit in enumerate(commits)}
+        # The boundaries may have been given by abbreviated SHA, branch, etc.
+        self._commit_positions[good_commit] = 0
+        self._commit_positions[bad_commit] = len(commits) - 1
+
+    def _get_commits(self, state: Dict[str, Any]) -> List[str]:
+        """Get the commits in the original range, boundaries included, from the index file"""
+        if self._commits is None:
+            if "commits_to_test" in state:
+                # State saved before the range was kept in an index file
+                commits = [state["good_commit"]] + state["commits_to_test"] + [state["bad_commit"]]
+            else:
+                commits = (self.workspace_dir / state["commit_range"]["index_file"]).read_text().split()
+            self._set_commits(commits, state["good_commit"], state["bad_commit"])
+        return self._commits
+
+    def _get_position(self, state: Dict[str, Any], commit: str) -> int:
+        """Get the position of a commit in the original range, or -1 if it is not in it"""
+        self._get_commits(state)
+        return self._commit_positions.get(commit, -1)
+
+    def _is_in_range(self, state: Dict[str, Any], commit: str) -> bool:
+        """Check whether a commit is strictly between the current good and bad commits"""
+        return (self._get_position(state, state["current_good"]) < self._get_position(state, commit)
+                < self._get_position(state, state["current_bad"]))
+
+    def _get_untested_commits(self, state: Dict[str, Any]) -> List[str]:
+        """Get the untested commits between the current good and bad commits, in order"""
+        commits = self._get_commits(state)[self._get_position(state, state["current_good"]) + 1:
+                                           self._get_position(state, state["current_bad"])]
+        return [commit for commit in commits if commit not in state["test_results"]]
+
+    @staticmethod
+    def _pick_quantile_commits(commits: List[str], busy: set, jobs: int,
+                               preferred: set = frozenset()) -> List[str]:
+        """Pick up to `jobs` commits that split the range into jobs + 1 even parts
+
+        Each pick is snapped to the nearest free commit that is preferred,
+        e.g. because it has an artifact already, if there is one within a
+        quarter of the distance between picks, so that the parts stay close
+        to even. Otherwise it is snapped to its nearest free neighbor. The
+        picks nearest the middle of the range come first, since they narrow
+        it down the most.
+        """
+        picks = []
+        middle = (len(commits) - 1) / 2
+        window = len(commits) // (4 * (jobs + 1))
+        targets = sorted({len(commits) * i // (jobs + 1) for i in range(1, jobs + 1)},
+                         key=lambda target: abs(target - middle))
+        for target in targets:
+            free = [index for index, commit in enumerate(commits)
+                    if commit not in busy and commit not in picks]
+            if not free:
+                break
+            free = [index for index in free
+                    if commits[index] in preferred and abs(index - target) <= window] or free
+            picks.append(commits[min(free, key=lambda index: (abs(index - target), index))])
+        return picks
+
     def _get_commit_range(self, good_commit: str, bad_commit: str) -> List[str]:
         """Get the list of commits between good and bad (inclusive)"""
         try:
@@ -344,46 +545,62 @@ TEST RESULTS SUMMARY:
                 "git", "rev-list", "--reverse", f"{good_commit}..{bad_commit}"
             ], cwd=self.repo_path, capture_output=True, text=True, check=True)
 
+            # The bad commit is the last one listed
             commits = [line.strip() for line in result.stdout.strip().split('\n') if line.strip()]
-            return [good_commit] + commits + [bad_commit]
+            return [good_commit] + commits
 
         except subprocess.CalledProcessError as e:
             raise RuntimeError(f"Failed to get commit range {good_commit}..{bad_commit}: {e}")
 
     def _get_commit_info(self, commit: str) -> Dict[str, str]:
         """Get basic information about a commit"""
-        try:
-            result = subprocess.run([
-                "git", "show", "-s", "--format=%an%x2C%ad%x2C%s", commit
-            ], cwd=self.repo_path, capture_output=True, text=True, check=True)
-
-            parts = result.stdout.strip().split(',', 2)
-            return {
-                "author": parts[0] if len(parts) > 0 else "Unknown",
-                "date": parts[1] if len(parts) > 1 else "Unknown",
-                "subject": parts[2] if len(parts) > 2 else "Unknown"
-            }
-        except subprocess.CalledProcessError:
-            return {
-                "author": "Unknown",
-                "date": "Unknown",
-                "subject": "Unknown"
-            }
+        return self._get_commit_infos([commit])[commit]
+
+    def _get_commit_infos(self, commits: List[str]) -> Dict[str, Dict[str, str]]:
+        """Get basic information about several commits with a single git log
+
+        The information is cached, so each commit is looked up only once.
+        """
+        missing = list(dict.fromkeys(commit for commit in commits if commit not in self._commit_info))
+        if missing:
+            try:
+                # --no-walk=unsorted prints the commits in the order given
+                result = subprocess.run([
+                    "git", "log", "--no-walk=unsorted", "--stdin", "--format=%H%x00%an%x00%ad%x00%s"
+                ], input="\n".join(missing) + "\n", cwd=self.repo_path, capture_output=True, text=True,
+                    check=True)
+
+                lines = result.stdout.splitlines()
+                for index, line in enumerate(lines):
+                    sha, author, date, subject = line.split('\0', 3)
+                    # Commits can be given by abbreviated SHA, tag, etc. but
+                    # git log lists a commit given twice only once
+                    keys = {sha}
+                    if len(lines) == len(missing):
+                        keys.add(missing[index])
+                    for key in keys:
+                        self._commit_info[key] = {
+                            "author": author,
+                            "date": date,
+                            "subject": subject
+                        }
+            except (subprocess.CalledProcessError, ValueError):
+                pass
+
+        unknown = {
+            "author": "Unknown",
+            "date": "Unknown",
+            "subject": "Unknown"
+        }
+        return {commit: self._commit_info.get(commit, unknown) for commit in commits}
 
     def _update_next_action(self, state: Dict[str, Any]) -> None:
         """Update the next_action field based on current bisection state"""
 
-        # Get commits between current good and bad
-        commits_in_range = self._get_commit_range(
-            state["current_good"],
-            state["current_bad"]
-        )
-
-        # Remove boundary commits and already tested commits
-        commits_to_test = []
-        for commit in commits_in_range[1:-1]:  # Exclude boundaries
-            if commit not in state["test_results"]:
-                commits_to_test.append(commit)
+        # Get the untested commits between current good and bad, boundaries excluded
+        commits_to_test = self._get_untested_commits(state)
+        commits_in_range = (self._get_position(state, state["current_bad"])
+                            - self._get_position(state, state["current_good"]) + 1)
 
         if len(commits_to_test) == 0:
             # Bisection is complete
@@ -395,8 +612,17 @@ TEST RESULTS SUMMARY:
             }
             return
 
-        # Find the midpoint commit to test next
+        # Find the midpoint commit to test next, or the commit nearest to it
+        # with an artifact, which saves building the compiler from source.
+        # Artifacts further than a quarter of the range from the midpoint are
+        # ignored, since testing them would narrow the range down too little.
         midpoint_index = len(commits_to_test) // 2
+        window = len(commits_to_test) // 4
+        artifact_commits = set(state.get("artifact_commits", []))
+        artifact_indices = [index for index, commit in enumerate(commits_to_test)
+                            if commit in artifact_commits and abs(index - midpoint_index) <= window]
+        if artifact_indices:
+            midpoint_index = min(artifact_indices, key=lambda index: (abs(index - midpoint_index), index))
         next_commit = commits_to_test[midpoint_index]
 
         # Calculate progress information
@@ -409,6 +635,7 @@ TEST RESULTS SUMMARY:
             "type": "test_commit",
             "commit": next_commit,
             "commit_info": self._get_commit_info(next_commit),
+            "has_artifact": next_commit in artifact_commits,
             "progress": {
                 "remaining_commits": remaining_commits,
                 "remaining_steps": remaining_steps,
@@ -419,7 +646,7 @@ TEST RESULTS SUMMARY:
             "bisection_range": {
                 "current_good": state["current_good"],
                 "current_bad": state["current_bad"],
-                "commits_in_range": len(commits_in_range)
+                "commits_in_range": commits_in_range
             }
         }
 
@@ -473,15 +700,70 @@ RESTART PARAMETERS:
         with open(self.state_file, 'w') as f:
             json.dump(state, f, indent=2)
 
+    def _record_event(self, state: Dict[str, Any], event: Dict[str, Any]) -> None:
+        """Append a state update to the event log and apply it to the state"""
+        event["timestamp"] = datetime.now().isoformat()
+        # A single write of a line to a file opened for appending is atomic,
+        # so concurrent jobs can record results at the same time.
+        with open(self.events_file, 'a') as f:
+            f.write(json.dumps(event) + "\n")
+        self._apply_event(state, event)
+
+    def _apply_event(self, state: Dict[str, Any], event: Dict[str, Any]) -> None:
+        """Apply a state update from the event log"""
+        commit = event.get("commit")
+        state["last_updated"] = event["timestamp"]
+
+        if event["type"] == "dispatch":
+            state["in_flight"][commit] = {"dispatched_at": event["timestamp"]}
+        elif event["type"] == "artifacts":
+            state["artifact_commits"] = event["commits"]
+        elif event["type"] == "cancel":
+            state["in_flight"].pop(commit, None)
+        elif event["type"] == "result":
+            state["in_flight"].pop(commit, None)
+            in_range = self._is_in_range(state, commit)
+            state["test_results"][commit] = {
+                "result": event["result"],
+                "is_good": event["is_good"],
+                "timestamp": event["timestamp"],
+                "step_number": event["step_number"]
+            }
+            state["completed_steps"] += 1
+
+            # Update bisection boundaries based on result
+            if in_range:
+                if event["is_good"]:
+                    state["current_good"] = commit
+                else:
+                    state["current_bad"] = commit
+        else:
+            raise ValueError(f"Unknown event type: {event['type']}")
+
     def _load_state(self) -> Dict[str, Any]:
-        """Load bisection state from file"""
+        """Load bisection state from file, with the updates from the event log applied"""
         try:
             with open(self.state_file, 'r') as f:
-                return json.load(f)
+                state = json.load(f)
         except FileNotFoundError:
             raise FileNotFoundError(f"State file not found: {self.state_file}")
         except json.JSONDecodeError as e:
             raise ValueError(f"Invalid JSON in state file {self.state_file}: {e}")
+        state.setdefault("in_flight", {})
+
+        events = []
+        if self.events_file.exists():
+            with open(self.events_file, 'r') as f:
+                for line in f:
+                    # Skip a line that is still being written
+                    if not line.endswith("\n"):
+                        break
+                    events.append(json.loads(line))
+        for event in events:
+            self._apply_event(state, event)
+        if events:
+            self._update_next_action(state)
+        return state
 
     def _append_to_log(self, log_file: Path, content: str) -> None:
         """Append content to a log file"""
@@ -489,6 +771,74 @@ RESTART PARAMETERS:
             f.write(content)
 
 
+class FakeJobRunner:
+    """Stands in for Jenkins or GitHub test jobs
+
+    Commits from `first_bad_commit` on fail, all others pass. Jobs take
+    `job_duration` seconds give or take `jitter`, in simulated time, so that
+    the orchestration can be tested and benchmarked locally in moments. Jobs
+    for commits without an artifact take `build_duration` seconds longer.
+    """
+
+    def __init__(self, commits: List[str], first_bad_commit: str, job_duration: float = 3600.0,
+                 jitter: float = 0.25, seed: int = 0, artifact_commits: Iterable[str] = (),
+                 build_duration: float = 0.0):
+        self.first_bad_index = commits.index(first_bad_commit)
+        self.order = {commit: index for index, commit in enumerate(commits)}
+        self.job_duration = job_duration
+        self.artifact_commits = set(artifact_commits)
+        self.build_duration = build_duration
+        self.jitter = jitter
+        self.random = random.Random(seed)
+        self.now = 0.0
+        self.running = []
+        self.jobs_started = 0
+        self.jobs_cancelled = 0
+        self.builds = 0
+
+    def start(self, commit: str) -> None:
+        duration = self.job_duration * (1 + self.random.uniform(-self.jitter, self.jitter))
+        if commit not in self.artifact_commits:
+            duration += self.build_duration
+            self.builds += 1
+        heapq.heappush(self.running, (self.now + duration, commit))
+        self.jobs_started += 1
+
+    def cancel(self, commit: str) -> None:
+        self.running = [job for job in self.running if job[1] != commit]
+        heapq.heapify(self.running)
+        self.jobs_cancelled += 1
+
+    def wait(self) -> tuple:
+        """Wait for the next job to finish and return its commit and result"""
+        self.now, commit = heapq.heappop(self.running)
+        result = "FAILURE" if self.order[commit] >= self.first_bad_index else "SUCCESS"
+        return commit, result
+
+
+def run_bisection(manager: BisectionManager, runner: FakeJobRunner, jobs: int) -> Dict[str, Any]:
+    """Run a whole bisection with a fake job runner, keeping up to `jobs` jobs in flight"""
+    while True:
+        dispatch = manager.dispatch_jobs(jobs)
+        for commit in dispatch['cancel']:
+            runner.cancel(commit)
+        if dispatch['type'] == 'complete':
+            break
+        for commit_info in dispatch['commits']:
+            runner.start(commit_info['commit'])
+        commit, result = runner.wait()
+        manager.record_test_result(commit, result)
+
+    return {
+        'failing_commit': dispatch['failing_commit'],
+        'jobs': jobs,
+        'jobs_started': runner.jobs_started,
+        'jobs_cancelled': runner.jobs_cancelled,
+        'compiler_builds': runner.builds,
+        'simulated_hours': round(runner.now / 3600, 2)
+    }
+
+
 def main():
     """Command line interface"""
     parser = argparse.ArgumentParser(description='Git Bisection Manager - CI bisection management')
@@ -505,6 +855,9 @@ def main():
     init_parser.add_argument('bad_commit', help='Known bad commit SHA')
     init_parser.add_argument('--test-job', help='Test job/workflow name')
     init_parser.add_argument('--session-id', help='Session ID for restart')
+    init_parser.add_argument('--artifact-index', action='append',
+                             help='S3 prefix, directory or listing file of compiler artifacts, '
+                                  'to prefer commits that have one (can be repeated)')
     add_common_args(init_parser)
 
     # Record result command (original interface)
@@ -531,6 +884,27 @@ def main():
     job_parser.add_argument('--build-number', help='Build number')
     add_common_args(job_parser)
 
+    dispatch_parser = subparsers.add_parser('dispatch', help='Pick commits to test in parallel jobs')
+    dispatch_parser.add_argument('--jobs', type=int, default=4, help='Maximum number of jobs in flight')
+    add_common_args(dispatch_parser)
+
+    simulate_parser = subparsers.add_parser('simulate', help='Run a bisection with fake jobs, to test and benchmark it')
+    simulate_parser.add_argument('good_commit', help='Known good commit SHA')
+    simulate_parser.add_argument('bad_commit', help='Known bad commit SHA')
+    simulate_parser.add_argument('first_bad_commit', help='Commit the fake jobs start failing at')
+    simulate_parser.add_argument('--jobs', type=int, default=4, help='Maximum number of jobs in flight')
+    simulate_parser.add_argument('--job-duration', type=float, default=3600.0,
+                                 help='Simulated duration of each job in seconds')
+    simulate_parser.add_argument('--seed', type=int, default=0, help='Seed for the job durations')
+    simulate_parser.add_argument('--artifact-index', action='append',
+                                 help='S3 prefix, directory or listing file of compiler artifacts (can be repeated)')
+    simulate_parser.add_argument('--build-duration', type=float, default=7200.0,
+                                 help='Simulated duration of a compiler build for commits without an artifact')
+    add_common_args(simulate_parser)
+
+    artifacts_parser = subparsers.add_parser('refresh-artifacts', help='Query the artifact index again')
+    add_common_args(artifacts_parser)
+
     report_parser = subparsers.add_parser('final-report', help='Generate final report')
     add_common_args(report_parser)
 
@@ -548,7 +922,8 @@ def main():
 
         if args.command == 'init':
             state = manager.initialize_bisection(
-                args.good_commit, args.bad_commit, args.test_job, args.session_id
+                args.good_commit, args.bad_commit, args.test_job, args.session_id,
+                artifact_index=args.artifact_index
             )
             print(json.dumps(state, indent=2))
 
@@ -569,6 +944,24 @@ def main():
                 args.job_url, args.build_number
             )
 
+        elif args.command == 'dispatch':
+            result = manager.dispatch_jobs(args.jobs)
+            print(json.dumps(result, indent=2))
+
+        elif args.command == 'simulate':
+            state = manager.initialize_bisection(args.good_commit, args.bad_commit, verbose=False,
+                                                 artifact_index=args.artifact_index)
+            commits = manager._get_commits(state)
+            runner = FakeJobRunner(commits, args.first_bad_commit, args.job_duration, seed=args.seed,
+                                   artifact_commits=state['artifact_commits'],
+                                   build_duration=args.build_duration)
+            result = run_bisection(manager, runner, args.jobs)
+            print(json.dumps(result, indent=2))
+
+        elif args.command == 'refresh-artifacts':
+            state = manager.refresh_artifacts()
+            print(json.dumps(state, indent=2))
+
         elif args.command == 'final-report':
             result = manager.generate_final_report()
             print(json.dumps(result, indent=2))
@@ -0,0 +1,144 @@
+import importlib.util
+import os
+import subprocess
+import tempfile
+import unittest
+from pathlib import Path
+
+# The standard library has a bisect module too, so load this one by path.
+_spec = importlib.util.spec_from_file_location(
+    "bisect_manager", Path(__file__).parent / "bisect.py")
+bisect_manager = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(bisect_manager)
+
+GIT_ENV = dict(os.environ,
+               GIT_AUTHOR_NAME="Test", GIT_AUTHOR_EMAIL="test@example.com",
+               GIT_COMMITTER_NAME="Test", GIT_COMMITTER_EMAIL="test@example.com")
+
+
+class BisectionManagerTest(unittest.TestCase):
+    def setUp(self):
+        self.repository_path = tempfile.TemporaryDirectory()
+        self.workspace_path = tempfile.TemporaryDirectory()
+        self.commits = self.setup_repository(20)
+
+    def tearDown(self):
+        self.repository_path.cleanup()
+        self.workspace_path.cleanup()
+
+    def git(self, *args: str) -> str:
+        return subprocess.run(["git", *args], cwd=self.repository_path.name, env=GIT_ENV,
+                              check=True, capture_output=True, text=True).stdout.strip()
+
+    def setup_repository(self, commit_count: int) -> list[str]:
+        self.git("init")
+        commits = []
+        for commit_index in range(commit_count):
+            self.git("commit", "--allow-empty", "-m", f"Commit {commit_index}")
+            commits.append(self.git("rev-parse", "HEAD"))
+        return commits
+
+    def make_manager(self):
+        return bisect_manager.BisectionManager(self.workspace_path.name,
+                                               self.repository_path.name)
+
+    def test_run_bisection(self):
+        for jobs in (1, 2, 3, 5):
+            for first_bad in range(1, len(self.commits)):
+                manager = self.make_manager()
+                state = manager.initialize_bisection(self.commits[0], self.commits[-1],
+                                                     verbose=False)
+                runner = bisect_manager.FakeJobRunner(manager._get_commits(state),
+                                                      self.commits[first_bad], seed=first_bad)
+                result = bisect_manager.run_bisection(manager, runner, jobs)
+                self.assertEqual(result["failing_commit"], self.commits[first_bad],
+                                 (jobs, first_bad))
+                # Every job was either waited for or cancelled.
+                self.assertEqual(runner.running, [], (jobs, first_bad))
+
+    def test_load_state_replays_events(self):
+        manager = self.make_manager()
+        manager.initialize_bisection(self.commits[0], self.commits[-1], verbose=False)
+        dispatch = manager.dispatch_jobs(3)
+        dispatched = [commit_info["commit"] for commit_info in dispatch["commits"]]
+        self.assertEqual(len(dispatched), 3)
+        # Results arrive out of order.
+        manager.record_test_result(dispatched[2], "FAILURE")
+        manager.record_test_result(dispatched[0], "SUCCESS")
+        expected = manager._load_state()
+
+        # A fresh manager, e.g. in another job, rebuilds the same state.
+        state = self.make_manager()._load_state()
+        for key in ("current_good", "current_bad", "test_results", "in_flight",
+                    "completed_steps", "next_action"):
+            self.assertEqual(state[key], expected[key], key)
+        self.assertEqual(list(state["in_flight"]), [dispatched[1]])
+        self.assertEqual(state["completed_steps"], 2)
+
+        # A line that is still being written is skipped.
+        with open(manager.events_file, "a") as events_file:
+            events_file.write('{"type": "result", "commit"')
+        state = self.make_manager()._load_state()
+        self.assertEqual(state["test_results"], expected["test_results"])
+
+    def test_artifact_snapping(self):
+        # 18 commits to test, the midpoint is the 10th one.
+        listing = Path(self.workspace_path.name) / "artifacts.txt"
+        manager = self.make_manager()
+
+        # An artifact near the midpoint is tested instead.
+        listing.write_text(f"clang-d8-g{self.commits[8][:12]}.tar.gz\n"
+                           f"clang-d2-g{self.commits[2][:12]}.tar.gz\n")
+        state = manager.initialize_bisection(self.commits[0], self.commits[-1],
+                                             verbose=False, artifact_index=[str(listing)])
+        self.assertEqual(state["next_action"]["commit"], self.commits[8])
+
+        # One far from it isn't.
+        listing.write_text(f"clang-d2-g{self.commits[2][:12]}.tar.gz\n")
+        state = manager.initialize_bisection(self.commits[0], self.commits[-1],
+                                             verbose=False, artifact_index=[str(listing)])
+        self.assertEqual(state["next_action"]["commit"], self.commits[10])
+
+    def test_get_commit_infos(self):
+        self.git("tag", "v3", self.commits[3])
+        commits = [self.commits[5][:10], "v3", "HEAD", self.commits[1]]
+        infos = self.make_manager()._get_commit_infos(commits)
+        self.assertEqual([infos[commit]["subject"] for commit in commits],
+                         ["Commit 5", "Commit 3", "Commit 19", "Commit 1"])
+        self.assertEqual(infos["v3"]["author"], "Test")
+
+        # Names of the same commit are listed once, so only the full SHA of
+        # the commit is known.
+        commits = [self.commits[2][:10], self.commits[2], self.commits[4]]
+        infos = self.make_manager()._get_commit_infos(commits + commits[:1])
+        self.assertEqual(list(infos), commits)
+        self.assertEqual(infos[self.commits[2][:10]]["subject"], "Unknown")
+        self.assertEqual(infos[self.commits[2]]["subject"], "Commit 2")
+        self.assertEqual(infos[self.commits[4]]["subject"], "Commit 4")
+
+        # So is everything if git fails.
+        infos = self.make_manager()._get_commit_infos(["no-such-commit", self.commits[1]])
+        self.assertEqual(infos[self.commits[1]]["date"], "Unknown")
+
+    def test_legacy_commits_to_test(self):
+        # State saved by older versions lists the commits instead of an index file.
+        state = {"good_commit": self.commits[0], "bad_commit": self.commits[-1],
+                 "commits_to_test": self.commits[1:-1], "current_good": self.commits[2],
+                 "current_bad": self.commits[8],
+                 "test_results": {self.commits[2]: "SUCCESS", self.commits[8]: "FAILURE"}}
+        manager = self.make_manager()
+        self.assertEqual(manager._get_commits(state), self.commits)
+        self.assertEqual(manager._get_untested_commits(state),
+                         self.commits[3:8])
+
+    def test_pick_quantile_commits(self):
+        commits = [str(index) for index in range(40)]
+        pick = bisect_manager.BisectionManager._pick_quantile_commits
+        self.assertEqual(pick(commits, set(), 3), ["20", "10", "30"])
+        # Preferred commits are picked only if they are near a target.
+        self.assertEqual(pick(commits, set(), 3, {"12", "25"}), ["20", "12", "30"])
+        self.assertEqual(pick(commits, set(), 1, {"12", "25"}), ["25"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -47,7 +47,7 @@ class ClangBuilder implements Serializable {
     def setupVenvStage() {
         script.withEnv(["PATH+EXTRA=/usr/bin:/usr/local/bin"]) {
             script.sh '''
-                rm -rf clang-*.tar.gz
+                rm -rf clang-*.tar.gz clang-*.tar.zst clang-*.tar.xz
                 rm -rf venv
                 python3 -m venv venv
                 set +u
@@ -116,8 +116,14 @@ class ClangBuilder implements Serializable {
                         cd -
                         ${stage1Mode ? 'echo "GIT_DISTANCE=\$GIT_DISTANCE" > build.properties' : ''}
                         ${stage1Mode ? 'echo "GIT_SHA=\$GIT_SHA" >> build.properties' : ''}
-                        echo "ARTIFACT=\$JOB_NAME/clang-d\$GIT_DISTANCE-g\$GIT_SHA.tar.gz" >> build.properties
-                        ${incremental ? '' : 'rm -rf clang-build clang-install *.tar.gz'}
+                        # The extension of the codec build.py packages with, see CODECS in artifact_package.py
+                        case "\${ARTIFACT_CODEC:-pigz}" in
+                            zstd) ARTIFACT_EXTENSION=.tar.zst ;;
+                            pixz|xz) ARTIFACT_EXTENSION=.tar.xz ;;
+                            *) ARTIFACT_EXTENSION=.tar.gz ;;
+                        esac
+                        echo "ARTIFACT=\$JOB_NAME/clang-d\$GIT_DISTANCE-g\$GIT_SHA\$ARTIFACT_EXTENSION" >> build.properties
+                        ${incremental ? '' : 'rm -rf clang-build clang-install *.tar.gz *.tar.zst *.tar.xz'}
                         ${buildCmd}
                     """
                 }
@@ -264,6 +270,6 @@ class ClangBuilder implements Serializable {
         if (!incremental) {
             script.sh "rm -rf clang-build clang-install"
         }
-        script.sh "rm -rf host-compiler *.tar.gz"
+        script.sh "rm -rf host-compiler *.tar.gz *.tar.zst *.tar.xz"
     }
 }
@@ -5,6 +5,8 @@ i.e.
 ARTIFACT={BUCKET}/clangci/subdir/buz.tar.gz
 '''
 import os
+import subprocess
+import sys
 from pathlib import Path
 from pipes import quote
 
@@ -21,11 +23,24 @@ def resolve_latest(config):
     pass
 
 
-def get_artifact(config, dest_dir):
-    url = config['url']
+def _import_artifact_cache():
+    '''
+    Import the artifact transfer layer shared with the Jenkins library
+    scripts, or return None if tasktool runs outside of the zorg checkout.
+    '''
+    parents = Path(__file__).resolve().parents
+    if len(parents) > 4:
+        scripts_dir = parents[4] / 'resources' / 'scripts'
+        if scripts_dir.is_dir() and str(scripts_dir) not in sys.path:
+            sys.path.append(str(scripts_dir))
+    try:
+        import artifact_cache
+    except ImportError:
+        return None
+    return artifact_cache
 
-    utils.check_call(['mkdir', '-p', dest_dir])
 
+def _get_artifact_with_cli(url, dest_dir):
     download_cmd = ["aws", "s3", "cp", f"{BUCKET}/clangci/{url}", 'artifact']
     utils.check_call(download_cmd, cwd=dest_dir)
 
@@ -43,5 +58,29 @@ def get_artifact(config, dest_dir):
     utils.check_call(untar_cmd, cwd=dest_dir)
 
 
+def get_artifact(config, dest_dir):
+    url = config['url']
+
+    utils.check_call(['mkdir', '-p', dest_dir])
+
+    artifact_cache = _import_artifact_cache()
+    if artifact_cache is None:
+        _get_artifact_with_cli(url, dest_dir)
+        return
+    from artifact_transfer import TransferError
+
+    # Follow the artifact if it is a pointer to another one, and download it
+    # unless it is in the artifact cache of this machine already.
+    try:
+        artifact_cache.fetch_artifact(BUCKET, url, dest_dir)
+    except subprocess.CalledProcessError as e:
+        sys.stderr.write("Error while fetching artifact %s: %s\n" % (url, e))
+        sys.stderr.write(e.stderr)
+        sys.exit(e.returncode)
+    except TransferError as e:
+        sys.stderr.write("Error while fetching artifact %s: %s\n" % (url, e))
+        sys.exit(1)
+
+
 def repro_arg(config, dest_dir):
     return '-a %s=%s' % (dest_dir, quote(config['url']))
\ No newline at end of file
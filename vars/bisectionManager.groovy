@@ -48,11 +48,14 @@ def call(Map params) {
 }
 
 def initializeBisection(String goodCommit, String badCommit, String testJob,
-                       String repoPath = '.', String sessionId = null) {
+                       String repoPath = '.', String sessionId = null, List artifactIndex = []) {
     def args = [goodCommit, badCommit, '--test-job', testJob]
     if (sessionId) {
         args.addAll(['--session-id', sessionId])
     }
+    artifactIndex.each { location ->
+        args.addAll(['--artifact-index', "'${location}'"])
+    }
 
     return bisectionManager([
         command: 'init',
@@ -102,6 +105,18 @@ def recordTestResult(String commit, String result, String repoPath = '.') {
     ])
 }
 
+// Helper for pipelines that test several commits at once, no pipeline in this
+// repository calls it yet. Call it after initializeBisection and after each
+// recordTestResult: start a test job for each of the returned commits, abort
+// the jobs for the commits in `cancel`, and stop once `type` is 'complete'.
+def dispatchJobs(int jobs, String repoPath = '.') {
+    return bisectionManager([
+        command: 'dispatch',
+        args: ['--jobs', jobs.toString()],
+        repoPath: repoPath
+    ])
+}
+
 def generateFinalReport(String repoPath = '.') {
     return bisectionManager([
         command: 'final-report',
@@ -1,6 +1,9 @@
 def call(Map config = [:]) {
     def pythonScript = libraryResource('scripts/artifact_manager.py')
     writeFile file: 'artifact_manager.py', text: pythonScript
+    writeFile file: 'artifact_transfer.py', text: libraryResource('scripts/artifact_transfer.py')
+    writeFile file: 'artifact_cache.py', text: libraryResource('scripts/artifact_cache.py')
+    writeFile file: 'artifact_package.py', text: libraryResource('scripts/artifact_package.py')
     sh 'chmod +x artifact_manager.py'
 
     withEnv(["PATH+EXTRA=/usr/bin:/usr/local/bin"]) {
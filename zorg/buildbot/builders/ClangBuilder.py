@@ -16,7 +16,7 @@ from zorg.buildbot.process.factory import LLVMBuildFactory
 
 def addGCSUploadSteps(f, package_name, install_prefix, gcs_directory, env,
                       gcs_url_property=None, use_pixz_compression=False,
-                      xz_compression_factor=6):
+                      xz_compression_factor=6, verbose_packaging=False):
     """
     Add steps to upload to the Google Cloud Storage bucket.
 
@@ -29,6 +29,7 @@ def addGCSUploadSteps(f, package_name, install_prefix, gcs_directory, env,
     env - The environment to use. Set BOTO_CONFIG to use a configuration file
           in a non-standard location, and BUCKET to use a different GCS bucket.
     gcs_url_property - Property to assign the GCS url to.
+    verbose_packaging - List every packaged file in the log.
     """
 
     gcs_url_fmt = ('gs://%(kw:gcs_bucket)s/%(kw:gcs_directory)s/'
@@ -49,12 +50,15 @@ def addGCSUploadSteps(f, package_name, install_prefix, gcs_directory, env,
                       command=['echo', gcs_url],
                       property=gcs_url_property))
 
+    tar_flags = '-cvf' if verbose_packaging else '-cf'
     if use_pixz_compression:
         # tweak the xz compression level to generate packages faster
-        tar_command = ['tar', '-Ipixz', '-cvf', output_file_name, '.']
+        tar_command = ['tar', '-Ipixz', tar_flags, output_file_name, '.']
     else:
-        xz_command = f'xz -{xz_compression_factor}'
-        tar_command = ['tar', '-I', xz_command, '-cvf', output_file_name, '.']
+        # Compress on all cores. This still produces .xz files, which
+        # llvmbisect can read.
+        xz_command = f'xz -T0 -{xz_compression_factor}'
+        tar_command = ['tar', '-I', xz_command, tar_flags, output_file_name, '.']
 
     f.addStep(ShellCommand(name='package ' + package_name,
                            command=tar_command,
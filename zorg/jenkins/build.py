@@ -11,7 +11,6 @@ import argparse
 import shutil
 import math
 import re
-from pathlib import Path
 
 import requests
 from contextlib import contextmanager
@@ -28,6 +27,10 @@ here = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.abspath(here + "/../../dep/"))
 import dep  # noqa
 
+# The artifact transfer layer is shared with the Jenkins library scripts. It
+# is only imported by the steps that use it.
+sys.path.append(os.path.abspath(here + "/../../resources/scripts/"))
+
 
 def readme_name(repo):
     """Given a repo, return the name of the readme file."""
@@ -830,27 +833,27 @@ def s3_upload_artifact(folder, artifact):
     run_cmd(conf.workspace, upload_cmd)
 
 def fetch_compiler():
-    local_name = "host-compiler.tar.gz"
     header("Fetching Compiler")
 
-    download_cmd = ["aws", "s3", "cp", f"{BUCKET}/clangci/{conf.artifact_url}", local_name]
-    run_cmd(conf.workspace, download_cmd)
-
-    # Determine if the compiler package is actually a pointer to another file stored.
-    # If so, download the file at the pointer
-    if Path(local_name).stat().st_size < 1000:
-        with open(local_name, "r") as pointer:
-            package = pointer.read().strip()
-            download_cmd = ["aws", "s3", "cp", f"{BUCKET}/clangci/{package}", local_name]
-            run_cmd(conf.workspace, download_cmd)
-
-    print("Decompressing...")
     if os.path.exists(conf.workspace + "/host-compiler"):
         shutil.rmtree(conf.workspace + "/host-compiler")
-    os.mkdir(conf.workspace + "/host-compiler")
-    run_cmd(conf.workspace + "/host-compiler/",
-            ['tar', 'zxf', "../" + local_name])
-    os.unlink(local_name)
+
+    import artifact_cache
+    import artifact_transfer
+
+    # Follow the artifact if it is a pointer to another one, and download it
+    # unless it is in the artifact cache of this machine already.
+    print("Fetching", conf.artifact_url, "...")
+    try:
+        info = artifact_cache.fetch_artifact(
+            BUCKET, conf.artifact_url, conf.workspace + "/host-compiler")
+    except (artifact_transfer.TransferError,
+            subprocess.CalledProcessError) as e:
+        print("Failed to fetch", conf.artifact_url + ":", e)
+        if isinstance(e, subprocess.CalledProcessError):
+            print(e.stderr)
+        sys.exit(1)
+    print("Fetched", info.key, "sha256", info.sha256)
     footer()
 
 def build_upload_artifact():
@@ -861,22 +864,38 @@ def build_upload_artifact():
     header("Uploading Artifact")
     prop_file = "last_good_build.properties"
 
-    artifact_name = "clang-d{}-g{}.tar.gz".format(conf.git_distance,
-                                                          conf.git_sha)
+    import artifact_package
+    codec = artifact_package.get_codec(conf.package_codec)
+    artifact_name = "clang-d{}-g{}{}".format(conf.git_distance,
+                                             conf.git_sha, codec.extension)
     new_url = conf.job_name + "/" + artifact_name
 
+    # The .a's are big and we don't need them later. Drop the LLVM and clang
+    # libraries, but keep the libraries from compiler-rt. The files are
+    # archived in a stable order, and listed only with --package-verbose.
+    print("Packaging", conf.installdir(), "to", artifact_name, "with",
+          codec.name)
+    info = None
+    if not os.environ.get('TESTING', False):
+        try:
+            info = artifact_package.package(
+                conf.installdir(), os.path.join(conf.workspace, artifact_name),
+                codec.name, conf.package_level,
+                artifact_package.DEFAULT_EXCLUDES, conf.package_verbose)
+        except artifact_package.PackagingError as e:
+            print(e)
+            sys.exit(1)
+        print("Packaged {} files into {} bytes in {:.1f}s".format(
+            info.files, info.size, info.seconds))
+
     with open(prop_file, 'w') as prop_fd:
         prop_fd.write("LLVM_REV={}\n".format(conf.svn_rev))
         prop_fd.write("GIT_DISTANCE={}\n".format(conf.git_distance))
         prop_fd.write("GIT_SHA={}\n".format(conf.git_sha))
         prop_fd.write("ARTIFACT={}\n".format(new_url))
-
-    # The .a's are big and we don't need them later. Drop the LLVM and clang
-    # libraries, but keep the libraries from compiler-rt.
-    tar = ["tar", "zcvf", "../" + artifact_name, "--exclude=*libLLVM*.a",
-           "--exclude=*libclang[A-Z]*.a", "."]
-
-    run_cmd(conf.installdir(), tar)
+        # Tells consumers which decompressor to use
+        if info:
+            artifact_package.write_properties(prop_fd, info)
 
     s3_upload_artifact(conf.job_name, artifact_name)
 
@@ -1050,6 +1069,8 @@ def print_machine_info():
 def parse_args():
     """Get the command line arguments, and make sure they are correct."""
 
+    import artifact_package
+
     parser = argparse.ArgumentParser(
         description='Build and test compilers and other things.')
 
@@ -1104,6 +1125,16 @@ def parse_args():
                         help='Individual test timeout in seconds.')
     parser.add_argument('--lldb-test-compiler',
                         help='The compiler used to build LLDB tests.')
+    parser.add_argument('--package-codec', dest='package_codec',
+                        default=os.environ.get('ARTIFACT_CODEC', artifact_package.DEFAULT_CODEC),
+                        choices=sorted(artifact_package.CODECS),
+                        help="Codec to compress the artifact with. The "
+                             "artifact name gets the codec's extension.")
+    parser.add_argument('--package-level', dest='package_level', type=int,
+                        help="Compression level, the codec's default if unset.")
+    parser.add_argument('--package-verbose', dest='package_verbose',
+                        action='store_true',
+                        help="List every file packaged into the artifact.")
     args = parser.parse_args()
     if args.thinlto:
         args.lto = True